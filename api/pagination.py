@@ -0,0 +1,33 @@
+from collections import OrderedDict
+from functools import partial
+
+from rest_framework.pagination import PageNumberPagination
+
+from core.pagination import EXACT_COUNT_PARAM, EstimatedCountPaginator, is_exact_count_requested
+
+
+class EstimatedCountPagination(PageNumberPagination):
+    """PageNumberPagination with estimated counts for large lists; ?exact_count=1 forces COUNT(*)"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        exact = is_exact_count_requested(request.query_params.get(EXACT_COUNT_PARAM)) or None
+        # Only an exact count can tell which page is the last one
+        if request.query_params.get(self.page_query_param) in self.last_page_strings:
+            exact = True
+        self.django_paginator_class = partial(EstimatedCountPaginator, exact=exact)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        items = list(response.data.items())
+        items.insert(1, ('count_is_estimate', self.page.paginator.estimated))
+        response.data = OrderedDict(items)
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        schema = super().get_paginated_response_schema(schema)
+        schema['properties']['count_is_estimate'] = {
+            'type': 'boolean',
+            'example': False,
+        }
+        return schema
@@ -0,0 +1,14 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from core import fastjson
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser using core.fastjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return fastjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {str(exc)}')
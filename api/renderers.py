@@ -0,0 +1,15 @@
+from rest_framework.renderers import JSONRenderer
+
+from core import fastjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer using core.fastjson; indented output still goes through the stdlib encoder"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        return fastjson.dumps(data, default=self.encoder_class().default)
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from core.models import Salon, Master, Service, Client, Appointment, Document, Post, Embedding
+from core.models import Salon, Master, Service, Client, Appointment, Document, Post, Embedding, IngestionJob
 
 User = get_user_model()
 
@@ -202,12 +202,34 @@ class PostSerializer(serializers.ModelSerializer):
         return value
 
 
+class IngestionJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = IngestionJob
+        fields = ['id', 'document', 'status', 'generation', 'total_chunks', 'processed_chunks',
+                 'progress', 'attempts', 'error_message', 'started_at', 'finished_at',
+                 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
 class EmbeddingSerializer(serializers.ModelSerializer):
     document = DocumentSerializer(read_only=True)
     document_id = serializers.UUIDField(write_only=True)
+    vector = serializers.SerializerMethodField()
 
     class Meta:
         model = Embedding
-        fields = ['id', 'document', 'document_id', 'content_chunk', 'embedding_vector', 
-                 'chunk_index', 'created_at']
-        read_only_fields = ['id', 'document', 'created_at'] 
\ No newline at end of file
+        fields = ['id', 'document', 'document_id', 'content_chunk', 'vector', 
+                 'vector_format', 'chunk_index', 'created_at']
+        read_only_fields = ['id', 'document', 'vector_format', 'created_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Vectors are large; only ship them when explicitly requested
+        if not self.context.get('include_vector'):
+            self.fields.pop('vector')
+
+    def get_vector(self, obj):
+        vector = obj.vector
+        return vector.tolist() if vector is not None else None 
\ No newline at end of file
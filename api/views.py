@@ -8,11 +8,13 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.db.models import Q
 
+from core.catalog import catalog_cache
 from core.models import Salon, Master, Service, Client, Appointment, Document, Post, Embedding
 from .serializers import (
     UserSerializer, UserCreateSerializer, UserProfileSerializer,
     SalonSerializer, MasterSerializer, ServiceSerializer, ClientSerializer,
-    AppointmentSerializer, DocumentSerializer, PostSerializer, EmbeddingSerializer
+    AppointmentSerializer, DocumentSerializer, PostSerializer, EmbeddingSerializer,
+    IngestionJobSerializer
 )
 from .permissions import IsOwnerOrReadOnly, IsSalonOwner
 
@@ -97,6 +99,13 @@ class SalonViewSet(viewsets.ModelViewSet):
         }
         return Response(stats)
 
+    @action(detail=True, methods=['get'])
+    def catalog(self, request, pk=None):
+        """Get salon profile with active services and masters (cached)"""
+        salon = self.get_object()
+        snapshot = catalog_cache.get(salon.id)
+        return Response(snapshot.as_dict())
+
 
 class MasterViewSet(viewsets.ModelViewSet):
     serializer_class = MasterSerializer
@@ -176,13 +185,35 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Appointment.objects.filter(salon__user=self.request.user)
 
+    def create(self, request, *args, **kwargs):
+        """Create appointment; a repeated Idempotency-Key header returns the first result"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = self.perform_create(serializer)
+        if not created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer):
+        """Create the appointment through create_idempotent; returns whether it is new"""
         salon_id = self.request.data.get('salon_id')
         salon = Salon.objects.get(id=salon_id, user=self.request.user)
         client = Client.objects.get(id=self.request.data.get('client_id'), salon=salon)
         service = Service.objects.get(id=self.request.data.get('service_id'), salon=salon)
         master = Master.objects.get(id=self.request.data.get('master_id'), salon=salon)
-        serializer.save(salon=salon, client=client, service=service, master=master)
+        key = self.request.headers.get('Idempotency-Key')
+        idempotency_key = Appointment.objects.make_idempotency_key('api', self.request.user.id, key) if key else None
+        fields = {
+            name: value for name, value in serializer.validated_data.items()
+            if name not in ('salon_id', 'client_id', 'service_id', 'master_id')
+        }
+        appointment, created = Appointment.objects.create_idempotent(
+            idempotency_key=idempotency_key,
+            salon=salon, client=client, service=service, master=master, **fields
+        )
+        serializer.instance = appointment
+        return created
 
     @action(detail=True, methods=['post'])
     def complete(self, request, pk=None):
@@ -228,12 +259,22 @@ class DocumentViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def generate_embeddings(self, request, pk=None):
-        """Generate embeddings for document"""
+        """Start or resume embedding generation for document"""
         document = self.get_object()
         # This will be handled by Celery task
-        from core.tasks import generate_document_embeddings
-        generate_document_embeddings.delay(document.id)
-        return Response({'status': 'embeddings_generation_started'})
+        from core.tasks import generate_document_embeddings, get_or_create_ingestion_job
+        job = get_or_create_ingestion_job(document)
+        if job.status == 'pending':
+            generate_document_embeddings.delay(document.id, job_id=job.id)
+        return Response(IngestionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def ingestion(self, request, pk=None):
+        """Get embedding generation jobs of document, latest first"""
+        document = self.get_object()
+        jobs = document.ingestion_jobs.all()[:10]
+        serializer = IngestionJobSerializer(jobs, many=True)
+        return Response(serializer.data)
 
 
 class PostViewSet(viewsets.ModelViewSet):
@@ -273,12 +314,24 @@ class EmbeddingViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['document', 'chunk_index']
 
     def get_queryset(self):
-        return Embedding.objects.filter(document__salon__user=self.request.user)
+        queryset = Embedding.objects.active().filter(document__salon__user=self.request.user)
+        if not self.include_vector():
+            queryset = queryset.defer('vector_data', 'embedding_vector')
+        return queryset
+
+    def include_vector(self):
+        """Vectors are returned for detail requests or with ?include_vector=1"""
+        return self.action == 'retrieve' or self.request.query_params.get('include_vector') in ('1', 'true')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['include_vector'] = self.include_vector()
+        return context
 
     @action(detail=False, methods=['post'])
     def search(self, request):
-        """Search embeddings by similarity"""
-        query = request.data.get('query')
+        """Hybrid full-text and vector search over salon documents"""
+        query = (request.data.get('query') or '').strip()
         salon_id = request.data.get('salon_id')
         
         if not query or not salon_id:
@@ -287,12 +340,32 @@ class EmbeddingViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # This would implement vector similarity search
-        # For now, return text-based search
-        embeddings = self.get_queryset().filter(
-            document__salon_id=salon_id,
-            content_chunk__icontains=query
-        )[:10]
+        salon = Salon.objects.filter(id=salon_id, user=request.user).select_related('user').first()
+        if salon is None:
+            return Response({'error': 'Salon not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            limit = min(max(int(request.data.get('limit', 10)), 1), 50)
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = self.get_serializer(embeddings, many=True)
-        return Response(serializer.data) 
\ No newline at end of file
+        from core.openai_clients import get_salon_api_key
+        from core.retrieval import retrieval_service
+        results = retrieval_service.search_sync(
+            salon.id,
+            query,
+            limit=limit,
+            openai_api_key=get_salon_api_key(salon),
+            doc_types=self._list_param(request.data.get('doc_type')),
+            tags=self._list_param(request.data.get('tags')),
+        )
+        return Response({'query': query, 'count': len(results), 'results': results})
+
+    @staticmethod
+    def _list_param(value):
+        """Accept both a list and a comma separated string"""
+        if not value:
+            return []
+        if isinstance(value, str):
+            return [item.strip() for item in value.split(',') if item.strip()]
+        return [str(item) for item in value]
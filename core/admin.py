@@ -1,6 +1,37 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Salon, Master, Service, Client, Appointment, Document, Post, Embedding
+from django.db.models.functions import Substr
+from django_celery_beat.admin import PeriodicTaskAdmin
+from .admin_filters import RelatedIDFilter
+from .instrumentation import request_task_profile
+from .pagination import EXACT_COUNT_PARAM, EstimatedCountPaginator, is_exact_count_requested
+from .models import User, Salon, Master, Service, Client, Appointment, Document, Post, Embedding, IngestionJob
+
+
+class SalonRelatedAdmin(admin.ModelAdmin):
+    """Admin of a model whose __str__ shows its salon's name, e.g. in autocomplete results"""
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('salon')
+
+
+class EstimatedCountAdmin(admin.ModelAdmin):
+    """Admin of a large table: estimated page counts, ?exact_count=1 for an exact COUNT(*)"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def changelist_view(self, request, extra_context=None):
+        # ChangeList would reject the toggle as an unknown field lookup
+        if EXACT_COUNT_PARAM in request.GET:
+            request.GET = request.GET.copy()
+            request.exact_count = is_exact_count_requested(request.GET.pop(EXACT_COUNT_PARAM)[-1])
+        return super().changelist_view(request, extra_context)
+    
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            exact=getattr(request, 'exact_count', None) or None,
+        )
 
 
 @admin.register(User)
@@ -21,7 +52,9 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(Salon)
 class SalonAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'phone', 'email', 'timezone', 'created_at')
-    list_filter = ('timezone', 'created_at', 'user')
+    list_filter = ('timezone', 'created_at', ('user', RelatedIDFilter))
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
     search_fields = ('name', 'address', 'phone', 'email')
     ordering = ('-created_at',)
     readonly_fields = ('created_at', 'updated_at')
@@ -41,9 +74,10 @@ class SalonAdmin(admin.ModelAdmin):
 
 
 @admin.register(Master)
-class MasterAdmin(admin.ModelAdmin):
+class MasterAdmin(SalonRelatedAdmin):
     list_display = ('full_name', 'salon', 'phone', 'specialization', 'is_active', 'created_at')
-    list_filter = ('is_active', 'specialization', 'salon', 'created_at')
+    list_filter = ('is_active', 'specialization', ('salon', RelatedIDFilter), 'created_at')
+    autocomplete_fields = ('salon',)
     search_fields = ('full_name', 'phone', 'specialization', 'telegram_id')
     ordering = ('salon', 'full_name')
     readonly_fields = ('created_at', 'updated_at')
@@ -63,9 +97,11 @@ class MasterAdmin(admin.ModelAdmin):
 
 
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
+class ServiceAdmin(SalonRelatedAdmin):
     list_display = ('name', 'salon', 'master', 'category', 'price', 'duration_minutes', 'is_active')
-    list_filter = ('category', 'is_active', 'salon', 'master', 'created_at')
+    list_filter = ('category', 'is_active', ('salon', RelatedIDFilter), ('master', RelatedIDFilter), 'created_at')
+    list_select_related = ('salon', 'master__salon')
+    autocomplete_fields = ('salon', 'master')
     search_fields = ('name', 'description')
     ordering = ('salon', 'category', 'name')
     readonly_fields = ('created_at', 'updated_at')
@@ -88,9 +124,10 @@ class ServiceAdmin(admin.ModelAdmin):
 
 
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(SalonRelatedAdmin, EstimatedCountAdmin):
     list_display = ('full_name', 'salon', 'phone', 'email', 'visits_count', 'total_spent', 'last_visit_date')
-    list_filter = ('salon', 'last_visit_date', 'created_at')
+    list_filter = (('salon', RelatedIDFilter), 'last_visit_date', 'created_at')
+    autocomplete_fields = ('salon',)
     search_fields = ('full_name', 'phone', 'email', 'telegram_id')
     ordering = ('salon', '-last_visit_date')
     readonly_fields = ('created_at', 'updated_at')
@@ -110,9 +147,15 @@ class ClientAdmin(admin.ModelAdmin):
 
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(EstimatedCountAdmin):
     list_display = ('client', 'service', 'master', 'scheduled_at', 'status', 'price')
-    list_filter = ('status', 'salon', 'master', 'service', 'scheduled_at', 'created_at')
+    list_filter = (
+        'status', ('salon', RelatedIDFilter), ('master', RelatedIDFilter), ('service', RelatedIDFilter),
+        'scheduled_at', 'created_at',
+    )
+    # client, service and master print their salon's name
+    list_select_related = ('client__salon', 'service__salon', 'master__salon')
+    autocomplete_fields = ('salon', 'client', 'service', 'master')
     search_fields = ('client__full_name', 'service__name', 'master__full_name', 'notes')
     ordering = ('-scheduled_at',)
     readonly_fields = ('created_at', 'updated_at')
@@ -133,12 +176,28 @@ class AppointmentAdmin(admin.ModelAdmin):
 
 
 @admin.register(Document)
-class DocumentAdmin(admin.ModelAdmin):
+class DocumentAdmin(SalonRelatedAdmin):
     list_display = ('name', 'salon', 'doc_type', 'file_size', 'uploaded_at')
-    list_filter = ('doc_type', 'salon', 'uploaded_at')
+    list_filter = ('doc_type', ('salon', RelatedIDFilter), 'uploaded_at')
+    autocomplete_fields = ('salon',)
     search_fields = ('name', 'description', 'tags')
     ordering = ('salon', '-uploaded_at')
     readonly_fields = ('uploaded_at', 'updated_at')
+    actions = ('reindex_with_profile',)
+    
+    def has_profile_permission(self, request):
+        return request.user.is_superuser
+    
+    @admin.action(description='Переиндексировать с профилированием', permissions=['profile'])
+    def reindex_with_profile(self, request, queryset):
+        from .tasks import generate_document_embeddings, get_or_create_ingestion_job
+        
+        documents = list(queryset)
+        request_task_profile(generate_document_embeddings.name, runs=len(documents))
+        for document in documents:
+            job = get_or_create_ingestion_job(document)
+            generate_document_embeddings.delay(document.id, job_id=job.id)
+        self.message_user(request, f'Индексация запущена с профилированием: {len(documents)}')
     
     fieldsets = (
         ('Основная информация', {
@@ -157,7 +216,9 @@ class DocumentAdmin(admin.ModelAdmin):
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('salon', 'caption_preview', 'scheduled_at', 'published_at', 'status')
-    list_filter = ('status', 'salon', 'scheduled_at', 'published_at')
+    list_filter = ('status', ('salon', RelatedIDFilter), 'scheduled_at', 'published_at')
+    list_select_related = ('salon',)
+    autocomplete_fields = ('salon',)
     search_fields = ('caption', 'error_message')
     ordering = ('-scheduled_at',)
     readonly_fields = ('published_at', 'created_at', 'updated_at')
@@ -182,27 +243,88 @@ class PostAdmin(admin.ModelAdmin):
 
 
 @admin.register(Embedding)
-class EmbeddingAdmin(admin.ModelAdmin):
-    list_display = ('document', 'chunk_index', 'content_preview', 'created_at')
-    list_filter = ('document__salon', 'document', 'created_at')
+class EmbeddingAdmin(EstimatedCountAdmin):
+    list_display = ('document', 'chunk_index', 'generation', 'is_active', 'content_preview', 'created_at')
+    list_filter = ('is_active', ('document__salon', RelatedIDFilter), ('document', RelatedIDFilter), 'created_at')
+    list_select_related = ('document__salon',)
     search_fields = ('content_chunk', 'document__name')
     ordering = ('document', 'chunk_index')
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'vector_format', 'vector_dimensions')
+    autocomplete_fields = ('document',)
+    
+    def get_queryset(self, request):
+        # Vectors and full chunks are loaded only when a single embedding is opened
+        return (
+            super().get_queryset(request)
+            .defer('content_chunk', 'embedding_vector', 'vector_data')
+            .annotate(content_head=Substr('content_chunk', 1, 101))
+        )
     
     def content_preview(self, obj):
-        return obj.content_chunk[:100] + '...' if len(obj.content_chunk) > 100 else obj.content_chunk
+        content = getattr(obj, 'content_head', None)
+        if content is None:
+            content = obj.content_chunk
+        return content[:100] + '...' if len(content) > 100 else content
     content_preview.short_description = 'Содержимое'
     
+    def vector_dimensions(self, obj):
+        vector = obj.vector
+        return len(vector) if vector is not None else 0
+    vector_dimensions.short_description = 'Размерность'
+    
     fieldsets = (
         ('Основная информация', {
             'fields': ('document', 'chunk_index', 'content_chunk')
         }),
+        ('Индексация', {
+            'fields': ('generation', 'is_active')
+        }),
         ('Векторное представление', {
-            'fields': ('embedding_vector',),
+            'fields': ('vector_format', 'vector_dimensions'),
             'classes': ('collapse',)
         }),
         ('Временные метки', {
             'fields': ('created_at',),
             'classes': ('collapse',)
         }),
-    ) 
\ No newline at end of file
+    ) 
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = ('document', 'generation', 'status', 'processed_chunks', 'total_chunks', 'attempts', 'updated_at')
+    list_filter = ('status', ('document__salon', RelatedIDFilter), 'created_at')
+    list_select_related = ('document__salon',)
+    search_fields = ('document__name', 'error_message')
+    ordering = ('-created_at',)
+    readonly_fields = (
+        'document', 'generation', 'content_hash', 'total_chunks', 'processed_chunks', 'attempts',
+        'started_at', 'finished_at', 'created_at', 'updated_at',
+    )
+    
+    fieldsets = (
+        ('Основная информация', {
+            'fields': ('document', 'generation', 'status', 'content_hash')
+        }),
+        ('Прогресс', {
+            'fields': ('total_chunks', 'processed_chunks', 'attempts', 'error_message')
+        }),
+        ('Временные метки', {
+            'fields': ('started_at', 'finished_at', 'created_at', 'updated_at'),
+            'classes': ('collapse',)
+        }),
+    )
+
+
+class ProfiledPeriodicTaskAdmin(PeriodicTaskAdmin):
+    """Periodic tasks with an action running them once under the task profiler"""
+    actions = PeriodicTaskAdmin.actions + ('run_tasks_with_profile',)
+    
+    def has_profile_permission(self, request):
+        return request.user.is_superuser
+    
+    @admin.action(description='Запустить с профилированием', permissions=['profile'])
+    def run_tasks_with_profile(self, request, queryset):
+        for task in queryset:
+            request_task_profile(task.task)
+        self.run_tasks(request, queryset)
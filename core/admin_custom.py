@@ -73,9 +73,11 @@ class CustomAdminSite(admin.AdminSite):
 admin_site = CustomAdminSite(name='custom_admin')
 
 # Регистрируем все модели в кастомном админ-сайте
+from django_celery_beat.models import PeriodicTask
 from .admin import (
     UserAdmin, SalonAdmin, MasterAdmin, ServiceAdmin, 
-    ClientAdmin, AppointmentAdmin, DocumentAdmin, PostAdmin, EmbeddingAdmin
+    ClientAdmin, AppointmentAdmin, DocumentAdmin, PostAdmin, EmbeddingAdmin,
+    ProfiledPeriodicTaskAdmin
 )
 
 admin_site.register(User, UserAdmin)
@@ -87,6 +89,7 @@ admin_site.register(Appointment, AppointmentAdmin)
 admin_site.register(Document, DocumentAdmin)
 admin_site.register(Post, PostAdmin)
 admin_site.register(Embedding, EmbeddingAdmin)
+admin_site.register(PeriodicTask, ProfiledPeriodicTaskAdmin)
 
 # Регистрируем стандартные модели аутентификации
 admin_site.register(Group, GroupAdmin) 
\ No newline at end of file
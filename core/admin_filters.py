@@ -0,0 +1,47 @@
+from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.contrib.admin.views.main import PAGE_VAR
+
+
+class RelatedIDFilter(admin.FieldListFilter):
+    """
+    Filter on a foreign key by typing the related object's id.
+
+    The stock related filter renders a link for every row of the related
+    table (every salon, master, document...), which is one large query per
+    changelist page and an unusable sidebar; this one only looks up the
+    selected object.
+    """
+    template = 'admin/core/related_id_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f"{field_path}__{field.target_field.name}__exact"
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.related_model = field.remote_field.model
+        self.title = getattr(field, 'verbose_name', self.related_model._meta.verbose_name)
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def selected_display(self) -> str:
+        if not self.lookup_val:
+            return ''
+        try:
+            selected = self.related_model._default_manager.filter(pk=self.lookup_val).first()
+        except (ValueError, ValidationError):
+            return ''
+        return str(selected) if selected is not None else ''
+
+    def choices(self, changelist):
+        yield {
+            'parameter_name': self.lookup_kwarg,
+            'value': self.lookup_val or '',
+            'selected': bool(self.lookup_val),
+            'display': self.selected_display(),
+            'hidden_params': [
+                (name, value) for name, value in changelist.params.items()
+                if name not in (self.lookup_kwarg, PAGE_VAR)
+            ],
+            'query_string_all': changelist.get_query_string(remove=[self.lookup_kwarg]),
+        }
@@ -4,4 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
-    verbose_name = 'Основное' 
\ No newline at end of file
+    verbose_name = 'Основное'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .instrumentation import install_query_timer
+
+        connection_created.connect(install_query_timer, dispatch_uid='core_query_timer')
@@ -0,0 +1,248 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Salon, Master, Service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SalonInfo:
+    id: int
+    name: str
+    address: str
+    phone: str
+    email: str
+    working_hours: dict
+    timezone: str
+    telegram_bot_username: str
+
+    @property
+    def working_hours_text(self) -> str:
+        return (self.working_hours or {}).get('text', '')
+
+
+@dataclass(frozen=True)
+class MasterInfo:
+    id: int
+    full_name: str
+    specialization: str
+
+
+@dataclass(frozen=True)
+class ServiceInfo:
+    id: int
+    name: str
+    description: str
+    category: str
+    category_display: str
+    price: Decimal
+    duration_minutes: int
+    master: Optional[MasterInfo] = None
+
+
+@dataclass
+class CatalogSnapshot:
+    """Immutable view of a salon's profile, active services and active masters"""
+    salon: SalonInfo
+    services: List[ServiceInfo]
+    masters: List[MasterInfo]
+    version: int
+    _services_by_id: Dict[str, ServiceInfo] = field(default_factory=dict, repr=False)
+    _masters_by_id: Dict[str, MasterInfo] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._services_by_id = {str(service.id): service for service in self.services}
+        # Masters assigned to a service stay bookable for it even if inactive
+        self._masters_by_id = {
+            str(service.master.id): service.master for service in self.services if service.master
+        }
+        self._masters_by_id.update((str(master.id), master) for master in self.masters)
+
+    def service(self, service_id) -> Optional[ServiceInfo]:
+        return self._services_by_id.get(str(service_id))
+
+    def master(self, master_id) -> Optional[MasterInfo]:
+        return self._masters_by_id.get(str(master_id))
+
+    def masters_for(self, service: ServiceInfo) -> List[MasterInfo]:
+        """Masters who can perform the service"""
+        return [service.master] if service.master else list(self.masters)
+
+    def services_by_category(self) -> Dict[str, List[ServiceInfo]]:
+        categories: Dict[str, List[ServiceInfo]] = {}
+        for service in self.services:
+            categories.setdefault(service.category_display, []).append(service)
+        return categories
+
+    def as_dict(self) -> dict:
+        return {
+            'version': self.version,
+            'salon': asdict(self.salon),
+            'services': [asdict(service) for service in self.services],
+            'masters': [asdict(master) for master in self.masters],
+        }
+
+
+def build_catalog(salon_id, version: int = 0) -> Optional[CatalogSnapshot]:
+    """Load a catalog snapshot from the database (3 queries)"""
+    salon = Salon.objects.filter(id=salon_id).first()
+    if salon is None:
+        return None
+
+    masters = [
+        MasterInfo(id=master.id, full_name=master.full_name, specialization=master.specialization)
+        for master in Master.objects.filter(salon_id=salon_id, is_active=True).order_by('full_name')
+    ]
+    services = [
+        ServiceInfo(
+            id=service.id,
+            name=service.name,
+            description=service.description,
+            category=service.category,
+            category_display=service.get_category_display(),
+            price=service.price,
+            duration_minutes=service.duration_minutes,
+            master=MasterInfo(
+                id=service.master.id,
+                full_name=service.master.full_name,
+                specialization=service.master.specialization,
+            ) if service.master else None,
+        )
+        for service in Service.objects.filter(salon_id=salon_id, is_active=True)
+        .select_related('master')
+        .order_by('category', 'name')
+    ]
+    return CatalogSnapshot(
+        salon=SalonInfo(
+            id=salon.id,
+            name=salon.name,
+            address=salon.address,
+            phone=salon.phone,
+            email=salon.email,
+            working_hours=salon.working_hours or {},
+            timezone=salon.timezone,
+            telegram_bot_username=salon.telegram_bot_username,
+        ),
+        services=services,
+        masters=masters,
+        version=version,
+    )
+
+
+class CatalogCache:
+    """
+    Read-through cache of per-salon catalog snapshots.
+
+    Snapshots are stored in the shared cache under the salon's current
+    version and mirrored in a small in-process LRU. The in-process copy is
+    trusted for local_ttl seconds, after which the version is re-read from
+    the shared cache; bump() (called from model signals) moves the version
+    so every process rebuilds once. In steady state a lookup costs no
+    database queries and at most one cache GET. While the shared cache is
+    unreachable the in-process copy keeps being served for up to max_stale
+    seconds since it was last confirmed, then it is rebuilt from the database.
+    """
+
+    def __init__(self, max_salons: int = 512, local_ttl: float = 5.0, ttl: int = 86400, max_stale: float = 60.0):
+        self.max_salons = max_salons
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._local: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _version_key(self, salon_id) -> str:
+        return f"catalog:version:{salon_id}"
+
+    def _snapshot_key(self, salon_id, version) -> str:
+        # Bump the prefix whenever the snapshot dataclasses change shape
+        return f"catalog:v3:{salon_id}:{version}"
+
+    def version(self, salon_id) -> int:
+        key = self._version_key(salon_id)
+        version = cache.get(key)
+        if version is None:
+            # A lost version key must never resurrect an old snapshot
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        return version
+
+    def peek(self, salon_id) -> Optional[CatalogSnapshot]:
+        """Return the in-process snapshot if it is still fresh, without any I/O"""
+        with self._lock:
+            entry = self._local.get(str(salon_id))
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+        return None
+
+    def _set_local(self, key: str, snapshot: CatalogSnapshot, confirmed_at: float):
+        """Keep snapshot in process; entries are (snapshot, expires_at, confirmed_at)"""
+        with self._lock:
+            self._local[key] = (snapshot, time.monotonic() + self.local_ttl, confirmed_at)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_salons:
+                self._local.popitem(last=False)
+
+    def get(self, salon_id) -> Optional[CatalogSnapshot]:
+        """Return the salon's catalog snapshot, building it on a miss"""
+        key = str(salon_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[1] > now:
+                self._local.move_to_end(key)
+                return entry[0]
+
+        try:
+            version = self.version(salon_id)
+            snapshot = cache.get(self._snapshot_key(salon_id, version))
+        except Exception as e:
+            logger.error(f"Error reading catalog cache for salon {salon_id}: {str(e)}")
+            if entry and now - entry[2] <= self.max_stale:
+                # Cannot tell whether it changed; serve it a little longer than usual
+                self._set_local(key, entry[0], entry[2])
+                return entry[0]
+            version, snapshot = None, None
+
+        if snapshot is None and entry and entry[0].version == version:
+            snapshot = entry[0]
+        if snapshot is None:
+            snapshot = build_catalog(salon_id, version or 0)
+            if snapshot is None:
+                return None
+            if version is not None:
+                try:
+                    cache.set(self._snapshot_key(salon_id, version), snapshot, self.ttl)
+                except Exception as e:
+                    logger.error(f"Error writing catalog cache for salon {salon_id}: {str(e)}")
+
+        self._set_local(key, snapshot, time.monotonic())
+        return snapshot
+
+    def bump(self, salon_id):
+        """Invalidate the salon's catalog everywhere"""
+        key = self._version_key(salon_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+        except Exception as e:
+            logger.error(f"Error bumping catalog version for salon {salon_id}: {str(e)}")
+        with self._lock:
+            self._local.pop(str(salon_id), None)
+
+
+catalog_cache = CatalogCache(
+    max_salons=settings.CATALOG_CACHE_MAX_SALONS,
+    local_ttl=settings.CATALOG_CACHE_LOCAL_TTL,
+    max_stale=settings.CATALOG_CACHE_MAX_STALE,
+)
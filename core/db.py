@@ -0,0 +1,68 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DBExecutor:
+    """
+    Thread pool for running ORM code from async code.
+
+    sync_to_async() with the default thread_sensitive=True funnels every
+    call through one thread, so concurrent handlers queue behind each other.
+    Each worker here keeps its own persistent connection (CONN_MAX_AGE), so
+    max_workers is the number of connections the process holds and should
+    be sized against the database connection limit. Stale or broken
+    connections are recycled around every call, like Django does around
+    a request.
+    """
+
+    def __init__(self, max_workers: int = 10):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='db')
+            return self._executor
+
+    @staticmethod
+    def _call(func, args, kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on a database thread and await the result"""
+        loop = asyncio.get_running_loop()
+        # Carry the caller's context (the update being traced) to the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._get_executor(), context.run, self._call, func, args, kwargs)
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+db_executor = DBExecutor(max_workers=settings.BOT_DB_POOL_SIZE)
+
+
+def db_call(func):
+    """Decorator turning a sync ORM function into a coroutine run on db_executor"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await db_executor.run(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .instrumentation import count_cache_lookup
+from .vectors import pack_float32, unpack_float32
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = re.sub(r'[^\w\s]', ' ', text.lower())
+    return ' '.join(text.split())
+
+
+class QueryEmbeddingCache:
+    """
+    Two-level cache of query embeddings.
+
+    A small in-process LRU sits in front of a shared Django cache (Redis in
+    production) so frequent questions skip the OpenAI round-trip entirely.
+    Keys are derived from the embedding model and the normalized query text;
+    vectors are stored as packed float32 bytes instead of JSON.
+    """
+
+    def __init__(self, max_local_entries: int = 1024, ttl: int = 86400, cache_alias: str = 'default'):
+        self.max_local_entries = max_local_entries
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def make_key(self, text: str, model: str) -> str:
+        digest = hashlib.sha1(normalize_query(text).encode('utf-8')).hexdigest()
+        return f"qemb:{model}:{digest}"
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = self.make_key(text, model)
+
+        with self._lock:
+            self.lookups += 1
+            lookups = self.lookups
+        if lookups % 1000 == 0:
+            logger.info(f"Query embedding cache stats: {self.stats()}")
+
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                vector, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._local.move_to_end(key)
+                    self.local_hits += 1
+                    count_cache_lookup('query_embedding', 'local_hit')
+                    return vector
+                del self._local[key]
+
+        try:
+            data = caches[self.cache_alias].get(key)
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache unavailable: {str(e)}")
+            data = None
+
+        if data is not None:
+            vector = unpack_float32(data)
+            self._set_local(key, vector)
+            with self._lock:
+                self.shared_hits += 1
+            count_cache_lookup('query_embedding', 'shared_hit')
+            return vector
+
+        with self._lock:
+            self.misses += 1
+        count_cache_lookup('query_embedding', 'miss')
+        return None
+
+    def set(self, text: str, model: str, vector: List[float]):
+        key = self.make_key(text, model)
+        self._set_local(key, vector)
+        try:
+            caches[self.cache_alias].set(key, pack_float32(vector), self.ttl)
+        except Exception as e:
+            logger.warning(f"Shared query embedding cache unavailable: {str(e)}")
+
+    def get_or_compute(self, text: str, model: str, compute: Callable[[], List[float]]) -> List[float]:
+        """Return the cached embedding or compute, cache and return it"""
+        vector = self.get(text, model)
+        if vector is None:
+            vector = compute()
+            self.set(text, model, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.lookups
+            hits = self.local_hits + self.shared_hits
+            return {
+                'lookups': lookups,
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'local_size': len(self._local),
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _set_local(self, key, vector):
+        with self._lock:
+            self._local[key] = (vector, time.monotonic() + self.ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_local_entries:
+                self._local.popitem(last=False)
+
+
+query_embedding_cache = QueryEmbeddingCache(
+    max_local_entries=settings.QUERY_EMBEDDING_CACHE_SIZE,
+    ttl=settings.QUERY_EMBEDDING_CACHE_TTL,
+)
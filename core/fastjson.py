@@ -0,0 +1,50 @@
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# orjson when installed, then msgspec, then the standard library. Every
+# backend accepts bytes or str, dumps() returns compact UTF-8 bytes and
+# malformed input raises ValueError.
+if orjson is not None:
+    BACKEND = 'orjson'
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+else:
+    BACKEND = 'json'
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e))
+    return json.loads(data)
+
+
+def dumps(obj, default: Optional[Callable] = None) -> bytes:
+    """Serialize obj; default converts values the backend does not support"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    if msgspec is not None:
+        return msgspec.json.encode(obj, enc_hook=default)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def std_loads(data) -> Any:
+    return json.loads(data)
+
+
+def std_dumps(obj, default: Optional[Callable] = None) -> bytes:
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
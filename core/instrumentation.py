@@ -0,0 +1,554 @@
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import Counter as CallCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional
+
+from celery.signals import task_failure, task_postrun, task_prerun, task_retry, worker_init, worker_process_shutdown
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import Signal
+
+from core import fastjson
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Histogram
+except ImportError:
+    prometheus_client = None
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_AVAILABLE = prometheus_client is not None
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+if PROMETHEUS_AVAILABLE:
+    UPDATES = Counter(
+        'salonify_bot_updates_total',
+        'Telegram updates handled',
+        ['bot_kind', 'handler', 'outcome'],
+    )
+    UPDATE_DURATION = Histogram(
+        'salonify_bot_update_duration_seconds',
+        'Wall time spent on one Telegram update',
+        ['bot_kind', 'handler'],
+        buckets=DURATION_BUCKETS,
+    )
+    UPDATE_STAGE_DURATION = Histogram(
+        'salonify_bot_update_stage_seconds',
+        'Time spent in one stage of a Telegram update',
+        ['handler', 'stage'],
+        buckets=DURATION_BUCKETS,
+    )
+    UPDATE_DB_QUERIES = Histogram(
+        'salonify_bot_update_db_queries',
+        'Database queries issued while handling one Telegram update',
+        ['handler'],
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+    TASK_RUNS = Counter(
+        'salonify_task_runs_total',
+        'Celery task runs by outcome',
+        ['task', 'outcome'],
+    )
+    TASK_DURATION = Histogram(
+        'salonify_task_duration_seconds',
+        'Wall time of one Celery task run',
+        ['task'],
+        buckets=DURATION_BUCKETS + (60.0, 300.0, 900.0, 3600.0),
+    )
+    TASK_ROWS = Counter(
+        'salonify_task_rows_total',
+        'Rows processed by Celery tasks',
+        ['task'],
+    )
+    TASK_EXTERNAL_CALLS = Counter(
+        'salonify_task_external_calls_total',
+        'External API calls made by Celery tasks',
+        ['task', 'service'],
+    )
+    TASK_DB_QUERIES = Counter(
+        'salonify_task_db_queries_total',
+        'Database queries issued by Celery tasks',
+        ['task'],
+    )
+    TASK_RETRIES = Counter(
+        'salonify_task_retries_total',
+        'Celery task retries scheduled',
+        ['task'],
+    )
+    CACHE_LOOKUPS = Counter(
+        'salonify_cache_lookups_total',
+        'In-process cache lookups by result (local_hit, shared_hit, miss)',
+        ['cache', 'result'],
+    )
+
+
+def _tracer():
+    if otel_trace is None or not settings.BOT_OTEL_ENABLED:
+        return None
+    return otel_trace.get_tracer('salonify.bot')
+
+
+class UpdateTrace:
+    """
+    Timings of one Telegram update.
+
+    Stages may nest: database time spent loading a session is counted
+    in both 'session' and 'db'. Database queries run on db_executor
+    threads, so stage totals are updated under a lock.
+    """
+
+    def __init__(self, bot_kind: str, span=None):
+        self.bot_kind = bot_kind
+        self.handler = ''
+        self.outcome = 'ok'
+        self.bot_id = None
+        self.update_id = None
+        self.span = span
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.stages: Dict[str, float] = {}
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_query(self, seconds: float):
+        with self._lock:
+            self.stages['db'] = self.stages.get('db', 0.0) + seconds
+            self.db_queries += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stages = {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()}
+            db_queries = self.db_queries
+        return {
+            'bot_kind': self.bot_kind,
+            'bot_id': self.bot_id,
+            'update_id': self.update_id,
+            'handler': self.handler,
+            'outcome': self.outcome,
+            'duration_ms': round(self.duration * 1000, 2),
+            'stages_ms': stages,
+            'db_queries': db_queries,
+        }
+
+
+_current: ContextVar[Optional[UpdateTrace]] = ContextVar('update_trace', default=None)
+
+# Sent with trace= once an update is finished, on the thread that handled it
+update_finished = Signal()
+
+
+def current_trace() -> Optional[UpdateTrace]:
+    return _current.get()
+
+
+@contextmanager
+def trace_update(bot_kind: str):
+    """Trace the update handled inside the block; exported when it ends"""
+    tracer = _tracer()
+    if tracer is None:
+        trace = UpdateTrace(bot_kind)
+        reset = _current.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.outcome = 'error'
+            raise
+        finally:
+            _current.reset(reset)
+            _finish(trace)
+        return
+
+    with tracer.start_as_current_span('telegram.update') as span:
+        trace = UpdateTrace(bot_kind, span)
+        reset = _current.set(trace)
+        try:
+            yield trace
+        except Exception:
+            trace.outcome = 'error'
+            raise
+        finally:
+            _current.reset(reset)
+            _finish(trace)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent inside the block to the current update's stage"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+
+    span = None
+    if trace.span is not None:
+        span = _tracer().start_span(name, context=otel_trace.set_span_in_context(trace.span))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+        if span is not None:
+            span.end()
+
+
+def instrumented_handler(bot_kind: str):
+    """
+    Decorator naming the handler of the current update.
+
+    The innermost decorated handler wins, so a dispatcher such as
+    button_callback reports the specific handler it delegated to. With no
+    update being traced (polling mode) the handler starts the trace.
+    """
+    def decorator(func):
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                trace = _current.get()
+                if trace is None:
+                    with trace_update(bot_kind) as trace:
+                        trace.handler = name
+                        return await func(*args, **kwargs)
+                trace.handler = name
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    trace.outcome = 'error'
+                    raise
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                trace = _current.get()
+                if trace is None:
+                    with trace_update(bot_kind) as trace:
+                        trace.handler = name
+                        return func(*args, **kwargs)
+                trace.handler = name
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    trace.outcome = 'error'
+                    raise
+        return wrapper
+    return decorator
+
+
+def _finish(trace: UpdateTrace):
+    trace.duration = time.perf_counter() - trace.started
+    handler = trace.handler or 'none'
+    data = trace.as_dict()
+
+    if PROMETHEUS_AVAILABLE:
+        try:
+            UPDATES.labels(trace.bot_kind, handler, trace.outcome).inc()
+            UPDATE_DURATION.labels(trace.bot_kind, handler).observe(trace.duration)
+            for name, seconds in trace.stages.items():
+                UPDATE_STAGE_DURATION.labels(handler, name).observe(seconds)
+            UPDATE_DB_QUERIES.labels(handler).observe(trace.db_queries)
+        except Exception as e:
+            logger.error(f"Error exporting update metrics: {str(e)}")
+
+    if trace.span is not None:
+        trace.span.set_attribute('telegram.bot_kind', trace.bot_kind)
+        trace.span.set_attribute('telegram.handler', handler)
+        trace.span.set_attribute('telegram.outcome', trace.outcome)
+        trace.span.set_attribute('db.query_count', data['db_queries'])
+        for name, milliseconds in data['stages_ms'].items():
+            trace.span.set_attribute(f"stage.{name}_ms", milliseconds)
+
+    if (
+        trace.duration >= settings.BOT_SLOW_UPDATE_THRESHOLD
+        and random.random() < settings.BOT_SLOW_UPDATE_LOG_SAMPLE_RATE
+    ):
+        logger.warning(f"Slow update {fastjson.dumps(data, default=str).decode('utf-8')}")
+
+    update_finished.send(sender=UpdateTrace, trace=trace)
+
+
+def query_timer(execute, sql, params, many, context):
+    """execute_wrapper adding each query to the current update or task run"""
+    trace = _current.get() or _task_run.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver installing query_timer on every new connection"""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus exposition for this process or all workers"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+class TaskRun:
+    """Counters of one Celery task run, reported by the task through count_rows() and friends"""
+
+    def __init__(self, name: str, task_id: str):
+        self.name = name
+        self.task_id = task_id
+        self.outcome = 'success'
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.rows = 0
+        self.external_calls = CallCounter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.profiler = None
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds: float):
+        with self._lock:
+            self.db_queries += 1
+            self.db_seconds += seconds
+
+    def as_dict(self) -> dict:
+        return {
+            'task': self.name,
+            'task_id': self.task_id,
+            'outcome': self.outcome,
+            'duration_ms': round(self.duration * 1000, 2),
+            'rows': self.rows,
+            'external_calls': dict(self.external_calls),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_seconds * 1000, 2),
+        }
+
+
+_task_run: ContextVar[Optional[TaskRun]] = ContextVar('task_run', default=None)
+# Runs by task id; prerun and postrun are separate signal calls
+_task_runs: Dict[str, tuple] = {}
+
+
+def count_rows(count: int):
+    """Add rows processed by the running task"""
+    run = _task_run.get()
+    if run is not None:
+        run.rows += count
+
+
+def count_external_call(service: str):
+    """Count one external API call made by the running task"""
+    run = _task_run.get()
+    if run is not None:
+        with run._lock:
+            run.external_calls[service] += 1
+
+
+def mark_task_error():
+    """Report a run that logged and swallowed its error as failed"""
+    run = _task_run.get()
+    if run is not None:
+        run.outcome = 'error'
+
+
+def count_cache_lookup(cache_name: str, result: str):
+    """Count one lookup in an application cache"""
+    if PROMETHEUS_AVAILABLE:
+        CACHE_LOOKUPS.labels(cache=cache_name, result=result).inc()
+
+
+# Task names with outstanding profile requests, as seen by this process
+PROFILE_REQUESTS_KEY = 'task_profile:requested'
+PROFILE_REQUESTS_REFRESH = 5.0
+_profile_requests = {'names': frozenset(), 'checked_at': 0.0}
+_profile_requests_lock = threading.Lock()
+
+
+def _profile_key(task_name: str) -> str:
+    return f"task_profile:{task_name}"
+
+
+def request_task_profile(task_name: str, runs: int = 1):
+    """Profile the next runs of task_name on any worker (admin actions)"""
+    ttl = settings.TASK_PROFILE_REQUEST_TTL
+    cache.set(_profile_key(task_name), runs, ttl)
+    requested = cache.get(PROFILE_REQUESTS_KEY) or frozenset()
+    cache.set(PROFILE_REQUESTS_KEY, frozenset(requested) | {task_name}, ttl)
+
+
+def _requested_profiles() -> frozenset:
+    """Names with profile requests; the shared key is read at most every few seconds"""
+    now = time.monotonic()
+    with _profile_requests_lock:
+        if now - _profile_requests['checked_at'] < PROFILE_REQUESTS_REFRESH:
+            return _profile_requests['names']
+        _profile_requests['checked_at'] = now
+    try:
+        names = frozenset(cache.get(PROFILE_REQUESTS_KEY) or ())
+    except Exception as e:
+        logger.error(f"Error checking task profile requests: {str(e)}")
+        names = frozenset()
+    with _profile_requests_lock:
+        _profile_requests['names'] = names
+    return names
+
+
+def _should_profile(task_name: str) -> bool:
+    if task_name in settings.TASK_PROFILE_TASKS and random.random() < settings.TASK_PROFILE_SAMPLE_RATE:
+        return True
+    if task_name not in _requested_profiles():
+        return False
+    try:
+        return cache.decr(_profile_key(task_name)) >= 0
+    except ValueError:
+        return False
+    except Exception as e:
+        logger.error(f"Error checking task profile request: {str(e)}")
+        return False
+
+
+def _start_profiler():
+    if settings.TASK_PROFILER == 'pyinstrument' and pyinstrument is not None:
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def _dump_profile(run: TaskRun):
+    """Write the run's profile to TASK_PROFILE_DIR and log its top functions"""
+    profiler = run.profiler
+    directory = Path(settings.TASK_PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = f"{run.name}-{time.strftime('%Y%m%d-%H%M%S')}-{run.task_id}"
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = directory / f"{stem}.prof"
+        profiler.dump_stats(str(path))
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(20)
+        top = summary.getvalue()
+    else:
+        profiler.stop()
+        path = directory / f"{stem}.html"
+        path.write_text(profiler.output_html(), encoding='utf-8')
+        top = profiler.output_text(unicode=True, color=False)
+
+    logger.info(f"Profile of task {run.name} ({run.task_id}) written to {path}\n{top}")
+
+
+@task_prerun.connect(dispatch_uid='instrumentation_task_prerun')
+def _task_prerun(task_id=None, task=None, **kwargs):
+    run = TaskRun(task.name, task_id)
+    if _should_profile(task.name):
+        try:
+            run.profiler = _start_profiler()
+        except Exception as e:
+            logger.error(f"Error starting profiler for task {task.name}: {str(e)}")
+    _task_runs[task_id] = (run, _task_run.set(run))
+
+
+@task_retry.connect(dispatch_uid='instrumentation_task_retry')
+def _task_retry(sender=None, **kwargs):
+    run = _task_run.get()
+    if run is not None:
+        run.outcome = 'retry'
+
+
+@task_failure.connect(dispatch_uid='instrumentation_task_failure')
+def _task_failure(task_id=None, **kwargs):
+    entry = _task_runs.get(task_id)
+    if entry is not None:
+        entry[0].outcome = 'failure'
+
+
+@task_postrun.connect(dispatch_uid='instrumentation_task_postrun')
+def _task_postrun(task_id=None, task=None, **kwargs):
+    entry = _task_runs.pop(task_id, None)
+    if entry is None:
+        return
+    run, reset = entry
+    try:
+        _task_run.reset(reset)
+    except ValueError:
+        _task_run.set(None)
+    run.duration = time.perf_counter() - run.started
+
+    if run.profiler is not None:
+        try:
+            _dump_profile(run)
+        except Exception as e:
+            logger.error(f"Error writing profile of task {run.name}: {str(e)}")
+
+    if PROMETHEUS_AVAILABLE:
+        try:
+            TASK_RUNS.labels(run.name, run.outcome).inc()
+            TASK_DURATION.labels(run.name).observe(run.duration)
+            TASK_ROWS.labels(run.name).inc(run.rows)
+            TASK_DB_QUERIES.labels(run.name).inc(run.db_queries)
+            for service, calls in run.external_calls.items():
+                TASK_EXTERNAL_CALLS.labels(run.name, service).inc(calls)
+            if run.outcome == 'retry':
+                TASK_RETRIES.labels(run.name).inc()
+        except Exception as e:
+            logger.error(f"Error exporting task metrics: {str(e)}")
+
+    logger.info(f"Task run {fastjson.dumps(run.as_dict(), default=str).decode('utf-8')}")
+
+
+@worker_init.connect(dispatch_uid='instrumentation_worker_init')
+def _start_worker_metrics_server(**kwargs):
+    """Serve task metrics from the worker's main process on TASK_METRICS_PORT"""
+    if not PROMETHEUS_AVAILABLE or not settings.TASK_METRICS_PORT:
+        return
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    prometheus_client.start_http_server(settings.TASK_METRICS_PORT, registry=registry)
+    logger.info(f"Serving task metrics on port {settings.TASK_METRICS_PORT}")
+
+
+@worker_process_shutdown.connect(dispatch_uid='instrumentation_worker_process_shutdown')
+def _mark_worker_process_dead(pid=None, **kwargs):
+    if PROMETHEUS_AVAILABLE and 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,129 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import FastJSONRenderer
+from core import fastjson
+from telegram_bot.views import peek_update_type
+
+
+def sample_updates():
+    """Webhook payloads shaped like real Telegram updates"""
+    user = {'id': 123456789, 'is_bot': False, 'first_name': 'Анна', 'username': 'anna', 'language_code': 'ru'}
+    chat = {'id': 123456789, 'first_name': 'Анна', 'username': 'anna', 'type': 'private'}
+    message = {
+        'message_id': 4321,
+        'from': user,
+        'chat': chat,
+        'date': 1760000000,
+        'text': 'Здравствуйте! Сколько стоит маникюр с покрытием и есть ли свободное время в субботу?',
+    }
+    return {
+        'message': {'update_id': 900000001, 'message': message},
+        'callback_query': {
+            'update_id': 900000002,
+            'callback_query': {
+                'id': '5112233445566778899',
+                'from': user,
+                'message': dict(message, text='💇‍♀️ Выберите услугу:', reply_markup={
+                    'inline_keyboard': [
+                        [{'text': f'Услуга {i} - {1000 + i * 100} руб.', 'callback_data': f'book_service_{uuid.uuid4()}'}]
+                        for i in range(12)
+                    ]
+                }),
+                'chat_instance': '-1234567890123456789',
+                'data': f'book_service_{uuid.uuid4()}',
+            },
+        },
+        'edited_message': {'update_id': 900000003, 'edited_message': dict(message, edit_date=1760000100)},
+    }
+
+
+def sample_api_page(size=20):
+    """DRF-style page of serialized appointments"""
+    return {
+        'count': 1000,
+        'next': 'https://example.com/api/appointments/?page=2',
+        'previous': None,
+        'results': [
+            {
+                'id': str(uuid.uuid4()),
+                'salon': {'id': str(uuid.uuid4()), 'name': 'Салон красоты', 'address': 'ул. Ленина, 1'},
+                'client': {'id': str(uuid.uuid4()), 'full_name': 'Анна Иванова', 'phone': '+79990000000'},
+                'service': {'id': str(uuid.uuid4()), 'name': 'Маникюр', 'price': Decimal('1500.00')},
+                'master': {'id': str(uuid.uuid4()), 'full_name': 'Мария Петрова'},
+                'scheduled_at': '2026-10-20T14:30:00Z',
+                'status': 'scheduled',
+                'price': '1500.00',
+                'notes': '',
+                'created_at': '2026-10-19T10:00:00Z',
+                'updated_at': '2026-10-19T10:00:00Z',
+            }
+            for _ in range(size)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark JSON parsing/rendering of webhook updates and API responses (per-worker req/s)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20000,
+            help='Operations per measurement (default: 20000)',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=20,
+            help='Results per API page (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'Fast backend: {fastjson.BACKEND}')
+        self.stdout.write(f'{"case":<40}{"stdlib req/s":>14}{"fast req/s":>14}{"speedup":>9}')
+
+        for name, update in sample_updates().items():
+            body = fastjson.std_dumps(update)
+            std = self.measure(lambda: peek_update_type(fastjson.std_loads(body)), iterations)
+            fast = self.measure(lambda: peek_update_type(fastjson.loads(body)), iterations)
+            self.report(f'webhook parse+peek: {name}', std, fast)
+
+        try:
+            from telegram import Update
+        except ImportError:
+            Update = None
+        if Update is not None:
+            update = sample_updates()['callback_query']
+            body = fastjson.dumps(update)
+            full = self.measure(lambda: Update.de_json(fastjson.loads(body), None), iterations // 10)
+            peek = self.measure(lambda: peek_update_type(fastjson.loads(body)), iterations // 10)
+            self.report('callback: full de_json | peek only', full, peek)
+
+        page = sample_api_page(options['page_size'])
+        std_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        std = self.measure(lambda: std_renderer.render(page), iterations // 10)
+        fast = self.measure(lambda: fast_renderer.render(page), iterations // 10)
+        self.report(f'DRF render: page of {options["page_size"]}', std, fast)
+
+        body = fastjson.std_dumps(page, default=str)
+        std = self.measure(lambda: fastjson.std_loads(body), iterations // 10)
+        fast = self.measure(lambda: fastjson.loads(body), iterations // 10)
+        self.report(f'DRF parse: page of {options["page_size"]}', std, fast)
+
+    def measure(self, func, iterations):
+        """Operations per second of func"""
+        iterations = max(iterations, 1)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return iterations / (time.perf_counter() - started)
+
+    def report(self, name, baseline, fast):
+        self.stdout.write(f'{name:<40}{baseline:>14.0f}{fast:>14.0f}{fast / baseline:>8.1f}x')
@@ -0,0 +1,72 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.models import Embedding
+from core.vectors import (
+    VECTOR_FORMAT_FLOAT32, VECTOR_FORMAT_FLOAT16, VECTOR_FORMAT_INT8,
+    encode_vector, decode_vector,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark storage size and decode time of embedding vector encodings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=1000,
+            help='Number of vectors to benchmark (default: 1000)',
+        )
+        parser.add_argument(
+            '--dimensions',
+            type=int,
+            default=1536,
+            help='Vector size for synthetic vectors (default: 1536)',
+        )
+        parser.add_argument(
+            '--from-db',
+            action='store_true',
+            help='Use vectors stored in the database instead of synthetic ones',
+        )
+
+    def handle(self, *args, **options):
+        vectors = self.load_vectors(options)
+        if not vectors:
+            self.stdout.write(self.style.ERROR('No vectors to benchmark'))
+            return
+
+        self.stdout.write(f'Vectors: {len(vectors)} x {len(vectors[0])}')
+        self.stdout.write(f'{"format":<10}{"bytes/vector":>14}{"decode µs":>12}{"max abs err":>14}')
+
+        payloads = [json.dumps(vector) for vector in vectors]
+        started = time.perf_counter()
+        for payload in payloads:
+            json.loads(payload)
+        self.report('json', payloads, time.perf_counter() - started, len(vectors), 0.0)
+
+        reference = np.asarray(vectors, dtype=np.float32)
+        for vector_format in (VECTOR_FORMAT_FLOAT32, VECTOR_FORMAT_FLOAT16, VECTOR_FORMAT_INT8):
+            payloads = [encode_vector(vector, vector_format) for vector in vectors]
+            started = time.perf_counter()
+            decoded = [decode_vector(payload, vector_format) for payload in payloads]
+            elapsed = time.perf_counter() - started
+            error = float(np.abs(np.vstack(decoded) - reference).max())
+            self.report(vector_format, payloads, elapsed, len(vectors), error)
+
+    def load_vectors(self, options):
+        if options['from_db']:
+            embeddings = Embedding.objects.only(
+                'vector_data', 'vector_format', 'embedding_vector'
+            )[:options['count']]
+            return [embedding.vector.tolist() for embedding in embeddings if embedding.vector is not None]
+
+        rng = np.random.default_rng(0)
+        return rng.normal(0, 0.05, size=(options['count'], options['dimensions'])).astype(np.float32).tolist()
+
+    def report(self, name, payloads, elapsed, count, error):
+        size = sum(len(payload) for payload in payloads) / count
+        self.stdout.write(f'{name:<10}{size:>14.0f}{elapsed / count * 1e6:>12.1f}{error:>14.6f}')
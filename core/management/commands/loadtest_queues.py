@@ -0,0 +1,110 @@
+import time
+
+from celery import current_app
+from django.core.management.base import BaseCommand
+
+from telegram_bot.loadtest.runner import percentile
+from telegram_bot.loadtest.tasks import queue_latency_probe, simulate_bulk_work
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure notification queue latency with and without a large bulk backlog. '
+        'Needs running workers and a result backend; workers and this command should share a clock.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backlog',
+            type=int,
+            default=500,
+            help='Bulk tasks to enqueue (default: 500)',
+        )
+        parser.add_argument(
+            '--work-seconds',
+            type=float,
+            default=1.0,
+            help='Seconds each bulk task holds a worker slot (default: 1.0)',
+        )
+        parser.add_argument(
+            '--probes',
+            type=int,
+            default=30,
+            help='Latency probes per phase (default: 30)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0.5,
+            help='Seconds between probes (default: 0.5)',
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=120.0,
+            help='Seconds to wait for a probe before counting it as lost (default: 120)',
+        )
+        parser.add_argument(
+            '--shared-queue',
+            action='store_true',
+            help='Put the backlog on the notifications queue, as when every task shared one queue',
+        )
+
+    def handle(self, *args, **options):
+        backlog_queue = 'notifications' if options['shared_queue'] else 'ingestion'
+
+        self.stdout.write(f'Baseline: {options["probes"]} probes on the notifications queue...')
+        baseline = self.probe(options)
+
+        self.stdout.write(f'Enqueuing {options["backlog"]} bulk tasks on the {backlog_queue} queue...')
+        backlog = [
+            simulate_bulk_work.apply_async(args=[options['work_seconds']], queue=backlog_queue)
+            for _ in range(options['backlog'])
+        ]
+        try:
+            self.stdout.write('Probing during the backlog...')
+            loaded = self.probe(options)
+            remaining = self.queue_depth(backlog_queue)
+        finally:
+            # Workers drop the rest of the simulated backlog on receipt
+            current_app.control.revoke([result.id for result in backlog])
+
+        self.stdout.write('')
+        self.print_phase('Baseline', baseline)
+        self.print_phase('With backlog', loaded)
+        self.stdout.write(f'{backlog_queue} queue depth at the end: {remaining}')
+
+        if not loaded['latencies'] or not baseline['latencies']:
+            return
+        growth = percentile(loaded['latencies'], 0.95) - percentile(baseline['latencies'], 0.95)
+        style = self.style.SUCCESS if growth < 1.0 else self.style.WARNING
+        self.stdout.write(style(f'p95 latency change under backlog: {growth * 1000:+.0f}ms'))
+
+    def probe(self, options) -> dict:
+        results = []
+        for _ in range(options['probes']):
+            results.append(queue_latency_probe.apply_async(args=[time.time()], queue='notifications'))
+            time.sleep(options['interval'])
+
+        latencies, lost = [], 0
+        for result in results:
+            try:
+                latencies.append(result.get(timeout=options['timeout']))
+            except Exception:
+                lost += 1
+        return {'latencies': latencies, 'lost': lost}
+
+    def queue_depth(self, queue: str) -> int:
+        try:
+            with current_app.connection_or_acquire() as connection:
+                return connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+        except Exception:
+            return -1
+
+    def print_phase(self, title: str, phase: dict):
+        latencies = phase['latencies']
+        self.stdout.write(
+            f'{title:<14}p50 {percentile(latencies, 0.5) * 1000:.0f}ms  '
+            f'p95 {percentile(latencies, 0.95) * 1000:.0f}ms  '
+            f'max {max(latencies, default=0) * 1000:.0f}ms  lost {phase["lost"]}'
+        )
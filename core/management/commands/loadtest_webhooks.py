@@ -0,0 +1,169 @@
+import logging
+import random
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from core import fastjson
+from telegram_bot.loadtest.fake_api import FakeBotAPI
+from telegram_bot.loadtest.runner import run_load
+from telegram_bot.loadtest.scenarios import UpdateFactory, build_script, create_fixtures, delete_fixtures
+from telegram_bot.webhooks import webhook_router
+
+
+class Command(BaseCommand):
+    help = 'Load-test the Telegram webhook end to end against a local fake Bot API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--salons',
+            type=int,
+            default=10,
+            help='Number of salons (client bots) to simulate (default: 10)',
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=20,
+            help='Simulated users per salon (default: 20)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Concurrent webhook requests (default: 4)',
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.05,
+            help='Fake Bot API response latency in seconds (default: 0.05)',
+        )
+        parser.add_argument(
+            '--jitter',
+            type=float,
+            default=0.02,
+            help='Random extra latency in seconds (default: 0.02)',
+        )
+        parser.add_argument(
+            '--rate-429',
+            type=float,
+            default=0.0,
+            help='Share of Bot API calls answered with 429 (default: 0)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for scenarios and the fake API (default: 0)',
+        )
+        parser.add_argument(
+            '--current-db',
+            action='store_true',
+            help='Run against the configured database instead of a throwaway test database',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the report as JSON to this file for comparison between releases',
+        )
+        parser.add_argument(
+            '--verbose-logs',
+            action='store_true',
+            help='Keep application logging at its configured level',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verbose_logs']:
+            for name in ('telegram_bot', 'core', 'httpx', 'telegram', 'openai'):
+                logging.getLogger(name).setLevel(logging.WARNING)
+
+        setup_test_environment()
+        old_name = None
+        if not options['current_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        fake_api = FakeBotAPI(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            rate_429=options['rate_429'],
+            seed=options['seed'],
+        ).start()
+        try:
+            with override_settings(
+                TELEGRAM_API_URL=fake_api.url,
+                OPENAI_BASE_URL=fake_api.openai_url,
+                TELEGRAM_UPDATE_LOG_SAMPLE_RATE=0.0,
+            ):
+                report = self.run(options, fake_api)
+        finally:
+            fake_api.stop()
+            if options['current_db']:
+                removed = delete_fixtures()
+                self.stdout.write(f'Removed load test data of {removed} salons')
+            else:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.print_report(report)
+        if options['output']:
+            Path(options['output']).write_bytes(fastjson.dumps(report.as_dict()))
+            self.stdout.write(f'Report written to {options["output"]}')
+
+        missing = report.bookings_expected - report.bookings_created
+        if missing:
+            raise CommandError(f'{missing} of {report.bookings_expected} booking scripts did not create an appointment')
+
+    def run(self, options, fake_api):
+        rng = random.Random(options['seed'])
+        self.stdout.write(f'Creating {options["salons"]} salons x {options["users"]} users...')
+        users = create_fixtures(options['salons'], options['users'], rng)
+        webhook_router.invalidate()
+
+        factory = UpdateFactory()
+        for user in users:
+            user.updates = build_script(user, factory, rng)
+        rng.shuffle(users)
+
+        total = sum(len(user.updates) for user in users)
+        self.stdout.write(
+            f'Sending {total} updates with concurrency {options["concurrency"]} '
+            f'(fake API latency {options["latency"] * 1000:.0f}ms, 429 rate {options["rate_429"]:.0%})'
+        )
+        return run_load(users, max(options['concurrency'], 1), fake_api)
+
+    def print_report(self, report):
+        data = report.as_dict()
+        latency = data['latency_ms']
+        self.stdout.write('')
+        self.stdout.write(f'Updates:            {data["updates"]} in {data["duration_s"]:.1f}s')
+        self.stdout.write(f'Throughput:         {data["throughput_per_s"]:.1f} updates/s')
+        self.stdout.write(
+            f'Latency:            p50 {latency["p50"]:.1f}ms  p95 {latency["p95"]:.1f}ms  p99 {latency["p99"]:.1f}ms'
+        )
+        for scenario, p95 in data['latency_p95_ms_by_scenario'].items():
+            self.stdout.write(f'  {scenario:<18}p95 {p95:.1f}ms')
+        self.stdout.write(f'DB queries/update:  {data["db_queries_per_update"]:.2f}')
+        self.stdout.write(
+            f'Outbound/update:    {data["outbound_calls_per_update"]:.3f} '
+            f'(inline replies/update {data["inline_replies_per_update"]:.3f})'
+        )
+        for method, count in sorted(data['outbound_calls'].items()):
+            self.stdout.write(f'  {method:<30}{count:>8}')
+        if data['rejected_429']:
+            self.stdout.write(f'429 responses:      {sum(data["rejected_429"].values())}')
+
+        errors = sum(count for status, count in data['statuses'].items() if status >= 400)
+        style = self.style.SUCCESS if not errors else self.style.WARNING
+        self.stdout.write(style(f'HTTP statuses: {data["statuses"]}'))
+
+        # Handlers catch their own errors and the webhook still answers 200
+        style = self.style.SUCCESS if not report.handler_errors else self.style.WARNING
+        self.stdout.write(style(f'Handler outcomes:   {report.handler_errors} errors'))
+        for scenario, outcomes in data['outcomes_by_scenario'].items():
+            self.stdout.write(f'  {scenario:<18}{outcomes}')
+        bookings = data['bookings']
+        style = self.style.SUCCESS if bookings['created'] == bookings['expected'] else self.style.ERROR
+        self.stdout.write(style(f'Bookings created:   {bookings["created"]} of {bookings["expected"]}'))
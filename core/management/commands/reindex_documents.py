@@ -0,0 +1,108 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import IngestionJob
+from core.reindex import enqueue_reindex, estimate_cost, plan_reindex, reindex_progress
+
+
+class Command(BaseCommand):
+    help = 'Re-embed documents of all salons in parallel through Celery, busiest salons first'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--salon',
+            action='append',
+            dest='salons',
+            help='Only re-index this salon (can be repeated)',
+        )
+        parser.add_argument(
+            '--doc-type',
+            action='append',
+            dest='doc_types',
+            help='Only re-index documents of this type (can be repeated)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='Re-index at most this many documents',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the plan and cost estimate without queueing anything',
+        )
+        parser.add_argument(
+            '--wait',
+            action='store_true',
+            help='Report progress and throughput until all jobs finish',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=10.0,
+            help='Seconds between progress reports with --wait (default: 10)',
+        )
+
+    def handle(self, *args, **options):
+        plan = plan_reindex(options['salons'], options['doc_types'])
+        if options['limit']:
+            plan = plan[:options['limit']]
+        if not plan:
+            self.stdout.write(self.style.WARNING('No documents to re-index'))
+            return
+
+        chunks = sum(item.chunks for item in plan)
+        tokens = sum(item.tokens for item in plan)
+        salons = len({item.salon_id for item in plan})
+        rpm, tpm = settings.OPENAI_EMBEDDING_RPM, settings.OPENAI_EMBEDDING_TPM
+        minutes = max(chunks / rpm if rpm else 0, tokens / tpm if tpm else 0)
+
+        self.stdout.write(f'Model: {settings.OPENAI_EMBEDDING_MODEL}')
+        self.stdout.write(f'Documents: {len(plan)} in {salons} salons, {chunks} chunks')
+        self.stdout.write(f'Tokens: ~{tokens} (estimated cost ~${estimate_cost(tokens):.2f})')
+        if minutes:
+            self.stdout.write(f'Budget: {rpm} RPM / {tpm} TPM, at least ~{minutes:.1f} min')
+
+        if options['dry_run']:
+            self.stdout.write(f'\n{"salon":>8}{"traffic":>9}{"chunks":>8}{"tokens":>10}  document')
+            for item in plan:
+                marker = '' if item.from_embeddings else ' *'
+                self.stdout.write(
+                    f'{item.salon_id:>8}{item.traffic:>9}{item.chunks:>8}{item.tokens:>10}  '
+                    f'{item.document_name}{marker}'
+                )
+            self.stdout.write('\n* never indexed, size measured from the file')
+            self.stdout.write(self.style.SUCCESS('Dry run, nothing queued'))
+            return
+
+        started = time.monotonic()
+        job_ids = enqueue_reindex(plan)
+        self.stdout.write(self.style.SUCCESS(f'Queued {len(job_ids)} ingestion jobs'))
+
+        if not options['wait']:
+            return
+
+        # Resumed jobs already have progress that this run did not produce
+        baseline = sum(
+            IngestionJob.objects.filter(id__in=job_ids).values_list('processed_chunks', flat=True)
+        )
+        while True:
+            time.sleep(options['interval'])
+            progress = reindex_progress(job_ids, started, baseline)
+            self.stdout.write(
+                f'[{progress.elapsed:7.0f}s] completed {progress.completed}/{progress.total}, '
+                f'running {progress.running}, failed {progress.failed}, '
+                f'{progress.chunks_per_minute:.1f} chunks/min'
+            )
+            if progress.finished:
+                break
+
+        style = self.style.SUCCESS if not progress.failed else self.style.WARNING
+        self.stdout.write(style(
+            f'Finished in {progress.elapsed:.0f}s: {progress.completed} completed, '
+            f'{progress.failed} failed, {progress.processed_chunks} chunks, '
+            f'{progress.chunks_per_minute:.1f} chunks/min'
+        ))
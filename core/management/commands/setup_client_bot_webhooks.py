@@ -1,8 +1,12 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from core.models import Salon
-import requests
+from telegram_bot.webhooks import (
+    WebhookRegistrar, WebhookTarget, summarize,
+    STATUS_UPDATED, STATUS_UNCHANGED, STATUS_REMOVED, STATUS_FAILED,
+)
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +25,24 @@ class Command(BaseCommand):
             action='store_true',
             help='Remove webhooks instead of setting them'
         )
+        parser.add_argument(
+            '--base-url',
+            type=str,
+            default=settings.TELEGRAM_WEBHOOK_BASE_URL,
+            help='Base URL for webhooks (default: TELEGRAM_WEBHOOK_BASE_URL)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=20,
+            help='Maximum number of concurrent Bot API requests (default: 20)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Call setWebhook for every bot without comparing getWebhookInfo first '
+                 '(required after rotating webhook secrets)'
+        )
 
     def handle(self, *args, **options):
         salon_id = options.get('salon_id')
@@ -38,82 +60,50 @@ class Command(BaseCommand):
         else:
             salons = Salon.objects.exclude(
                 telegram_bot_token__isnull=True
-            ).exclude(telegram_bot_token='')
+            ).exclude(telegram_bot_token='').only('id', 'name', 'telegram_bot_token')
         
+        targets = []
         for salon in salons:
-            if remove:
-                self.remove_webhook(salon)
-            else:
-                self.setup_webhook(salon)
-
-    def setup_webhook(self, salon):
-        """Setup webhook for salon client bot"""
-        if not salon.telegram_bot_token:
-            self.stdout.write(
-                self.style.WARNING(f'Salon {salon.name} has no bot token')
-            )
-            return
+            if not salon.telegram_bot_token:
+                self.stdout.write(
+                    self.style.WARNING(f'Salon {salon.name} has no bot token')
+                )
+                continue
+            targets.append(WebhookTarget(name=salon.name, token=salon.telegram_bot_token))
         
-        webhook_url = f"https://salonify-app-3cd2419b7b71.herokuapp.com/telegram/webhook/{salon.telegram_bot_token}/"
+        registrar = WebhookRegistrar(
+            base_url=options['base_url'],
+            concurrency=options['concurrency'],
+            diff=not options['force'],
+        )
         
-        url = f"https://api.telegram.org/bot{salon.telegram_bot_token}/setWebhook"
-        data = {
-            'url': webhook_url,
-            'allowed_updates': ['message', 'callback_query']
-        }
+        started = time.monotonic()
+        if remove:
+            results = registrar.remove_all(targets)
+        else:
+            results = registrar.register_all(targets)
+        elapsed = time.monotonic() - started
         
-        try:
-            response = requests.post(url, json=data)
-            result = response.json()
-            
-            if result.get('ok'):
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Webhook set for salon {salon.name}: {webhook_url}'
-                    )
-                )
-            else:
+        for result in results:
+            if result.status == STATUS_FAILED:
                 self.stdout.write(
-                    self.style.ERROR(
-                        f'Failed to set webhook for salon {salon.name}: {result.get("description")}'
-                    )
+                    self.style.ERROR(f'Failed for salon {result.name}: {result.detail}')
                 )
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(
-                    f'Error setting webhook for salon {salon.name}: {str(e)}'
-                )
-            )
-
-    def remove_webhook(self, salon):
-        """Remove webhook for salon client bot"""
-        if not salon.telegram_bot_token:
-            self.stdout.write(
-                self.style.WARNING(f'Salon {salon.name} has no bot token')
-            )
-            return
+            elif self.verbosity > 1:
+                self.stdout.write(f'{result.status}: salon {result.name} {result.detail}')
         
-        url = f"https://api.telegram.org/bot{salon.telegram_bot_token}/deleteWebhook"
+        self.report(results, elapsed)
+
+    def report(self, results, elapsed):
+        """Print a summary of the run"""
+        counts = summarize(results)
+        attempts = sum(result.attempts for result in results)
         
-        try:
-            response = requests.post(url)
-            result = response.json()
-            
-            if result.get('ok'):
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'Webhook removed for salon {salon.name}'
-                    )
-                )
-            else:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'Failed to remove webhook for salon {salon.name}: {result.get("description")}'
-                    )
-                )
-        except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(
-                    f'Error removing webhook for salon {salon.name}: {str(e)}'
-                )
-            ) 
\ No newline at end of file
+        self.stdout.write('')
+        self.stdout.write(f'Bots processed: {len(results)} in {elapsed:.1f}s')
+        self.stdout.write(f'Bot API requests: {attempts}')
+        for status in (STATUS_UPDATED, STATUS_UNCHANGED, STATUS_REMOVED):
+            if counts[status]:
+                self.stdout.write(self.style.SUCCESS(f'  {status}: {counts[status]}'))
+        if counts[STATUS_FAILED]:
+            self.stdout.write(self.style.ERROR(f'  {STATUS_FAILED}: {counts[STATUS_FAILED]}'))
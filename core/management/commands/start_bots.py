@@ -1,31 +1,100 @@
 import asyncio
-import threading
+import signal
 from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
-from telegram_bot.bot import start_all_bots
-
-User = get_user_model()
+from django.conf import settings
+from telegram_bot.supervisor import BotSupervisor
 
 
 class Command(BaseCommand):
-    help = 'Запускает всех Telegram ботов'
+    help = 'Запускает всех Telegram ботов в одном процессе под управлением супервизора'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-admin-bots',
+            action='store_true',
+            help='Запускать только боты салонов для клиентов',
+        )
+        parser.add_argument(
+            '--sync-interval',
+            type=float,
+            default=30.0,
+            help='Интервал синхронизации токенов с базой данных, сек (по умолчанию: 30)',
+        )
+        parser.add_argument(
+            '--startup-concurrency',
+            type=int,
+            default=20,
+            help='Сколько ботов стартует одновременно (по умолчанию: 20)',
+        )
+        parser.add_argument(
+            '--pool-size',
+            type=int,
+            default=256,
+            help='Размер общего пула HTTP соединений (по умолчанию: 256)',
+        )
+        parser.add_argument(
+            '--get-updates-pool-size',
+            type=int,
+            default=settings.BOT_GET_UPDATES_POOL_SIZE,
+            help='Размер пула соединений для getUpdates, должен быть больше числа ботов '
+                 '(по умолчанию: BOT_GET_UPDATES_POOL_SIZE)',
+        )
+        parser.add_argument(
+            '--measure-memory',
+            action='store_true',
+            help='Измерять потребление памяти на одного бота (tracemalloc)',
+        )
+        parser.add_argument(
+            '--shard',
+            action='store_true',
+            help='Делить ботов между несколькими процессами через Redis (консистентное хеширование и аренды)',
+        )
+        parser.add_argument(
+            '--worker-id',
+            type=str,
+            help='Идентификатор процесса в кластере (по умолчанию: hostname:pid)',
+        )
 
     def handle(self, *args, **options):
-        def run_bots():
+        try:
+            asyncio.run(self.run_supervisor(options))
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Ошибка запуска ботов: {str(e)}')
+            )
+            return
+
+        self.stdout.write('Команда завершена')
+
+    async def run_supervisor(self, options):
+        coordinator = None
+        if options['shard']:
+            from telegram_bot.sharding import ShardCoordinator
+            coordinator = ShardCoordinator(
+                settings.BOT_SHARD_REDIS_URL,
+                worker_id=options.get('worker_id'),
+                lease_ttl=settings.BOT_SHARD_LEASE_TTL,
+            )
+            self.stdout.write(f'Шардирование включено, процесс {coordinator.worker_id}')
+
+        supervisor = BotSupervisor(
+            include_admin_bots=not options['no_admin_bots'],
+            sync_interval=options['sync_interval'],
+            startup_concurrency=options['startup_concurrency'],
+            pool_size=options['pool_size'],
+            get_updates_pool_size=options['get_updates_pool_size'],
+            measure_memory=options['measure_memory'],
+            coordinator=coordinator,
+        )
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                asyncio.run(start_all_bots())
-                self.stdout.write(
-                    self.style.SUCCESS('Все боты запущены успешно')
-                )
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Ошибка запуска ботов: {str(e)}')
-                )
-        
-        # Запускаем в отдельном потоке
-        thread = threading.Thread(target=run_bots)
-        thread.daemon = True
-        thread.start()
-        thread.join()
-        
-        self.stdout.write('Команда завершена') 
\ No newline at end of file
+                loop.add_signal_handler(sig, supervisor.stop)
+            except NotImplementedError:
+                pass
+
+        self.stdout.write(
+            self.style.SUCCESS('Супервизор ботов запущен')
+        )
+        await supervisor.run_forever()
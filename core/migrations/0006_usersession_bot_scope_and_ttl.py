@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-19 10:00
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_initial_expiry(apps, schema_editor):
+    UserSession = apps.get_model('core', 'UserSession')
+    UserSession.objects.using(schema_editor.connection.alias).update(
+        expires_at=F('updated_at') + timedelta(days=1)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_usersession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersession',
+            name='bot_id',
+            field=models.BigIntegerField(default=0, help_text='Числовой идентификатор бота, которому принадлежит сессия', verbose_name='ID бота Telegram'),
+        ),
+        migrations.AddField(
+            model_name='usersession',
+            name='version',
+            field=models.PositiveIntegerField(default=1, help_text='Увеличивается при каждом обновлении сессии', verbose_name='Версия'),
+        ),
+        migrations.AddField(
+            model_name='usersession',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True, verbose_name='Истекает'),
+        ),
+        migrations.RunPython(set_initial_expiry, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='usersession',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, verbose_name='Истекает'),
+        ),
+        migrations.AlterField(
+            model_name='usersession',
+            name='user_id',
+            field=models.BigIntegerField(verbose_name='ID пользователя Telegram'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersession',
+            unique_together={('bot_id', 'user_id')},
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-19 11:00
+
+import numpy as np
+from django.db import migrations, models
+
+
+# Frozen copies of the encoding at the time of this migration; app code may change later
+def encode_float32(vector):
+    return np.asarray(vector, dtype=np.float32).astype('<f4').tobytes()
+
+
+def decode_vector(data, vector_format):
+    if vector_format == 'float32':
+        return np.frombuffer(data, dtype='<f4')
+    if vector_format == 'float16':
+        return np.frombuffer(data, dtype='<f2').astype(np.float32)
+    if vector_format == 'int8':
+        scale = np.frombuffer(data, dtype='<f4', count=1)[0]
+        return np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+    raise ValueError(f"Unknown vector format: {vector_format}")
+
+
+def convert_json_vectors(apps, schema_editor):
+    Embedding = apps.get_model('core', 'Embedding')
+    db_alias = schema_editor.connection.alias
+
+    pending = Embedding.objects.using(db_alias).filter(
+        vector_data__isnull=True, embedding_vector__isnull=False
+    )
+    while True:
+        batch = list(pending.only('id', 'embedding_vector')[:500])
+        if not batch:
+            break
+        for embedding in batch:
+            embedding.vector_data = encode_float32(embedding.embedding_vector)
+            embedding.vector_format = 'float32'
+            embedding.embedding_vector = None
+        Embedding.objects.using(db_alias).bulk_update(
+            batch, ['vector_data', 'vector_format', 'embedding_vector']
+        )
+
+
+def restore_json_vectors(apps, schema_editor):
+    Embedding = apps.get_model('core', 'Embedding')
+    db_alias = schema_editor.connection.alias
+
+    pending = Embedding.objects.using(db_alias).filter(
+        embedding_vector__isnull=True, vector_data__isnull=False
+    )
+    while True:
+        batch = list(pending.only('id', 'vector_data', 'vector_format')[:500])
+        if not batch:
+            break
+        for embedding in batch:
+            embedding.embedding_vector = decode_vector(
+                bytes(embedding.vector_data), embedding.vector_format
+            ).tolist()
+        Embedding.objects.using(db_alias).bulk_update(batch, ['embedding_vector'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_usersession_bot_scope_and_ttl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embedding',
+            name='vector_data',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Векторное представление (бинарное)'),
+        ),
+        migrations.AddField(
+            model_name='embedding',
+            name='vector_format',
+            field=models.CharField(choices=[('float32', 'float32'), ('float16', 'float16'), ('int8', 'int8 (квантованный)')], default='float32', max_length=10, verbose_name='Формат вектора'),
+        ),
+        migrations.AlterField(
+            model_name='embedding',
+            name='embedding_vector',
+            field=models.JSONField(blank=True, help_text='Устаревший формат хранения, используется только для старых записей', null=True, verbose_name='Векторное представление (JSON)'),
+        ),
+        migrations.RunPython(convert_json_vectors, restore_json_vectors),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_embedding_binary_vectors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='embedding',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('content_chunk', config='russian'), name='embedding_content_fts_idx'),
+        ),
+    ]
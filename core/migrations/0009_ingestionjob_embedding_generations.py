@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_embedding_content_fts_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='embedding',
+            name='generation',
+            field=models.PositiveIntegerField(default=0, help_text='Номер задания индексации, создавшего набор векторов', verbose_name='Поколение'),
+        ),
+        migrations.AddField(
+            model_name='embedding',
+            name='is_active',
+            field=models.BooleanField(db_index=True, default=True, help_text='Новый набор векторов становится активным только после завершения индексации', verbose_name='Активно'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='embedding',
+            unique_together={('document', 'generation', 'chunk_index')},
+        ),
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('completed', 'Завершено'), ('failed', 'Ошибка')], db_index=True, default='pending', max_length=20, verbose_name='Статус')),
+                ('generation', models.PositiveIntegerField(help_text='Поколение векторов, которое создает задание', verbose_name='Поколение')),
+                ('content_hash', models.CharField(blank=True, help_text='Продолжить задание можно только для неизмененного документа', max_length=40, verbose_name='Хеш содержимого')),
+                ('total_chunks', models.PositiveIntegerField(default=0, verbose_name='Всего частей')),
+                ('processed_chunks', models.PositiveIntegerField(default=0, help_text='Контрольная точка: части с меньшим индексом уже сохранены', verbose_name='Обработано частей')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('error_message', models.TextField(blank=True, verbose_name='Сообщение об ошибке')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Время запуска')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время завершения')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_jobs', to='core.document', verbose_name='Документ')),
+            ],
+            options={
+                'verbose_name': 'Задание индексации',
+                'verbose_name_plural': 'Задания индексации',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
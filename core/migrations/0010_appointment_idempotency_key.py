@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_ingestionjob_embedding_generations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Повторный запрос с тем же ключом возвращает уже созданную запись', max_length=64, null=True, unique=True, verbose_name='Ключ идемпотентности'),
+        ),
+    ]
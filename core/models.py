@@ -1,8 +1,16 @@
-from django.db import models
+import hashlib
+import json
+
+import numpy as np
+from django.db import IntegrityError, models, transaction
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.validators import RegexValidator
 
+from .vectors import VECTOR_FORMAT_CHOICES, VECTOR_FORMAT_FLOAT32, encode_vector, decode_vector
+
 
 class User(AbstractUser):
     """Пользователь системы"""
@@ -292,6 +300,41 @@ class Client(models.Model):
         return f"{self.full_name} ({self.salon.name})"
 
 
+class AppointmentManager(models.Manager):
+    """Менеджер записей с идемпотентным созданием"""
+
+    @staticmethod
+    def make_idempotency_key(*parts):
+        """Ключ идемпотентности фиксированной длины из произвольных частей"""
+        return hashlib.sha256(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def create_idempotent(self, idempotency_key=None, **fields):
+        """
+        Создать запись; при повторе с тем же ключом вернуть уже созданную.
+
+        Возвращает (запись, создана ли она сейчас).
+        """
+        if not idempotency_key:
+            return self.create(**fields), True
+
+        existing = self.select_related('salon', 'service', 'master').filter(
+            idempotency_key=idempotency_key
+        ).first()
+        if existing is not None:
+            return existing, False
+        try:
+            with transaction.atomic():
+                return self.create(idempotency_key=idempotency_key, **fields), True
+        except IntegrityError:
+            # Параллельный повтор успел создать запись первым
+            existing = self.select_related('salon', 'service', 'master').filter(
+                idempotency_key=idempotency_key
+            ).first()
+            if existing is None:
+                raise
+            return existing, False
+
+
 class Appointment(models.Model):
     """Запись на прием"""
     STATUS_CHOICES = [
@@ -341,6 +384,14 @@ class Appointment(models.Model):
         blank=True, 
         verbose_name='Заметки'
     )
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        verbose_name='Ключ идемпотентности',
+        help_text='Повторный запрос с тем же ключом возвращает уже созданную запись'
+    )
     created_at = models.DateTimeField(
         auto_now_add=True, 
         verbose_name='Дата создания'
@@ -350,6 +401,8 @@ class Appointment(models.Model):
         verbose_name='Дата обновления'
     )
 
+    objects = AppointmentManager()
+
     class Meta:
         verbose_name = 'Запись'
         verbose_name_plural = 'Записи'
@@ -475,6 +528,14 @@ class Post(models.Model):
         return f"{self.salon.name} - {self.caption[:50]}..."
 
 
+class EmbeddingManager(models.Manager):
+    """Менеджер векторных представлений"""
+
+    def active(self):
+        """Только опубликованный набор векторов, по которому идет поиск"""
+        return self.filter(is_active=True)
+
+
 class Embedding(models.Model):
     """Векторное представление документа"""
     document = models.ForeignKey(
@@ -485,36 +546,258 @@ class Embedding(models.Model):
     chunk_index = models.PositiveIntegerField(
         verbose_name='Индекс части'
     )
+    generation = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Поколение',
+        help_text='Номер задания индексации, создавшего набор векторов'
+    )
+    is_active = models.BooleanField(
+        default=True,
+        db_index=True,
+        verbose_name='Активно',
+        help_text='Новый набор векторов становится активным только после завершения индексации'
+    )
     content_chunk = models.TextField(
         verbose_name='Часть содержимого'
     )
     embedding_vector = models.JSONField(
-        verbose_name='Векторное представление'
+        null=True,
+        blank=True,
+        verbose_name='Векторное представление (JSON)',
+        help_text='Устаревший формат хранения, используется только для старых записей'
+    )
+    vector_data = models.BinaryField(
+        null=True,
+        blank=True,
+        verbose_name='Векторное представление (бинарное)'
+    )
+    vector_format = models.CharField(
+        max_length=10,
+        choices=VECTOR_FORMAT_CHOICES,
+        default=VECTOR_FORMAT_FLOAT32,
+        verbose_name='Формат вектора'
     )
     created_at = models.DateTimeField(
         auto_now_add=True, 
         verbose_name='Дата создания'
     )
 
+    objects = EmbeddingManager()
+
     class Meta:
         verbose_name = 'Векторное представление'
         verbose_name_plural = 'Векторные представления'
-        unique_together = ['document', 'chunk_index']
+        unique_together = ['document', 'generation', 'chunk_index']
+        indexes = [
+            GinIndex(
+                SearchVector('content_chunk', config='russian'),
+                name='embedding_content_fts_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Embedding {self.document.name} - часть {self.chunk_index}"
 
+    @property
+    def vector(self):
+        """Вектор в виде numpy.ndarray (float32) или None"""
+        if self.vector_data is not None:
+            return decode_vector(self.vector_data, self.vector_format)
+        if self.embedding_vector is not None:
+            return np.asarray(self.embedding_vector, dtype=np.float32)
+        return None
+
+    def set_vector(self, vector, vector_format=None):
+        """Сохранить вектор в компактном бинарном формате"""
+        from django.conf import settings
+        self.vector_format = vector_format or settings.EMBEDDING_VECTOR_FORMAT
+        self.vector_data = encode_vector(vector, self.vector_format)
+        self.embedding_vector = None
+
+
+class IngestionJob(models.Model):
+    """Задание индексации документа"""
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('completed', 'Завершено'),
+        ('failed', 'Ошибка'),
+    ]
+    
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='ingestion_jobs',
+        verbose_name='Документ'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        db_index=True,
+        verbose_name='Статус'
+    )
+    generation = models.PositiveIntegerField(
+        verbose_name='Поколение',
+        help_text='Поколение векторов, которое создает задание'
+    )
+    content_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        verbose_name='Хеш содержимого',
+        help_text='Продолжить задание можно только для неизмененного документа'
+    )
+    total_chunks = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Всего частей'
+    )
+    processed_chunks = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Обработано частей',
+        help_text='Контрольная точка: части с меньшим индексом уже сохранены'
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Попыток'
+    )
+    error_message = models.TextField(
+        blank=True,
+        verbose_name='Сообщение об ошибке'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время запуска'
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время завершения'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    class Meta:
+        verbose_name = 'Задание индексации'
+        verbose_name_plural = 'Задания индексации'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Индексация {self.document.name} #{self.generation} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    @property
+    def progress(self):
+        """Доля обработанных частей от 0 до 1"""
+        if not self.total_chunks:
+            return 1.0 if self.status == 'completed' else 0.0
+        return self.processed_chunks / self.total_chunks
+
+
+class UserSessionManager(models.Manager):
+    """Менеджер сессий с атомарным upsert и учетом срока жизни"""
+
+    def active(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def get_active(self, bot_id, user_id):
+        """Вернуть неистекшую сессию пользователя для бота или None"""
+        return self.active().filter(bot_id=bot_id, user_id=user_id).first()
+
+    def upsert(self, bot_id, user_id, session_data, ttl=None, expected_version=None):
+        """
+        Атомарно создать или обновить сессию одним запросом
+        (INSERT ... ON CONFLICT DO UPDATE).
+
+        Если передан expected_version, существующая запись обновляется только
+        при совпадении версии (оптимистичная блокировка). Возвращает новую
+        версию сессии или None, если версия устарела.
+        """
+        from django.conf import settings
+        from django.db import connections
+
+        if ttl is None:
+            ttl = settings.USER_SESSION_TTL
+        now = timezone.now()
+        expires_at = now + ttl
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+
+        sql = f"""
+            INSERT INTO {table} (bot_id, user_id, session_data, version, expires_at, created_at, updated_at)
+            VALUES (%s, %s, %s, 1, %s, %s, %s)
+            ON CONFLICT (bot_id, user_id) DO UPDATE SET
+                session_data = EXCLUDED.session_data,
+                version = {table}.version + 1,
+                expires_at = EXCLUDED.expires_at,
+                updated_at = EXCLUDED.updated_at
+        """
+        params = [bot_id, user_id, json.dumps(session_data), expires_at, now, now]
+        if expected_version is not None:
+            sql += f" WHERE {table}.version = %s"
+            params.append(expected_version)
+        sql += " RETURNING version"
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def delete_expired(self, batch_size=1000):
+        """
+        Удалить истекшие сессии небольшими пачками, чтобы не держать
+        долгих блокировок. Возвращает количество удаленных записей.
+        """
+        deleted_total = 0
+        while True:
+            ids = list(
+                self.filter(expires_at__lte=timezone.now())
+                .order_by('expires_at')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            deleted, _ = self.filter(id__in=ids).delete()
+            deleted_total += deleted
+            if len(ids) < batch_size:
+                break
+        return deleted_total
+
 
 class UserSession(models.Model):
     """Сессия пользователя для Telegram бота"""
+    bot_id = models.BigIntegerField(
+        default=0,
+        verbose_name='ID бота Telegram',
+        help_text='Числовой идентификатор бота, которому принадлежит сессия'
+    )
     user_id = models.BigIntegerField(
-        verbose_name='ID пользователя Telegram',
-        unique=True
+        verbose_name='ID пользователя Telegram'
     )
     session_data = models.JSONField(
         default=dict,
         verbose_name='Данные сессии'
     )
+    version = models.PositiveIntegerField(
+        default=1,
+        verbose_name='Версия',
+        help_text='Увеличивается при каждом обновлении сессии'
+    )
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name='Истекает'
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата создания'
@@ -524,9 +807,12 @@ class UserSession(models.Model):
         verbose_name='Дата обновления'
     )
 
+    objects = UserSessionManager()
+
     class Meta:
         verbose_name = 'Сессия пользователя'
         verbose_name_plural = 'Сессии пользователей'
+        unique_together = ['bot_id', 'user_id']
 
     def __str__(self):
-        return f"Сессия пользователя {self.user_id}" 
\ No newline at end of file
+        return f"Сессия пользователя {self.user_id} (бот {self.bot_id})"
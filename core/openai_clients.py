@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+import httpx
+import openai
+from django.conf import settings
+
+from .instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+
+class ClientBusyError(Exception):
+    pass
+
+
+def get_salon_api_key(salon) -> str:
+    """OpenAI key for a salon: its own key, falling back to the owner's token"""
+    return salon.openai_api_key or salon.user.openai_api_token
+
+
+def _fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class _ClientEntry:
+    """Clients and the concurrency slots of one API key"""
+
+    def __init__(self, api_key: str, max_concurrency: int, max_retries: int, timeout: float):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.in_use = 0
+        self.retired = False
+        self._lock = threading.Lock()
+        self._sync_client = None
+        # httpx.AsyncClient connections belong to the loop that opened them
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_concurrency,
+            max_keepalive_connections=self.max_concurrency,
+        )
+
+    def sync_client(self) -> openai.OpenAI:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = openai.OpenAI(
+                    api_key=self.api_key,
+                    base_url=settings.OPENAI_BASE_URL or None,
+                    max_retries=self.max_retries,
+                    timeout=self.timeout,
+                    http_client=httpx.Client(limits=self._limits(), timeout=self.timeout),
+                )
+            return self._sync_client
+
+    def async_client(self) -> openai.AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=settings.OPENAI_BASE_URL or None,
+                    max_retries=self.max_retries,
+                    timeout=self.timeout,
+                    http_client=httpx.AsyncClient(limits=self._limits(), timeout=self.timeout),
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def pop_async_client(self, loop) -> Optional[openai.AsyncOpenAI]:
+        with self._lock:
+            return self._async_clients.pop(loop, None)
+
+    def close(self):
+        """Close the pooled sync connections and ask live loops to close their async pools"""
+        with self._lock:
+            client, self._sync_client = self._sync_client, None
+            async_clients = list(self._async_clients.items())
+            self._async_clients = weakref.WeakKeyDictionary()
+        if client is not None:
+            try:
+                client.close()
+            except Exception as e:
+                logger.error(f"Error closing OpenAI client: {str(e)}")
+        for loop, async_client in async_clients:
+            # Connections of a closed loop cannot be closed any more
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(loop.create_task, async_client.close())
+            except RuntimeError:
+                pass
+
+
+class OpenAIClientRegistry:
+    """
+    Configured OpenAI clients shared per API key.
+
+    Each key gets its own client with a pooled HTTP connection set, a cap on
+    concurrent requests and the SDK's retry policy (429/5xx with backoff),
+    so no request can ever go out with another salon's key. Callers pass
+    the key they just read from the salon; when an owner's key changes the
+    client of the old key is retired, and the least recently used keys are
+    evicted beyond max_clients.
+
+    Slots are threading semaphores (cooperative under gevent monkey
+    patching); async callers poll them without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        max_clients: int = 256,
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        timeout: float = 30.0,
+        acquire_timeout: float = 30.0,
+    ):
+        self.max_clients = max_clients
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self._entries: OrderedDict = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, api_key: str, owner: Optional[str] = None) -> _ClientEntry:
+        if not api_key:
+            raise ValueError('OpenAI API key is not configured')
+        fingerprint = _fingerprint(api_key)
+        evicted = []
+
+        with self._lock:
+            if owner is not None:
+                previous = self._owners.get(owner)
+                self._owners[owner] = fingerprint
+                if previous and previous != fingerprint and previous not in self._owners.values():
+                    logger.info(f"OpenAI key rotated for {owner}")
+                    old = self._entries.pop(previous, None)
+                    if old is not None:
+                        evicted.append(old)
+
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = _ClientEntry(api_key, self.max_concurrency, self.max_retries, self.timeout)
+                self._entries[fingerprint] = entry
+            self._entries.move_to_end(fingerprint)
+
+            while len(self._entries) > self.max_clients:
+                _, old = self._entries.popitem(last=False)
+                evicted.append(old)
+
+            if evicted:
+                # Forget owners of evicted keys so _owners stays bounded by live clients
+                live = set(self._entries)
+                for name in [name for name, value in self._owners.items() if value not in live]:
+                    del self._owners[name]
+
+            entry.in_use += 1
+
+        for old in evicted:
+            self._retire(old)
+        return entry
+
+    def _retire(self, entry: _ClientEntry):
+        with self._lock:
+            entry.retired = True
+            idle = not entry.in_use
+        if idle:
+            entry.close()
+
+    def _release(self, entry: _ClientEntry):
+        with self._lock:
+            entry.in_use -= 1
+            close = entry.retired and not entry.in_use
+        if close:
+            entry.close()
+
+    @contextmanager
+    def client(self, api_key: str, owner: Optional[str] = None):
+        """Yield a sync client for api_key holding one of its concurrency slots"""
+        entry = self._entry(api_key, owner)
+        try:
+            with stage('openai'):
+                if not entry.slots.acquire(timeout=self.acquire_timeout):
+                    raise ClientBusyError(f"All {entry.max_concurrency} OpenAI slots are busy")
+                try:
+                    yield entry.sync_client()
+                finally:
+                    entry.slots.release()
+        finally:
+            self._release(entry)
+
+    @asynccontextmanager
+    async def async_client(self, api_key: str, owner: Optional[str] = None):
+        """Yield an async client for api_key bound to the running loop"""
+        entry = self._entry(api_key, owner)
+        try:
+            with stage('openai'):
+                deadline = time.monotonic() + self.acquire_timeout
+                delay = 0.005
+                while not entry.slots.acquire(blocking=False):
+                    if time.monotonic() >= deadline:
+                        raise ClientBusyError(f"All {entry.max_concurrency} OpenAI slots are busy")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 0.05)
+                try:
+                    yield entry.async_client()
+                finally:
+                    entry.slots.release()
+        finally:
+            self._release(entry)
+
+    async def close_loop_clients(self):
+        """
+        Close the async clients bound to the running loop.
+
+        Call before closing a short-lived loop (one per webhook update),
+        otherwise its connections are left open until garbage collection.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            client = entry.pop_async_client(loop)
+            if client is None:
+                continue
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"Error closing OpenAI client: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'clients': len(self._entries),
+                'owners': len(self._owners),
+                'in_use': sum(entry.in_use for entry in self._entries.values()),
+            }
+
+
+openai_clients = OpenAIClientRegistry(
+    max_clients=settings.OPENAI_CLIENT_POOL_SIZE,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY_PER_KEY,
+    max_retries=settings.OPENAI_MAX_RETRIES,
+    timeout=settings.OPENAI_TIMEOUT,
+)
@@ -0,0 +1,146 @@
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+logger = logging.getLogger(__name__)
+
+# Query parameter forcing an exact count in the admin and the API
+EXACT_COUNT_PARAM = 'exact_count'
+
+
+def is_exact_count_requested(value) -> bool:
+    return value is not None and str(value).lower() not in ('', '0', 'false', 'no')
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """
+    PostgreSQL's estimate of the number of rows in queryset, or None.
+
+    An unfiltered queryset gets the table's pg_class.reltuples (kept up
+    to date by autovacuum/ANALYZE); a filtered one gets the planner's row
+    estimate from EXPLAIN. Neither reads the table.
+    """
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    query = queryset.query
+    try:
+        with connection.cursor() as cursor:
+            if not query.where and not query.distinct and not query.combinator:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(queryset.model._meta.db_table)],
+                )
+                row = cursor.fetchone()
+                # -1 until the table has been vacuumed or analyzed once
+                return row[0] if row and row[0] >= 0 else None
+
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.error(f"Error estimating row count: {str(e)}")
+        return None
+
+
+class EstimatedPage(Page):
+    """Page of an estimated paginator; whether a next page exists comes from one extra fetched row"""
+
+    def __init__(self, object_list, number, paginator, has_next: bool):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        if not self._has_next:
+            raise EmptyPage('That page contains no results')
+        return self.number + 1
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self.object_list)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts PostgreSQL's row estimate for large result sets.
+
+    An exact COUNT(*) is only run when the estimate is below
+    PAGINATION_ESTIMATE_THRESHOLD, when exact is set or when the
+    PAGINATION_EXACT_COUNT setting is on. With an estimate, count is only a
+    figure to display (estimated tells whether it is one): pages are not
+    bounded by it, each page fetches per_page + 1 rows and has_next() comes
+    from the extra row.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, exact=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.exact = settings.PAGINATION_EXACT_COUNT if exact is None else exact
+        self.estimated = False
+        self._has_next = {}
+
+    @cached_property
+    def count(self):
+        if not self.exact:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= settings.PAGINATION_ESTIMATE_THRESHOLD:
+                self.estimated = True
+                return estimate
+        return Paginator.count.func(self)
+
+    def validate_number(self, number):
+        # Reading count decides whether it is estimated
+        if self.count is not None and not self.estimated:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        self._has_next[number] = len(rows) > self.per_page
+        return EstimatedPage(rows[:self.per_page], number, self, self._has_next[number])
+
+    def get_elided_page_range(self, number=1, *, on_each_side=3, on_ends=2):
+        number = self.validate_number(number)
+        if not self.estimated:
+            yield from super().get_elided_page_range(number, on_each_side=on_each_side, on_ends=on_ends)
+            return
+
+        # Only pages known to exist: the ones before number and the next one
+        first = max(1, number - on_each_side)
+        if first > on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+        else:
+            first = 1
+        yield from range(first, number + 1)
+        if self._has_next.get(number):
+            yield number + 1
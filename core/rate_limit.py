@@ -0,0 +1,91 @@
+import logging
+import random
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count for budgeting without a tokenizer.
+
+    Four UTF-8 bytes per token matches English closely and slightly
+    overestimates Cyrillic text, which is the safe side for a budget.
+    """
+    return max(1, len(text.encode('utf-8')) // 4)
+
+
+class GlobalRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget shared by all workers.
+
+    Usage is counted in one-minute windows in the shared cache (Redis), so
+    every Celery worker and web process draws from the same budget. A call
+    that does not fit is rolled back and retried in the next window.
+    A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, name: str, rpm: int = 0, tpm: int = 0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+
+    def _window_keys(self, window: int):
+        prefix = f"ratelimit:{self.name}:{window}"
+        return f"{prefix}:requests", f"{prefix}:tokens"
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """Take budget for one request; returns 0 on success or seconds to wait"""
+        if not self.rpm and not self.tpm:
+            return 0.0
+
+        now = time.time()
+        window = int(now // 60)
+        requests_key, tokens_key = self._window_keys(window)
+        cache.add(requests_key, 0, 120)
+        cache.add(tokens_key, 0, 120)
+
+        used_requests = cache.incr(requests_key)
+        used_tokens = cache.incr(tokens_key, tokens)
+        # A single request larger than the whole budget may run in an empty window
+        fits_tokens = not self.tpm or used_tokens <= self.tpm or used_tokens == tokens
+        if (not self.rpm or used_requests <= self.rpm) and fits_tokens:
+            return 0.0
+
+        cache.decr(requests_key)
+        cache.decr(tokens_key, tokens)
+        return (window + 1) * 60 - now
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None) -> float:
+        """Block until the request fits the budget; returns the time waited"""
+        started = time.monotonic()
+        while True:
+            try:
+                wait = self.try_acquire(tokens)
+            except Exception as e:
+                # The budget is advisory, do not stop ingestion when the cache is down
+                logger.error(f"Error checking rate limit {self.name}: {str(e)}")
+                return 0.0
+            if not wait:
+                return time.monotonic() - started
+
+            # Spread waiting workers over the start of the next window
+            wait += random.uniform(0, 1)
+            if timeout is not None and time.monotonic() - started + wait > timeout:
+                raise RateLimitTimeout(f"Rate limit {self.name} not available within {timeout}s")
+            time.sleep(wait)
+
+
+embedding_rate_limiter = GlobalRateLimiter(
+    'openai:embeddings',
+    rpm=settings.OPENAI_EMBEDDING_RPM,
+    tpm=settings.OPENAI_EMBEDDING_TPM,
+)
@@ -0,0 +1,179 @@
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import Document, Embedding, IngestionJob
+from .rate_limit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+TRAFFIC_DAYS = 7
+
+
+def _traffic_key(salon_id, day) -> str:
+    return f"question_traffic:{salon_id}:{day:%Y%m%d}"
+
+
+def record_question(salon_id):
+    """Count a bot question for the salon (used to prioritize re-indexing)"""
+    key = _traffic_key(salon_id, timezone.now().date())
+    try:
+        cache.add(key, 0, (TRAFFIC_DAYS + 1) * 86400)
+        cache.incr(key)
+    except Exception as e:
+        logger.error(f"Error recording question traffic for salon {salon_id}: {str(e)}")
+
+
+def question_traffic(salon_ids: Iterable, days: int = TRAFFIC_DAYS) -> Dict[str, int]:
+    """Questions asked per salon over the last days, fetched in one cache round-trip"""
+    today = timezone.now().date()
+    keys = {
+        _traffic_key(salon_id, today - timedelta(days=offset)): str(salon_id)
+        for salon_id in salon_ids
+        for offset in range(days)
+    }
+    traffic = {salon_id: 0 for salon_id in keys.values()}
+    try:
+        for key, count in cache.get_many(list(keys)).items():
+            traffic[keys[key]] += int(count)
+    except Exception as e:
+        logger.error(f"Error reading question traffic: {str(e)}")
+    return traffic
+
+
+@dataclass
+class ReindexItem:
+    """Document scheduled for re-indexing with its cost estimate"""
+    document_id: int
+    document_name: str
+    salon_id: int
+    traffic: int
+    chunks: int
+    tokens: int
+    # Size taken from the active embeddings rather than measured from the file
+    from_embeddings: bool
+
+
+def plan_reindex(salon_ids: Optional[List] = None, doc_types: Optional[List[str]] = None) -> List[ReindexItem]:
+    """
+    List documents to re-index, busiest salons first.
+
+    Sizes come from the active embedding set when a document has one;
+    documents that were never indexed are read and chunked to estimate.
+    """
+    from .tasks import read_document_content, split_text_into_chunks
+
+    documents = Document.objects.select_related('salon').order_by('salon_id', 'id')
+    if salon_ids:
+        documents = documents.filter(salon_id__in=salon_ids)
+    if doc_types:
+        documents = documents.filter(doc_type__in=doc_types)
+    documents = list(documents)
+
+    sizes = {
+        row['document_id']: row
+        for row in Embedding.objects.active()
+        .filter(document__in=documents)
+        .values('document_id')
+        .annotate(chunks=Count('id'), characters=Sum(Length('content_chunk')))
+    }
+    traffic = question_traffic({document.salon_id for document in documents})
+
+    plan = []
+    for document in documents:
+        size = sizes.get(document.id)
+        if size:
+            # Cyrillic is two UTF-8 bytes per character
+            chunks, tokens, from_embeddings = size['chunks'], max(1, size['characters'] // 2), True
+        else:
+            content = read_document_content(document)
+            chunks_text = split_text_into_chunks(content) if content else []
+            chunks = len(chunks_text)
+            tokens = sum(estimate_tokens(chunk) for chunk in chunks_text)
+            from_embeddings = False
+        plan.append(ReindexItem(
+            document_id=document.id,
+            document_name=document.name,
+            salon_id=document.salon_id,
+            traffic=traffic.get(str(document.salon_id), 0),
+            chunks=chunks,
+            tokens=tokens,
+            from_embeddings=from_embeddings,
+        ))
+
+    plan.sort(key=lambda item: (-item.traffic, item.salon_id, item.document_id))
+    return plan
+
+
+def estimate_cost(tokens: int) -> float:
+    """Embedding cost in USD for the given number of tokens"""
+    return tokens / 1000 * settings.OPENAI_EMBEDDING_PRICE_PER_1K_TOKENS
+
+
+def enqueue_reindex(plan: Iterable[ReindexItem]) -> List[int]:
+    """
+    Start an ingestion job for every planned document and queue it.
+
+    Tasks are published in plan order, so with a FIFO broker the busiest
+    salons are embedded first; the shared rate limiter keeps the whole
+    fleet of workers within the API budget.
+    """
+    from .tasks import generate_document_embeddings, get_or_create_ingestion_job
+
+    job_ids = []
+    for item in plan:
+        document = Document.objects.get(id=item.document_id)
+        job = get_or_create_ingestion_job(document)
+        if job.status == 'pending':
+            generate_document_embeddings.delay(document.id, job_id=job.id)
+        job_ids.append(job.id)
+    return job_ids
+
+
+@dataclass
+class ReindexProgress:
+    """Snapshot of a re-index run"""
+    total: int
+    completed: int
+    failed: int
+    running: int
+    processed_chunks: int
+    total_chunks: int
+    elapsed: float
+
+    @property
+    def finished(self) -> bool:
+        return self.completed + self.failed >= self.total
+
+    @property
+    def chunks_per_minute(self) -> float:
+        return self.processed_chunks / self.elapsed * 60 if self.elapsed else 0.0
+
+
+def reindex_progress(job_ids: List[int], started: float, baseline_chunks: int = 0) -> ReindexProgress:
+    """Aggregate job state for a run started at time.monotonic() == started"""
+    counts = dict(
+        IngestionJob.objects.filter(id__in=job_ids)
+        .values_list('status')
+        .annotate(count=Count('id'))
+    )
+    totals = IngestionJob.objects.filter(id__in=job_ids).aggregate(
+        processed=Sum('processed_chunks'), total=Sum('total_chunks')
+    )
+    return ReindexProgress(
+        total=len(job_ids),
+        completed=counts.get('completed', 0),
+        failed=counts.get('failed', 0),
+        running=counts.get('running', 0),
+        processed_chunks=max((totals['processed'] or 0) - baseline_chunks, 0),
+        total_chunks=totals['total'] or 0,
+        elapsed=time.monotonic() - started,
+    )
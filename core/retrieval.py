@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .db import db_executor
+from .models import Embedding
+from .search import filter_embeddings, lexical_search, reciprocal_rank_fusion
+from .tasks import embed_query
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_tags(tags: str) -> FrozenSet[str]:
+    return frozenset(tag.strip().lower() for tag in (tags or '').split(',') if tag.strip())
+
+
+@dataclass
+class VectorIndex:
+    """Row-normalized embedding matrix of one salon with per-row metadata"""
+    matrix: np.ndarray
+    rows: List[Dict]
+    doc_types: np.ndarray
+    tags: List[FrozenSet[str]]
+    version: int
+    loaded_at: float
+
+    def mask(self, doc_types: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None) -> Optional[np.ndarray]:
+        """Boolean row mask for the doc_type / tag filters, None when unfiltered"""
+        mask = None
+        doc_types = [doc_type for doc_type in (doc_types or []) if doc_type]
+        if doc_types:
+            mask = np.isin(self.doc_types, doc_types)
+
+        wanted = _parse_tags(','.join(tags or []))
+        if wanted:
+            tag_mask = np.fromiter((bool(row & wanted) for row in self.tags), dtype=bool, count=len(self.tags))
+            mask = tag_mask if mask is None else mask & tag_mask
+        return mask
+
+    def score(self, query_embedding: List[float], limit: int, mask: Optional[np.ndarray] = None) -> List[Dict]:
+        """Top rows by cosine similarity to the query embedding"""
+        if not self.rows:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm or query.shape[0] != self.matrix.shape[1]:
+            return []
+
+        similarities = self.matrix @ (query / norm)
+        if mask is not None:
+            similarities = np.where(mask, similarities, -np.inf)
+            limit = min(limit, int(mask.sum()))
+        limit = min(limit, len(self.rows))
+        if limit <= 0:
+            return []
+
+        top = np.argpartition(-similarities, limit - 1)[:limit]
+        top = top[np.argsort(-similarities[top])]
+        return [dict(self.rows[i], similarity=float(similarities[i])) for i in top]
+
+
+class RetrievalService:
+    """
+    Low-latency document retrieval for interactive callers.
+
+    Each salon's embeddings are decoded once into a normalized matrix and
+    kept in an LRU of indexes; scoring runs in a thread pool (numpy releases
+    the GIL for the matrix product) so the event loop is never blocked.
+    Indexes are reloaded when their TTL passes or when invalidate() bumps
+    the salon's version in the shared cache, which works across processes.
+
+    search() enforces a hard latency budget: whatever retrievers finished
+    within it are fused and returned, the rest are abandoned.
+    """
+
+    def __init__(self, max_salons: int = 64, ttl: float = 300, workers: int = 4, budget: float = 1.5):
+        self.max_salons = max_salons
+        self.ttl = ttl
+        self.budget = budget
+        self._indexes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='retrieval')
+
+    def _version_key(self, salon_id) -> str:
+        return f"retrieval:version:{salon_id}"
+
+    def invalidate(self, salon_id):
+        """Force every process to reload the salon's index on its next search"""
+        key = self._version_key(salon_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+        except Exception as e:
+            logger.error(f"Error invalidating retrieval index for salon {salon_id}: {str(e)}")
+        with self._lock:
+            self._indexes.pop(str(salon_id), None)
+
+    def version(self, salon_id) -> int:
+        """Current version of the salon's embeddings, bumped by invalidate()"""
+        try:
+            return cache.get(self._version_key(salon_id), 0)
+        except Exception as e:
+            logger.error(f"Error reading retrieval index version: {str(e)}")
+            return 0
+
+    def get_index(self, salon_id) -> VectorIndex:
+        """Return the salon's index, loading it if missing, stale or outdated"""
+        key = str(salon_id)
+        version = self.version(salon_id)
+
+        with self._lock:
+            index = self._indexes.get(key)
+            if index and index.version == version and time.monotonic() - index.loaded_at < self.ttl:
+                self._indexes.move_to_end(key)
+                return index
+
+        index = self._load_index(salon_id, version)
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_salons:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _load_index(self, salon_id, version: int) -> VectorIndex:
+        started = time.perf_counter()
+        embeddings = (
+            Embedding.objects.active().filter(document__salon_id=salon_id)
+            .select_related('document')
+            .only(
+                'id', 'content_chunk', 'vector_data', 'vector_format', 'embedding_vector',
+                'document__name', 'document__doc_type', 'document__tags',
+            )
+            .iterator(chunk_size=500)
+        )
+
+        rows, vectors, doc_types, tags = [], [], [], []
+        dimensions = None
+        for embedding in embeddings:
+            vector = embedding.vector
+            if vector is None:
+                continue
+            if dimensions is None:
+                dimensions = vector.shape[0]
+            elif vector.shape[0] != dimensions:
+                logger.warning(f"Skipping embedding {embedding.id}: {vector.shape[0]} dimensions, expected {dimensions}")
+                continue
+            vectors.append(vector)
+            doc_types.append(embedding.document.doc_type)
+            tags.append(_parse_tags(embedding.document.tags))
+            rows.append({
+                'embedding_id': str(embedding.id),
+                'document_id': str(embedding.document_id),
+                'document_name': embedding.document.name,
+                'doc_type': embedding.document.doc_type,
+                'content_chunk': embedding.content_chunk,
+            })
+
+        if vectors:
+            matrix = np.vstack(vectors).astype(np.float32, copy=False)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            matrix /= norms
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        logger.info(
+            f"Loaded retrieval index for salon {salon_id}: {len(rows)} chunks "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return VectorIndex(
+            matrix=matrix,
+            rows=rows,
+            doc_types=np.array(doc_types, dtype=object),
+            tags=tags,
+            version=version,
+            loaded_at=time.monotonic(),
+        )
+
+    async def embed(self, openai_api_key: str, query: str) -> List[float]:
+        """Embed a query without blocking the event loop"""
+        return await sync_to_async(embed_query, thread_sensitive=False)(openai_api_key, query)
+
+    async def rank(
+        self,
+        salon_id,
+        query_embedding: List[float],
+        limit: int = 10,
+        doc_types: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+    ) -> List[Dict]:
+        """Vector-only ranking of the salon's chunks"""
+        index = await db_executor.run(self.get_index, salon_id)
+        mask = index.mask(doc_types, tags)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, index.score, query_embedding, limit, mask)
+
+    async def _lexical(self, salon_id, query, limit, doc_types, tags):
+        queryset = filter_embeddings(Embedding.objects.active(), doc_types, tags)
+        return await db_executor.run(lexical_search, salon_id, query, limit, queryset)
+
+    async def _vector(self, salon_id, query, limit, doc_types, tags, openai_api_key, query_embedding):
+        if query_embedding is None:
+            query_embedding = await self.embed(openai_api_key, query)
+        return await self.rank(salon_id, query_embedding, limit, doc_types, tags)
+
+    async def search(
+        self,
+        salon_id,
+        query: str,
+        limit: int = 10,
+        openai_api_key: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+        doc_types: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+        budget: Optional[float] = None,
+    ) -> List[Dict]:
+        """
+        Hybrid full-text and vector search within a latency budget (seconds).
+
+        The vector retriever runs only when an API key or a precomputed
+        query embedding is given.
+        """
+        budget = self.budget if budget is None else budget
+        candidates = max(limit, settings.SEARCH_CANDIDATES)
+
+        tasks = {'lexical': asyncio.ensure_future(self._lexical(salon_id, query, candidates, doc_types, tags))}
+        if openai_api_key or query_embedding is not None:
+            tasks['vector'] = asyncio.ensure_future(
+                self._vector(salon_id, query, candidates, doc_types, tags, openai_api_key, query_embedding)
+            )
+
+        done, pending = await asyncio.wait(tasks.values(), timeout=budget)
+        for task in pending:
+            task.cancel()
+
+        result_lists = {}
+        for name, task in tasks.items():
+            if task not in done:
+                logger.warning(f"{name} retrieval for salon {salon_id} exceeded the {budget}s budget")
+            elif task.exception() is not None:
+                logger.error(f"Error in {name} retrieval for salon {salon_id}: {str(task.exception())}")
+            else:
+                result_lists[name] = task.result()
+
+        return reciprocal_rank_fusion(result_lists, k=settings.SEARCH_RRF_K)[:limit]
+
+    def search_sync(self, salon_id, query: str, **kwargs) -> List[Dict]:
+        """search() for synchronous callers such as DRF views and Celery tasks"""
+        return async_to_sync(self.search)(salon_id, query, **kwargs)
+
+
+retrieval_service = RetrievalService(
+    max_salons=settings.RETRIEVAL_INDEX_MAX_SALONS,
+    ttl=settings.RETRIEVAL_INDEX_TTL,
+    workers=settings.RETRIEVAL_WORKERS,
+    budget=settings.RETRIEVAL_BUDGET,
+)
@@ -0,0 +1,88 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, Q
+
+from .models import Embedding
+
+SEARCH_CONFIG = 'russian'
+
+# Must match the expression of the embedding_content_fts_idx GIN index
+CONTENT_SEARCH_VECTOR = SearchVector('content_chunk', config=SEARCH_CONFIG)
+
+
+def filter_embeddings(queryset, doc_types: Optional[Iterable[str]] = None, tags: Optional[Iterable[str]] = None):
+    """Restrict embeddings to documents of the given types carrying any of the given tags"""
+    doc_types = [doc_type for doc_type in (doc_types or []) if doc_type]
+    if doc_types:
+        queryset = queryset.filter(document__doc_type__in=doc_types)
+
+    # Document.tags is a comma separated string, match whole tags only
+    tag_filter = Q()
+    for tag in tags or []:
+        tag = tag.strip()
+        if tag:
+            tag_filter |= Q(document__tags__iregex=rf'(^|,)\s*{re.escape(tag)}\s*(,|$)')
+    if tag_filter:
+        queryset = queryset.filter(tag_filter)
+    return queryset
+
+
+def lexical_search(salon_id, query: str, limit: int = 50, queryset=None) -> List[Dict]:
+    """Rank embeddings of a salon by Postgres full-text relevance to the query"""
+    if queryset is None:
+        queryset = Embedding.objects.active()
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+
+    rows = (
+        queryset.filter(document__salon_id=salon_id)
+        .annotate(search=CONTENT_SEARCH_VECTOR)
+        .filter(search=search_query)
+        .annotate(rank=SearchRank(F('search'), search_query))
+        .order_by('-rank', 'id')
+        .values('id', 'document_id', 'document__name', 'document__doc_type', 'content_chunk', 'rank')[:limit]
+    )
+
+    return [{
+        'embedding_id': str(row['id']),
+        'document_id': str(row['document_id']),
+        'document_name': row['document__name'],
+        'doc_type': row['document__doc_type'],
+        'content_chunk': row['content_chunk'],
+        'rank': float(row['rank']),
+    } for row in rows]
+
+
+def reciprocal_rank_fusion(result_lists: Dict[str, List[Dict]], k: int = 60) -> List[Dict]:
+    """
+    Merge ranked result lists by reciprocal-rank fusion.
+
+    Every result scores sum(1 / (k + position)) over the lists it appears
+    in, so results found by both retrievers rise to the top without having
+    to calibrate text rank against cosine similarity.
+    """
+    fused = {}
+    for name, results in result_lists.items():
+        for position, result in enumerate(results, start=1):
+            entry = fused.get(result['embedding_id'])
+            if entry is None:
+                entry = {
+                    'embedding_id': result['embedding_id'],
+                    'document_id': result['document_id'],
+                    'document_name': result['document_name'],
+                    'doc_type': result['doc_type'],
+                    'content_chunk': result['content_chunk'],
+                    'score': 0.0,
+                    'lexical_rank': None,
+                    'vector_rank': None,
+                    'similarity': None,
+                }
+                fused[result['embedding_id']] = entry
+            entry['score'] += 1.0 / (k + position)
+            entry[f"{name}_rank"] = position
+            if 'similarity' in result:
+                entry['similarity'] = result['similarity']
+
+    return sorted(fused.values(), key=lambda entry: entry['score'], reverse=True)
+
@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import catalog_cache
+from .models import Salon, Master, Service
+
+
+def bump_catalog_version(salon_id):
+    """Invalidate the salon catalog once the current transaction commits"""
+    transaction.on_commit(lambda: catalog_cache.bump(salon_id))
+
+
+@receiver(post_save, sender=Salon)
+@receiver(post_delete, sender=Salon)
+def salon_changed(sender, instance, **kwargs):
+    bump_catalog_version(instance.id)
+
+
+@receiver(post_save, sender=Master)
+@receiver(post_delete, sender=Master)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def catalog_item_changed(sender, instance, **kwargs):
+    bump_catalog_version(instance.salon_id)
@@ -1,76 +1,191 @@
 from celery import shared_task
 from django.utils import timezone
 from django.conf import settings
-import openai
+from django.db import transaction
+from django.db.models import Max, Q
+import hashlib
 import logging
+import os
 from datetime import timedelta
 import json
 import requests
 from typing import List, Dict
+import numpy as np
 
-from .models import Document, Embedding, Appointment, Post, Salon, Client
+from .models import Document, Embedding, IngestionJob, Appointment, Post, Salon, Client, UserSession
+from .embedding_cache import query_embedding_cache
+from .instrumentation import count_external_call, count_rows, mark_task_error
+from .openai_clients import get_salon_api_key, openai_clients
+from .rate_limit import embedding_rate_limiter, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def generate_document_embeddings(document_id: str):
-    """Generate embeddings for a document using OpenAI API"""
+class NonRetryableIngestionError(Exception):
+    """Ingestion failure that a retry cannot fix (missing key, unreadable or empty document)"""
+    pass
+
+
+def get_or_create_ingestion_job(document: Document) -> IngestionJob:
+    """
+    Return the job that should (re)index a document.
+    
+    An unfinished job that is still making progress is returned as is, a
+    failed or stalled job is reset to pending so it resumes from its
+    checkpoint, otherwise a new job with the next generation is created.
+    """
+    with transaction.atomic():
+        Document.objects.select_for_update().filter(id=document.id).first()
+        job = document.ingestion_jobs.exclude(status='completed').order_by('-created_at').first()
+        
+        if job is not None:
+            stalled = timezone.now() - job.updated_at > timedelta(seconds=settings.INGESTION_STALL_TIMEOUT)
+            if job.status == 'pending' or (job.status == 'running' and not stalled):
+                return job
+            job.status = 'pending'
+            job.error_message = ''
+            job.save(update_fields=['status', 'error_message', 'updated_at'])
+            return job
+        
+        last_generation = document.ingestion_jobs.aggregate(Max('generation'))['generation__max'] or 0
+        return IngestionJob.objects.create(document=document, generation=last_generation + 1)
+
+
+@shared_task(bind=True, max_retries=3, acks_late=True, reject_on_worker_lost=True)
+def generate_document_embeddings(self, document_id: str, job_id=None):
+    """
+    Generate embeddings for a document using OpenAI API.
+    
+    Chunks are written as an inactive generation and checkpointed one by
+    one; the new set replaces the active one in a single transaction once
+    every chunk is stored, so searches never see a partial index. A failed
+    run is retried and continues from the last checkpoint.
+    """
     try:
-        document = Document.objects.get(id=document_id)
-        salon = document.salon
-        
-        # Get OpenAI API key from user settings
-        openai_api_key = salon.user.openai_api_token
+        document = Document.objects.select_related('salon__user').get(id=document_id)
+    except Document.DoesNotExist:
+        logger.error(f"Document {document_id} not found")
+        mark_task_error()
+        return
+    
+    if job_id is None:
+        job_id = get_or_create_ingestion_job(document).id
+    
+    # Claim the job so that duplicate deliveries do not index it twice
+    stalled_before = timezone.now() - timedelta(seconds=settings.INGESTION_STALL_TIMEOUT)
+    claimed = IngestionJob.objects.filter(id=job_id).filter(
+        Q(status__in=['pending', 'failed']) | Q(status='running', updated_at__lt=stalled_before)
+    ).update(status='running', updated_at=timezone.now())
+    if not claimed:
+        # Redelivered after its worker died (acks_late), the job is still marked
+        # running; look again once it counts as stalled and can be resumed.
+        # A plain duplicate delivery just leaves the job to the running worker.
+        redelivered = (self.request.delivery_info or {}).get('redelivered')
+        if (
+            redelivered
+            and self.request.retries < self.max_retries
+            and IngestionJob.objects.filter(id=job_id, status='running').exists()
+        ):
+            logger.info(f"Ingestion job {job_id} is running, checking again in {settings.INGESTION_STALL_TIMEOUT}s")
+            raise self.retry(
+                kwargs={'document_id': document_id, 'job_id': job_id},
+                countdown=settings.INGESTION_STALL_TIMEOUT
+            )
+        logger.info(f"Ingestion job {job_id} is already running or finished")
+        return
+    job = IngestionJob.objects.get(id=job_id)
+    salon = document.salon
+    
+    try:
+        openai_api_key = get_salon_api_key(salon)
         if not openai_api_key:
-            logger.error(f"No OpenAI API key found for user {salon.user.username}")
-            return
-        
-        # Configure OpenAI client
-        openai.api_key = openai_api_key
+            raise NonRetryableIngestionError(f"No OpenAI API key found for salon {salon.id}")
         
         # Read document content
         content = read_document_content(document)
         if not content:
-            logger.error(f"Could not read content from document {document.id}")
-            return
+            raise NonRetryableIngestionError(f"Could not read content from document {document.id}")
         
         # Split content into chunks (max 8000 characters per chunk)
         chunks = split_text_into_chunks(content, max_length=8000)
+        content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        
+        staged = Embedding.objects.filter(document=document, generation=job.generation)
+        if job.content_hash != content_hash:
+            # Document changed since the checkpoint, start the generation over
+            staged.delete()
+            job.content_hash = content_hash
+            job.processed_chunks = 0
+        else:
+            # Drop chunks written after the last checkpoint
+            staged.filter(chunk_index__gte=job.processed_chunks).delete()
+        
+        job.status = 'running'
+        job.total_chunks = len(chunks)
+        job.attempts += 1
+        job.error_message = ''
+        job.started_at = job.started_at or timezone.now()
+        job.save()
+        
+        if job.processed_chunks:
+            logger.info(f"Resuming ingestion job {job.id} for document {document.id} at chunk {job.processed_chunks}")
+        
+        # Generate embeddings for each remaining chunk
+        for index in range(job.processed_chunks, len(chunks)):
+            embedding_rate_limiter.acquire(estimate_tokens(chunks[index]))
+            with openai_clients.client(openai_api_key, owner=f"salon:{salon.id}") as client:
+                response = client.embeddings.create(
+                    model=settings.OPENAI_EMBEDDING_MODEL,
+                    input=chunks[index]
+                )
+            count_external_call('openai')
+            
+            embedding = Embedding(
+                document=document,
+                content_chunk=chunks[index],
+                chunk_index=index,
+                generation=job.generation,
+                is_active=False
+            )
+            embedding.set_vector(response.data[0].embedding)
+            
+            with transaction.atomic():
+                embedding.save()
+                job.processed_chunks = index + 1
+                job.save(update_fields=['processed_chunks', 'updated_at'])
+            count_rows(1)
+            
+            logger.info(f"Generated embedding for chunk {index} of document {document.id}")
         
-        # Delete existing embeddings for this document
-        Embedding.objects.filter(document=document).delete()
+        # Swap the new generation in atomically
+        with transaction.atomic():
+            Embedding.objects.filter(document=document, is_active=True).delete()
+            Embedding.objects.filter(document=document, generation=job.generation).update(is_active=True)
+            job.status = 'completed'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'finished_at', 'updated_at'])
         
-        # Generate embeddings for each chunk
-        for index, chunk in enumerate(chunks):
-            try:
-                response = openai.Embedding.create(
-                    model="text-embedding-ada-002",
-                    input=chunk
-                )
-                
-                embedding_vector = response['data'][0]['embedding']
-                
-                # Save embedding to database
-                Embedding.objects.create(
-                    document=document,
-                    content_chunk=chunk,
-                    embedding_vector=embedding_vector,
-                    chunk_index=index
-                )
-                
-                logger.info(f"Generated embedding for chunk {index} of document {document.id}")
-                
-            except Exception as e:
-                logger.error(f"Error generating embedding for chunk {index}: {str(e)}")
-                continue
+        from .retrieval import retrieval_service
+        retrieval_service.invalidate(salon.id)
         
         logger.info(f"Completed embedding generation for document {document.id}")
         
-    except Document.DoesNotExist:
-        logger.error(f"Document {document_id} not found")
     except Exception as e:
-        logger.error(f"Error in generate_document_embeddings: {str(e)}")
+        logger.error(f"Error in generate_document_embeddings for document {document_id}: {str(e)}")
+        mark_task_error()
+        job.status = 'failed'
+        job.error_message = str(e)
+        job.save(update_fields=['status', 'error_message', 'updated_at'])
+        if isinstance(e, NonRetryableIngestionError):
+            return
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Ingestion job {job.id} gave up after {job.attempts} attempts")
+            return
+        raise self.retry(
+            exc=e,
+            kwargs={'document_id': document_id, 'job_id': job.id},
+            countdown=settings.INGESTION_RETRY_DELAY * 2 ** self.request.retries
+        )
 
 
 @shared_task
@@ -90,12 +205,15 @@ def send_appointment_reminders():
         for appointment in appointments:
             try:
                 send_telegram_reminder(appointment)
+                count_rows(1)
                 logger.info(f"Sent reminder for appointment {appointment.id}")
             except Exception as e:
                 logger.error(f"Error sending reminder for appointment {appointment.id}: {str(e)}")
+                mark_task_error()
                 
     except Exception as e:
         logger.error(f"Error in send_appointment_reminders: {str(e)}")
+        mark_task_error()
 
 
 @shared_task
@@ -125,12 +243,15 @@ def send_post(post_id: str):
             post.error_message = 'Failed to send post'
         
         post.save()
+        count_rows(1)
         logger.info(f"Processed post {post.id} with status {post.status}")
         
     except Post.DoesNotExist:
         logger.error(f"Post {post_id} not found")
+        mark_task_error()
     except Exception as e:
         logger.error(f"Error in send_post: {str(e)}")
+        mark_task_error()
 
 
 @shared_task
@@ -147,14 +268,16 @@ def process_scheduled_posts():
         
         for post in posts:
             send_post.delay(str(post.id))
+            count_rows(1)
             
         logger.info(f"Queued {posts.count()} posts for processing")
         
     except Exception as e:
         logger.error(f"Error in process_scheduled_posts: {str(e)}")
+        mark_task_error()
 
 
-@shared_task
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def update_client_statistics():
     """Update client statistics based on completed appointments"""
     try:
@@ -174,31 +297,73 @@ def update_client_statistics():
                 client.last_visit_date = last_appointment.scheduled_at
             
             client.save()
+            count_rows(1)
             
         logger.info(f"Updated statistics for {clients.count()} clients")
         
     except Exception as e:
         logger.error(f"Error in update_client_statistics: {str(e)}")
+        mark_task_error()
 
 
-def read_document_content(document: Document) -> str:
-    """Read content from document based on its type"""
+@shared_task
+def cleanup_expired_user_sessions():
+    """Delete expired Telegram bot sessions in small batches"""
     try:
-        if document.doc_type == 'TXT':
-            with open(document.path_or_url, 'r', encoding='utf-8') as file:
-                return file.read()
+        deleted = UserSession.objects.delete_expired(
+            batch_size=settings.USER_SESSION_CLEANUP_BATCH_SIZE
+        )
+        count_rows(deleted)
+        logger.info(f"Deleted {deleted} expired user sessions")
         
-        elif document.doc_type == 'DOCX':
-            from docx import Document as DocxDocument
-            doc = DocxDocument(document.path_or_url)
-            return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+    except Exception as e:
+        logger.error(f"Error in cleanup_expired_user_sessions: {str(e)}")
+        mark_task_error()
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def reindex_corpus(salon_ids=None, doc_types=None):
+    """Re-embed every document, busiest salons first, within the global API budget"""
+    from .reindex import enqueue_reindex, estimate_cost, plan_reindex
+    
+    try:
+        plan = plan_reindex(salon_ids, doc_types)
+        job_ids = enqueue_reindex(plan)
+        tokens = sum(item.tokens for item in plan)
+        count_rows(len(job_ids))
+        logger.info(
+            f"Queued re-indexing of {len(job_ids)} documents "
+            f"(~{tokens} tokens, ~${estimate_cost(tokens):.2f})"
+        )
+        return job_ids
         
-        elif document.doc_type == 'GOOGLE_DOC':
+    except Exception as e:
+        logger.error(f"Error in reindex_corpus: {str(e)}")
+        mark_task_error()
+        return []
+
+
+def read_document_content(document: Document) -> str:
+    """Read content from document based on its file extension"""
+    path = document.file_path
+    try:
+        if path.startswith(('http://', 'https://')):
             # For Google Docs, we would need to implement Google Docs API integration
             # For now, return empty string
-            logger.warning(f"Google Docs integration not implemented for document {document.id}")
+            logger.warning(f"Remote documents are not supported yet, skipping document {document.id}")
             return ""
         
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.txt', '.md'):
+            with open(path, 'r', encoding='utf-8') as file:
+                return file.read()
+        
+        elif extension == '.docx':
+            from docx import Document as DocxDocument
+            doc = DocxDocument(path)
+            return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+        
+        logger.warning(f"Unsupported file type {extension or '(none)'} for document {document.id}")
         return ""
         
     except Exception as e:
@@ -246,7 +411,7 @@ def send_telegram_reminder(appointment: Appointment):
 Ждем вас!
         """.strip()
         
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+        url = f"{settings.TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
         data = {
             'chat_id': appointment.client.telegram_id,
             'text': message,
@@ -254,6 +419,7 @@ def send_telegram_reminder(appointment: Appointment):
         }
         
         response = requests.post(url, json=data)
+        count_external_call('telegram')
         return response.status_code == 200
         
     except Exception as e:
@@ -282,51 +448,87 @@ def send_telegram_post(bot_token: str, post: Post) -> bool:
 
 @shared_task
 def search_embeddings(query: str, salon_id: str, limit: int = 10) -> List[Dict]:
-    """Search for similar embeddings using vector similarity"""
+    """
+    Search for similar embeddings using vector similarity.
+    
+    Kept for batch callers; interactive code should use core.retrieval,
+    which avoids the broker round-trip and the per-call index load.
+    """
     try:
-        salon = Salon.objects.get(id=salon_id)
-        openai_api_key = salon.user.openai_api_token
+        salon = Salon.objects.select_related('user').get(id=salon_id)
+        openai_api_key = get_salon_api_key(salon)
         
         if not openai_api_key:
             logger.error(f"No OpenAI API key found for salon {salon_id}")
             return []
         
-        # Configure OpenAI
-        openai.api_key = openai_api_key
-        
         # Generate embedding for query
-        response = openai.Embedding.create(
-            model="text-embedding-ada-002",
-            input=query
-        )
-        
-        query_embedding = response['data'][0]['embedding']
+        query_embedding = embed_query(openai_api_key, query)
         
-        # Get all embeddings for this salon
-        embeddings = Embedding.objects.filter(
-            document__salon=salon
-        ).select_related('document')
-        
-        # Calculate similarity scores
-        results = []
-        for embedding in embeddings:
-            similarity = calculate_cosine_similarity(query_embedding, embedding.embedding_vector)
-            results.append({
-                'embedding_id': str(embedding.id),
-                'document_name': embedding.document.name,
-                'content_chunk': embedding.content_chunk,
-                'similarity': similarity
-            })
-        
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x['similarity'], reverse=True)
-        return results[:limit]
+        results = rank_embeddings(salon_id, query_embedding, limit)
+        count_rows(len(results))
+        return results
         
     except Exception as e:
         logger.error(f"Error in search_embeddings: {str(e)}")
+        mark_task_error()
         return []
 
 
+def embed_query(openai_api_key: str, query: str) -> List[float]:
+    """Generate an embedding vector for a search query, using the query embedding cache"""
+    model = settings.OPENAI_EMBEDDING_MODEL
+    
+    def compute():
+        with openai_clients.client(openai_api_key) as client:
+            response = client.embeddings.create(
+                model=model,
+                input=query
+            )
+        count_external_call('openai')
+        return response.data[0].embedding
+    
+    return query_embedding_cache.get_or_compute(query, model, compute)
+
+
+def rank_embeddings(salon_id, query_embedding: List[float], limit: int = 10, queryset=None) -> List[Dict]:
+    """Rank all embeddings of a salon (or of queryset) by cosine similarity to the query embedding"""
+    if queryset is None:
+        queryset = Embedding.objects.active()
+    embeddings = list(
+        queryset.filter(document__salon_id=salon_id)
+        .select_related('document')
+        .only('id', 'content_chunk', 'vector_data', 'vector_format', 'embedding_vector', 'document__name', 'document__doc_type')
+    )
+    
+    vectors = [embedding.vector for embedding in embeddings]
+    embeddings = [e for e, v in zip(embeddings, vectors) if v is not None]
+    vectors = [v for v in vectors if v is not None]
+    if not vectors:
+        return []
+    
+    # Calculate similarity scores for all chunks at once
+    similarities = cosine_similarities(query_embedding, np.vstack(vectors))
+    top = np.argsort(-similarities)[:limit]
+    
+    return [{
+        'embedding_id': str(embeddings[i].id),
+        'document_id': str(embeddings[i].document_id),
+        'document_name': embeddings[i].document.name,
+        'doc_type': embeddings[i].document.doc_type,
+        'content_chunk': embeddings[i].content_chunk,
+        'similarity': float(similarities[i])
+    } for i in top]
+
+
+def cosine_similarities(query_vector, matrix: np.ndarray) -> np.ndarray:
+    """Cosine similarity between a query vector and every row of matrix"""
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = np.inf
+    return (matrix @ query) / norms
+
+
 def calculate_cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     """Calculate cosine similarity between two vectors"""
     import math
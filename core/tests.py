@@ -0,0 +1,147 @@
+import os
+import secrets
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.admin_custom import admin_site
+from core.models import Salon, Master, Service, Client, Appointment, Document, Post, Embedding, IngestionJob
+from core.retrieval import retrieval_service
+from core.tasks import generate_document_embeddings
+from telegram_bot.loadtest.fake_api import FakeBotAPI
+
+User = get_user_model()
+
+
+def create_rows(count: int):
+    """count salons, each with one row of every related model shown in the admin"""
+    scheduled_at = timezone.now() + timedelta(days=1)
+    for index in range(count):
+        owner = User.objects.create_user(
+            username=f"admin_queries_{index}_{secrets.token_hex(4)}",
+            password=secrets.token_urlsafe(16),
+        )
+        salon = Salon.objects.create(
+            user=owner,
+            name=f"Салон {index}",
+            address='ул. Тестовая, 1',
+            phone='+79990000000',
+            email=f"salon{index}@example.com",
+            working_hours={'text': 'Пн-Вс 10:00-21:00'},
+        )
+        master = Master.objects.create(salon=salon, full_name=f"Мастер {index}", phone='+79990000001')
+        service = Service.objects.create(
+            salon=salon, master=master, name=f"Услуга {index}", category='hair',
+            price=Decimal('1000'), duration_minutes=60,
+        )
+        client = Client.objects.create(salon=salon, full_name=f"Клиент {index}", phone='+79990000002')
+        Appointment.objects.create(
+            salon=salon, client=client, service=service, master=master,
+            scheduled_at=scheduled_at, price=service.price,
+        )
+        document = Document.objects.create(salon=salon, name=f"Документ {index}", file_size=100)
+        Post.objects.create(salon=salon, caption=f"Пост {index}", scheduled_at=scheduled_at)
+        embedding = Embedding(document=document, chunk_index=0, content_chunk='Текст ' * 500)
+        embedding.set_vector([0.1] * 1536)
+        embedding.save()
+        IngestionJob.objects.create(document=document, generation=1)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Admin changelists must issue the same number of queries however many rows they show"""
+
+    # Keep LARGE below the changelist page size
+    SMALL = 2
+    LARGE = 20
+
+    def setUp(self):
+        superuser = User.objects.create_superuser('admin_queries', password=secrets.token_urlsafe(16))
+        self.client.force_login(superuser)
+
+    def measure(self) -> dict:
+        counts = {}
+        for model in admin_site._registry:
+            name = f"{model._meta.app_label}_{model._meta.model_name}"
+            url = reverse(f"{admin_site.name}:{name}_changelist")
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200, url)
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_count_does_not_grow_with_rows(self):
+        create_rows(self.SMALL)
+        small = self.measure()
+        create_rows(self.LARGE - self.SMALL)
+        large = self.measure()
+
+        for name in small:
+            with self.subTest(admin=name):
+                self.assertEqual(large[name], small[name])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DocumentIngestionTests(TransactionTestCase):
+    """generate_document_embeddings end to end, with FakeBotAPI standing in for OpenAI"""
+
+    def setUp(self):
+        self.fake_api = FakeBotAPI(seed=1).start()
+        self.addCleanup(self.fake_api.stop)
+        settings_override = override_settings(OPENAI_BASE_URL=self.fake_api.openai_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        owner = User.objects.create_user(username=f"owner_{secrets.token_hex(4)}", password=secrets.token_urlsafe(16))
+        self.salon = Salon.objects.create(
+            user=owner,
+            name='Тестовый салон',
+            address='ул. Тестовая, 1',
+            phone='+79990000000',
+            working_hours={'text': 'Пн-Вс 10:00-21:00'},
+            openai_api_key=f"sk-test-{secrets.token_hex(8)}",
+        )
+
+    def write_file(self, suffix: str, text: str) -> str:
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_ingests_text_document(self):
+        text = 'Стрижка стоит 1000 рублей. Окрашивание стоит 3000 рублей. Запись по телефону.'
+        path = self.write_file('.txt', text)
+        document = Document.objects.create(
+            salon=self.salon, name='Прайс', doc_type='price_list', file_path=path, file_size=len(text.encode()),
+        )
+        version = retrieval_service.version(self.salon.id)
+
+        generate_document_embeddings.apply(args=[str(document.id)])
+
+        job = IngestionJob.objects.get(document=document)
+        self.assertEqual(job.status, 'completed', job.error_message)
+        self.assertEqual(job.processed_chunks, job.total_chunks)
+        embeddings = Embedding.objects.filter(document=document, is_active=True)
+        self.assertEqual(embeddings.count(), 1)
+        self.assertIn('Окрашивание', embeddings.get().content_chunk)
+        self.assertEqual(self.fake_api.stats()['calls'].get('openai:embeddings'), 1)
+        self.assertNotEqual(retrieval_service.version(self.salon.id), version)
+
+    def test_unreadable_document_fails_without_retry(self):
+        document = Document.objects.create(
+            salon=self.salon, name='Скан', file_path=self.write_file('.pdf', '%PDF'), file_size=4,
+        )
+
+        generate_document_embeddings.apply(args=[str(document.id)])
+
+        job = IngestionJob.objects.get(document=document)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(self.fake_api.stats()['calls'], {})
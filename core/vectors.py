@@ -0,0 +1,63 @@
+from typing import List, Sequence
+
+import numpy as np
+
+VECTOR_FORMAT_FLOAT32 = 'float32'
+VECTOR_FORMAT_FLOAT16 = 'float16'
+VECTOR_FORMAT_INT8 = 'int8'
+
+VECTOR_FORMAT_CHOICES = [
+    (VECTOR_FORMAT_FLOAT32, 'float32'),
+    (VECTOR_FORMAT_FLOAT16, 'float16'),
+    (VECTOR_FORMAT_INT8, 'int8 (квантованный)'),
+]
+
+
+def encode_vector(vector: Sequence[float], vector_format: str = VECTOR_FORMAT_FLOAT32) -> bytes:
+    """
+    Pack a vector into bytes.
+
+    float32 uses 4 bytes per value, float16 uses 2. int8 stores a float32
+    scale followed by one signed byte per value (symmetric quantization).
+    """
+    array = np.asarray(vector, dtype=np.float32)
+
+    if vector_format == VECTOR_FORMAT_FLOAT32:
+        return array.astype('<f4').tobytes()
+    if vector_format == VECTOR_FORMAT_FLOAT16:
+        return array.astype('<f2').tobytes()
+    if vector_format == VECTOR_FORMAT_INT8:
+        peak = float(np.abs(array).max()) if array.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        quantized = np.clip(np.round(array / scale), -127, 127).astype(np.int8)
+        return np.float32(scale).astype('<f4').tobytes() + quantized.tobytes()
+
+    raise ValueError(f"Unknown vector format: {vector_format}")
+
+
+def decode_vector(data, vector_format: str = VECTOR_FORMAT_FLOAT32) -> np.ndarray:
+    """
+    Unpack bytes produced by encode_vector into a float32 array.
+
+    float32 data is decoded zero-copy with numpy.frombuffer, so the result
+    is read-only and shares memory with data.
+    """
+    if vector_format == VECTOR_FORMAT_FLOAT32:
+        return np.frombuffer(data, dtype='<f4')
+    if vector_format == VECTOR_FORMAT_FLOAT16:
+        return np.frombuffer(data, dtype='<f2').astype(np.float32)
+    if vector_format == VECTOR_FORMAT_INT8:
+        scale = np.frombuffer(data, dtype='<f4', count=1)[0]
+        return np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+
+    raise ValueError(f"Unknown vector format: {vector_format}")
+
+
+def pack_float32(vector: Sequence[float]) -> bytes:
+    """Pack a vector as little-endian float32 bytes"""
+    return encode_vector(vector, VECTOR_FORMAT_FLOAT32)
+
+
+def unpack_float32(data: bytes) -> List[float]:
+    """Inverse of pack_float32"""
+    return decode_vector(data, VECTOR_FORMAT_FLOAT32).tolist()
@@ -0,0 +1,24 @@
+from hmac import compare_digest
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import require_http_methods
+
+from . import instrumentation
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Prometheus metrics of this process, or of all workers in multiprocess mode"""
+    token = settings.METRICS_AUTH_TOKEN
+    if token:
+        if not compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return HttpResponse(status=403)
+    elif not settings.DEBUG:
+        # Without a token the endpoint is only open in development
+        return HttpResponse(status=403)
+    if not instrumentation.PROMETHEUS_AVAILABLE:
+        return HttpResponse('prometheus_client is not installed', status=501, content_type='text/plain')
+    
+    body, content_type = instrumentation.render_metrics()
+    return HttpResponse(body, content_type=content_type)
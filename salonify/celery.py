@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from kombu import Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'salonify.settings')
@@ -14,6 +15,34 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
+# Probe tasks of manage.py loadtest_queues
+app.autodiscover_tasks(['telegram_bot.loadtest'])
+
+# Queues by latency class, so bulk work never delays what users wait for.
+# Each group gets its own worker (see Procfile):
+#   interactive, notifications - short tasks; higher concurrency, prefetch 4
+#   ingestion, analytics       - long tasks; prefetch 1, acks_late on the tasks
+# 'celery' is the old default queue, still drained by the interactive worker.
+app.conf.task_queues = (
+    Queue('interactive'),
+    Queue('notifications'),
+    Queue('ingestion'),
+    Queue('analytics'),
+    Queue('celery'),
+)
+app.conf.task_default_queue = 'interactive'
+app.conf.task_routes = {
+    'core.tasks.search_embeddings': {'queue': 'interactive'},
+    'core.tasks.send_post': {'queue': 'notifications'},
+    'core.tasks.send_appointment_reminders': {'queue': 'notifications'},
+    'core.tasks.process_scheduled_posts': {'queue': 'notifications'},
+    'core.tasks.generate_document_embeddings': {'queue': 'ingestion'},
+    'core.tasks.reindex_corpus': {'queue': 'ingestion'},
+    'core.tasks.update_client_statistics': {'queue': 'analytics'},
+    'core.tasks.cleanup_expired_user_sessions': {'queue': 'analytics'},
+    'telegram_bot.loadtest.tasks.queue_latency_probe': {'queue': 'notifications'},
+    'telegram_bot.loadtest.tasks.simulate_bulk_work': {'queue': 'ingestion'},
+}
 
 
 @app.task(bind=True)
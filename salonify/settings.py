@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -178,7 +179,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # JSON through orjson/msgspec when installed (core.fastjson)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.EstimatedCountPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -187,6 +198,11 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Admin and API lists of more than PAGINATION_ESTIMATE_THRESHOLD rows (by PostgreSQL's
+# estimate) show an estimated count; PAGINATION_EXACT_COUNT always runs COUNT(*)
+PAGINATION_ESTIMATE_THRESHOLD = config('PAGINATION_ESTIMATE_THRESHOLD', default=100000, cast=int)
+PAGINATION_EXACT_COUNT = config('PAGINATION_EXACT_COUNT', default=False, cast=bool)
+
 # JWT settings
 from datetime import timedelta
 SIMPLE_JWT = {
@@ -210,6 +226,12 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Unacknowledged (acks_late) tasks are redelivered by Redis after this many seconds,
+# so it must exceed the longest ingestion or analytics run
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': config('CELERY_VISIBILITY_TIMEOUT', default=4 * 3600, cast=int),
+}
+
 # Celery SSL Configuration for Heroku Redis
 if CELERY_BROKER_URL.startswith('rediss://'):
     import ssl
@@ -220,14 +242,140 @@ if CELERY_BROKER_URL.startswith('rediss://'):
         'ssl_cert_reqs': ssl.CERT_NONE
     }
 
+# Cache (shared between web, bot and Celery processes)
+CACHE_URL = config('CACHE_URL', default=CELERY_BROKER_URL)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+        'KEY_PREFIX': 'salonify',
+    }
+}
+if CACHE_URL.startswith('rediss://'):
+    CACHES['default']['OPTIONS'] = {'ssl_cert_reqs': None}
+
 # Celery Beat settings
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'cleanup-expired-user-sessions': {
+        'task': 'core.tasks.cleanup_expired_user_sessions',
+        'schedule': timedelta(minutes=15),
+    },
+}
 
 # Telegram Bot settings
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default='')
+TELEGRAM_WEBHOOK_BASE_URL = config('TELEGRAM_WEBHOOK_BASE_URL', default='https://salonify-app-3cd2419b7b71.herokuapp.com')
+# Bot API endpoint; pointed at a fake server by the webhook load test
+TELEGRAM_API_URL = config('TELEGRAM_API_URL', default='https://api.telegram.org')
+
+# Webhook redeliveries of the same update_id are dropped within this window (seconds)
+TELEGRAM_UPDATE_DEDUP_WINDOW = config('TELEGRAM_UPDATE_DEDUP_WINDOW', default=600, cast=int)
+TELEGRAM_UPDATE_DEDUP_MAX_LOCAL = config('TELEGRAM_UPDATE_DEDUP_MAX_LOCAL', default=100000, cast=int)
+
+# Webhook URLs carry an opaque route id; URLs with the raw token are accepted until bots are re-registered
+TELEGRAM_WEBHOOK_ACCEPT_TOKEN_URLS = config('TELEGRAM_WEBHOOK_ACCEPT_TOKEN_URLS', default=True, cast=bool)
+
+# Share of incoming updates logged, and whether the full payload is included
+TELEGRAM_UPDATE_LOG_SAMPLE_RATE = config('TELEGRAM_UPDATE_LOG_SAMPLE_RATE', default=1.0 if DEBUG else 0.01, cast=float)
+TELEGRAM_UPDATE_LOG_PAYLOAD = config('TELEGRAM_UPDATE_LOG_PAYLOAD', default=DEBUG, cast=bool)
+
+# Telegram bot sessions
+USER_SESSION_TTL = timedelta(hours=config('USER_SESSION_TTL_HOURS', default=24, cast=int))
+USER_SESSION_CLEANUP_BATCH_SIZE = config('USER_SESSION_CLEANUP_BATCH_SIZE', default=1000, cast=int)
+
+# Threads (and therefore DB connections) used by async bot code for ORM calls
+BOT_DB_POOL_SIZE = config('BOT_DB_POOL_SIZE', default=10, cast=int)
+
+# Connections for getUpdates long polls in start_bots; each polling bot holds one,
+# so keep it above the number of bots a process runs
+BOT_GET_UPDATES_POOL_SIZE = config('BOT_GET_UPDATES_POOL_SIZE', default=1024, cast=int)
+
+# Bot fleet sharding (manage.py start_bots --shard)
+BOT_SHARD_REDIS_URL = config('BOT_SHARD_REDIS_URL', default=CELERY_BROKER_URL)
+BOT_SHARD_LEASE_TTL = config('BOT_SHARD_LEASE_TTL', default=90, cast=int)
 
 # OpenAI settings
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='')  # e.g. a local stand-in LLM for tests
+OPENAI_EMBEDDING_MODEL = config('OPENAI_EMBEDDING_MODEL', default='text-embedding-ada-002')
+OPENAI_CHAT_MODEL = config('OPENAI_CHAT_MODEL', default='gpt-3.5-turbo')
+
+# Pooled per-key OpenAI clients
+OPENAI_CLIENT_POOL_SIZE = config('OPENAI_CLIENT_POOL_SIZE', default=256, cast=int)
+OPENAI_MAX_CONCURRENCY_PER_KEY = config('OPENAI_MAX_CONCURRENCY_PER_KEY', default=8, cast=int)
+OPENAI_MAX_RETRIES = config('OPENAI_MAX_RETRIES', default=3, cast=int)
+OPENAI_TIMEOUT = config('OPENAI_TIMEOUT', default=30.0, cast=float)
+
+# Global embeddings API budget shared by all workers (0 disables a limit)
+# and the price used for re-index cost estimates
+OPENAI_EMBEDDING_RPM = config('OPENAI_EMBEDDING_RPM', default=3000, cast=int)
+OPENAI_EMBEDDING_TPM = config('OPENAI_EMBEDDING_TPM', default=1000000, cast=int)
+OPENAI_EMBEDDING_PRICE_PER_1K_TOKENS = config('OPENAI_EMBEDDING_PRICE_PER_1K_TOKENS', default=0.0001, cast=float)
+
+# Storage format for document embeddings: float32, float16 or int8
+EMBEDDING_VECTOR_FORMAT = config('EMBEDDING_VECTOR_FORMAT', default='float32')
+
+# Query embedding cache
+QUERY_EMBEDDING_CACHE_SIZE = config('QUERY_EMBEDDING_CACHE_SIZE', default=1024, cast=int)
+QUERY_EMBEDDING_CACHE_TTL = config('QUERY_EMBEDDING_CACHE_TTL', default=86400, cast=int)
+
+# Question answering for bot users
+ANSWER_TOP_K = config('ANSWER_TOP_K', default=4, cast=int)
+ANSWER_TIMEOUT = config('ANSWER_TIMEOUT', default=15.0, cast=float)
+ANSWER_MAX_CONCURRENCY_PER_SALON = config('ANSWER_MAX_CONCURRENCY_PER_SALON', default=4, cast=int)
+ANSWER_CACHE_TTL = config('ANSWER_CACHE_TTL', default=3600, cast=int)
+ANSWER_CACHE_SIMILARITY = config('ANSWER_CACHE_SIMILARITY', default=0.95, cast=float)
+ANSWER_CACHE_MAX_ENTRIES = config('ANSWER_CACHE_MAX_ENTRIES', default=200, cast=int)
+
+# Document ingestion: a running job without progress for this many seconds is
+# considered dead and may be resumed; retries back off from INGESTION_RETRY_DELAY
+INGESTION_STALL_TIMEOUT = config('INGESTION_STALL_TIMEOUT', default=900, cast=int)
+INGESTION_RETRY_DELAY = config('INGESTION_RETRY_DELAY', default=60, cast=int)
+
+# Per-salon catalog snapshots (profile, services, masters); the in-process copy
+# is re-validated against the shared version every CATALOG_CACHE_LOCAL_TTL seconds and
+# served for up to CATALOG_CACHE_MAX_STALE seconds while the shared cache is down
+CATALOG_CACHE_MAX_SALONS = config('CATALOG_CACHE_MAX_SALONS', default=512, cast=int)
+CATALOG_CACHE_LOCAL_TTL = config('CATALOG_CACHE_LOCAL_TTL', default=5.0, cast=float)
+CATALOG_CACHE_MAX_STALE = config('CATALOG_CACHE_MAX_STALE', default=60.0, cast=float)
+
+# Rendered bot messages (text + keyboard) kept per process, keyed by catalog version
+BOT_RENDER_CACHE_SIZE = config('BOT_RENDER_CACHE_SIZE', default=2048, cast=int)
+
+# Per-update instrumentation: updates slower than BOT_SLOW_UPDATE_THRESHOLD seconds
+# are logged with their stage breakdown (a BOT_SLOW_UPDATE_LOG_SAMPLE_RATE share of them),
+# and BOT_OTEL_ENABLED exports updates as OpenTelemetry spans when opentelemetry is installed
+BOT_SLOW_UPDATE_THRESHOLD = config('BOT_SLOW_UPDATE_THRESHOLD', default=1.0, cast=float)
+BOT_SLOW_UPDATE_LOG_SAMPLE_RATE = config('BOT_SLOW_UPDATE_LOG_SAMPLE_RATE', default=1.0, cast=float)
+BOT_OTEL_ENABLED = config('BOT_OTEL_ENABLED', default=False, cast=bool)
+
+# Bearer token required to scrape /metrics (empty denies every request unless DEBUG)
+METRICS_AUTH_TOKEN = config('METRICS_AUTH_TOKEN', default='')
+
+# Celery task metrics are served by each worker on TASK_METRICS_PORT (0 disables);
+# prefork workers need PROMETHEUS_MULTIPROC_DIR so child processes are aggregated
+TASK_METRICS_PORT = config('TASK_METRICS_PORT', default=0, cast=int)
+
+# Task profiling: runs of TASK_PROFILE_TASKS (full task names) are profiled with a
+# TASK_PROFILE_SAMPLE_RATE chance, as are runs requested from the admin within
+# TASK_PROFILE_REQUEST_TTL seconds; dumps go to TASK_PROFILE_DIR.
+# TASK_PROFILER is 'cprofile' or 'pyinstrument' (when installed)
+TASK_PROFILE_TASKS = config('TASK_PROFILE_TASKS', default='', cast=Csv())
+TASK_PROFILE_SAMPLE_RATE = config('TASK_PROFILE_SAMPLE_RATE', default=1.0, cast=float)
+TASK_PROFILE_REQUEST_TTL = config('TASK_PROFILE_REQUEST_TTL', default=3600, cast=int)
+TASK_PROFILE_DIR = config('TASK_PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+TASK_PROFILER = config('TASK_PROFILER', default='cprofile')
+
+# Hybrid document search: candidates taken from each retriever and the RRF constant
+SEARCH_CANDIDATES = config('SEARCH_CANDIDATES', default=50, cast=int)
+SEARCH_RRF_K = config('SEARCH_RRF_K', default=60, cast=int)
+
+# In-process retrieval indexes and the latency budget (seconds) for interactive search
+RETRIEVAL_INDEX_MAX_SALONS = config('RETRIEVAL_INDEX_MAX_SALONS', default=64, cast=int)
+RETRIEVAL_INDEX_TTL = config('RETRIEVAL_INDEX_TTL', default=300, cast=int)
+RETRIEVAL_WORKERS = config('RETRIEVAL_WORKERS', default=4, cast=int)
+RETRIEVAL_BUDGET = config('RETRIEVAL_BUDGET', default=1.5, cast=float)
 
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 3 * 1024 * 1024  # 3 MB
@@ -18,11 +18,13 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from core.admin_custom import admin_site
+from core.views import metrics
 
 urlpatterns = [
     path('admin/', admin_site.urls),
     path('api/', include('api.urls')),
     path('telegram/', include('telegram_bot.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
 
 # Serve static files in development
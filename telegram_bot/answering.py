@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from core.catalog import catalog_cache
+from core.db import db_call, db_executor
+from core.embedding_cache import normalize_query
+from core.models import Salon
+from core.openai_clients import get_salon_api_key, openai_clients
+from core.reindex import record_question
+from core.retrieval import retrieval_service
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """
+Ты - вежливый администратор салона красоты "{salon_name}" и отвечаешь клиентам в Telegram.
+Отвечай кратко, по-русски, только на основе информации ниже.
+Если ответа нет в информации, предложи позвонить в салон по телефону {salon_phone}.
+
+Адрес: {salon_address}
+Часы работы: {working_hours}
+
+Услуги:
+{services}
+
+Выдержки из документов салона:
+{context}
+""".strip()
+
+
+def _unit(vector: List[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+def answer_version(salon_id) -> Optional[str]:
+    """Catalog and embeddings versions the salon's answers depend on; shared across processes"""
+    try:
+        return f"{catalog_cache.version(salon_id)}:{retrieval_service.version(salon_id)}"
+    except Exception as e:
+        logger.error(f"Error reading answer cache version for salon {salon_id}: {str(e)}")
+        return None
+
+
+@dataclass
+class Answer:
+    """Answer produced by the pipeline"""
+    text: str
+    cached: bool = False
+    timings: Dict[str, float] = field(default_factory=dict)
+    sources: List[str] = field(default_factory=list)
+
+
+class SalonAnswers:
+    """One salon's cached answers, valid for a single catalog/embeddings version"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.entries: OrderedDict = OrderedDict()
+        self._matrix = None
+        self._keys: List[str] = []
+
+    def changed(self):
+        self._matrix = None
+
+    def matrix(self):
+        """Question vectors stacked for one matrix product, rebuilt after changes"""
+        if self._matrix is None:
+            self._keys = list(self.entries)
+            self._matrix = np.stack([self.entries[key][0] for key in self._keys])
+        return self._keys, self._matrix
+
+
+class SemanticAnswerCache:
+    """
+    Per-salon cache of answers.
+
+    Identical questions (after normalization) are served by key; near
+    duplicates are served when the cosine similarity of the question
+    embeddings is above the threshold. Each salon keeps at most
+    max_entries answers in LRU order. Answers are tied to the version
+    from answer_version(), so a catalog change or re-embedding in any
+    process drops them.
+    """
+
+    def __init__(self, max_entries: int = 200, ttl: float = 3600, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._salons: Dict[str, SalonAnswers] = {}
+        self._lock = threading.Lock()
+
+    def _current(self, salon_id, version) -> Optional[SalonAnswers]:
+        salon = self._salons.get(str(salon_id))
+        if salon and salon.version != version:
+            del self._salons[str(salon_id)]
+            return None
+        return salon
+
+    def get_exact(self, salon_id, version, question: str) -> Optional[str]:
+        if version is None:
+            return None
+        key = normalize_query(question)
+        with self._lock:
+            salon = self._current(salon_id, version)
+            if not salon or key not in salon.entries:
+                return None
+            vector, answer, expires_at = salon.entries[key]
+            if expires_at < time.monotonic():
+                del salon.entries[key]
+                salon.changed()
+                return None
+            salon.entries.move_to_end(key)
+            return answer
+
+    def get_similar(self, salon_id, version, vector: List[float]) -> Optional[str]:
+        if version is None:
+            return None
+        with self._lock:
+            salon = self._current(salon_id, version)
+            if not salon or not salon.entries:
+                return None
+            keys, matrix = salon.matrix()
+
+        # Score outside the lock; the snapshot is never mutated in place
+        scores = matrix @ _unit(vector)
+        now = time.monotonic()
+        with self._lock:
+            if self._salons.get(str(salon_id)) is not salon:
+                return None
+            for index in np.argsort(scores)[::-1]:
+                if scores[index] < self.threshold:
+                    return None
+                entry = salon.entries.get(keys[index])
+                if entry and entry[2] >= now:
+                    salon.entries.move_to_end(keys[index])
+                    return entry[1]
+        return None
+
+    def set(self, salon_id, version, question: str, vector: List[float], answer: str):
+        if version is None:
+            return
+        key = normalize_query(question)
+        with self._lock:
+            salon = self._current(salon_id, version)
+            if salon is None:
+                salon = self._salons[str(salon_id)] = SalonAnswers(version)
+            salon.entries[key] = (_unit(vector), answer, time.monotonic() + self.ttl)
+            salon.entries.move_to_end(key)
+            while len(salon.entries) > self.max_entries:
+                salon.entries.popitem(last=False)
+            salon.changed()
+
+    def invalidate(self, salon_id):
+        with self._lock:
+            self._salons.pop(str(salon_id), None)
+
+
+class SalonConcurrencyLimiter:
+    """
+    Caps concurrent LLM answers per salon.
+
+    Uses non-blocking acquisition so that an overloaded salon sheds load
+    immediately instead of queueing; works across threads and event loops.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, salon_id) -> bool:
+        key = str(salon_id)
+        with self._lock:
+            if self._active.get(key, 0) >= self.limit:
+                return False
+            self._active[key] = self._active.get(key, 0) + 1
+            return True
+
+    def release(self, salon_id):
+        key = str(salon_id)
+        with self._lock:
+            self._active[key] -= 1
+            if not self._active[key]:
+                del self._active[key]
+
+
+answer_cache = SemanticAnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl=settings.ANSWER_CACHE_TTL,
+    threshold=settings.ANSWER_CACHE_SIMILARITY,
+)
+concurrency_limiter = SalonConcurrencyLimiter(settings.ANSWER_MAX_CONCURRENCY_PER_SALON)
+
+
+@db_call
+def load_salon_context(salon_id):
+    """Load the API key and catalog used to build the prompt"""
+    salon = Salon.objects.select_related('user').get(id=salon_id)
+    catalog = catalog_cache.get(salon_id)
+    services = catalog.services if catalog else []
+    api_key = get_salon_api_key(salon)
+    return salon, api_key, services
+
+
+def build_messages(salon: Salon, services, chunks, question: str) -> List[Dict]:
+    """Build chat messages with salon profile, catalog and retrieved chunks"""
+    services_text = '\n'.join(
+        f"- {service.name}: {service.price} руб., {service.duration_minutes} мин."
+        + (f" (мастер: {service.master.full_name})" if service.master else '')
+        for service in services
+    ) or 'нет данных'
+    context_text = '\n---\n'.join(chunk['content_chunk'] for chunk in chunks) or 'нет данных'
+    working_hours = (salon.working_hours or {}).get('text', '') or 'не указаны'
+
+    system_prompt = SYSTEM_PROMPT.format(
+        salon_name=salon.name,
+        salon_phone=salon.phone,
+        salon_address=salon.address,
+        working_hours=working_hours,
+        services=services_text,
+        context=context_text,
+    )
+    return [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': question},
+    ]
+
+
+async def _answer(salon_id, question: str) -> Optional[Answer]:
+    timings = {}
+
+    def mark(stage, started):
+        timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    version = await db_executor.run(answer_version, salon_id)
+    mark('cache_version', started)
+
+    started = time.perf_counter()
+    cached = answer_cache.get_exact(salon_id, version, question)
+    mark('cache_exact', started)
+    if cached:
+        return Answer(cached, cached=True, timings=timings)
+
+    started = time.perf_counter()
+    salon, api_key, services = await load_salon_context(salon_id)
+    mark('load_context', started)
+    if not api_key:
+        logger.warning(f"No OpenAI API key for salon {salon_id}, skipping answer pipeline")
+        return None
+
+    started = time.perf_counter()
+    query_embedding = await retrieval_service.embed(api_key, question)
+    mark('embed', started)
+
+    started = time.perf_counter()
+    cached = answer_cache.get_similar(salon_id, version, query_embedding)
+    mark('cache_semantic', started)
+    if cached:
+        return Answer(cached, cached=True, timings=timings)
+
+    started = time.perf_counter()
+    chunks = await retrieval_service.search(
+        salon_id, question, settings.ANSWER_TOP_K, query_embedding=query_embedding
+    )
+    mark('retrieve', started)
+
+    started = time.perf_counter()
+    messages = build_messages(salon, services, chunks, question)
+    mark('prompt', started)
+
+    started = time.perf_counter()
+    async with openai_clients.async_client(api_key, owner=f"salon:{salon_id}") as client:
+        response = await client.chat.completions.create(
+            model=settings.OPENAI_CHAT_MODEL,
+            messages=messages,
+            temperature=0.2,
+        )
+    text = (response.choices[0].message.content or '').strip()
+    mark('llm', started)
+    if not text:
+        return None
+
+    answer_cache.set(salon_id, version, question, query_embedding, text)
+    return Answer(text, timings=timings, sources=[chunk['document_name'] for chunk in chunks])
+
+
+async def answer_question(salon_id, question: str) -> Optional[Answer]:
+    """
+    Answer a client question for a salon.
+
+    Returns None when the answer cannot be produced in time (timeout,
+    concurrency cap reached, missing API key or an upstream error) so
+    the caller can fall back to its static replies.
+    """
+    if not concurrency_limiter.acquire(salon_id):
+        logger.warning(f"Answer concurrency limit reached for salon {salon_id}")
+        return None
+
+    started = time.perf_counter()
+    try:
+        await db_executor.run(record_question, salon_id)
+        answer = await asyncio.wait_for(_answer(salon_id, question), timeout=settings.ANSWER_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Answer pipeline timed out for salon {salon_id}")
+        return None
+    except Exception as e:
+        logger.error(f"Error in answer pipeline for salon {salon_id}: {str(e)}")
+        return None
+    finally:
+        concurrency_limiter.release(salon_id)
+
+    if answer:
+        answer.timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+        stages = ' '.join(f"{stage}={ms}ms" for stage, ms in answer.timings.items())
+        logger.info(f"Answered question for salon {salon_id} (cached={answer.cached}): {stages}")
+    return answer
@@ -12,9 +12,10 @@ from telegram.constants import ParseMode
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from core.models import Salon, Master, Service, Client, Appointment
-from core.tasks import search_embeddings
-import openai
+from core.instrumentation import instrumented_handler
+from . import queries
+from .answering import answer_question
+from .dedup import update_idempotency_key
 
 User = get_user_model()
 
@@ -37,10 +38,16 @@ USER_DATA_APPOINTMENT = 'appointment_data'
 
 
 class SalonifyBot:
-    def __init__(self, token: str, user: User):
+    def __init__(self, token: str, user: User, request=None, get_updates_request=None):
         self.token = token
         self.user = user
-        self.application = Application.builder().token(token).build()
+        
+        builder = Application.builder().token(token).base_url(f"{settings.TELEGRAM_API_URL}/bot")
+        if request is not None:
+            builder = builder.request(request)
+        if get_updates_request is not None:
+            builder = builder.get_updates_request(get_updates_request)
+        self.application = builder.build()
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -61,6 +68,7 @@ class SalonifyBot:
         # Contact handler for phone number sharing
         self.application.add_handler(MessageHandler(filters.CONTACT, self.handle_contact))
     
+    @instrumented_handler('admin')
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user = update.effective_user
@@ -84,6 +92,7 @@ class SalonifyBot:
         
         await update.message.reply_text(welcome_message.strip())
     
+    @instrumented_handler('admin')
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
         help_text = """
@@ -104,6 +113,7 @@ class SalonifyBot:
         
         await update.message.reply_text(help_text.strip())
     
+    @instrumented_handler('admin')
     async def register_salon(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start salon registration process"""
         context.user_data[USER_DATA_STATE] = SALON_REGISTRATION
@@ -114,12 +124,13 @@ class SalonifyBot:
             "Введите название салона:"
         )
     
+    @instrumented_handler('admin')
     async def book_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start appointment booking process"""
         # Get user's salons
-        salons = Salon.objects.filter(user=self.user)
+        salons = await queries.get_owner_salons(self.user.id)
         
-        if not salons.exists():
+        if not salons:
             await update.message.reply_text(
                 "❌ У вас нет зарегистрированных салонов.\n"
                 "Используйте /register_salon для регистрации."
@@ -141,26 +152,20 @@ class SalonifyBot:
             reply_markup=reply_markup
         )
     
+    @instrumented_handler('admin')
     async def my_appointments(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user's appointments"""
         user_id = str(update.effective_user.id)
         
-        # Find client by telegram_id
-        try:
-            client = Client.objects.get(telegram_id=user_id)
-        except Client.DoesNotExist:
+        # Find client's upcoming appointments by telegram_id
+        is_client, upcoming_appointments = await queries.get_upcoming_appointments(user_id, statuses=['planned'])
+        if not is_client:
             await update.message.reply_text(
                 "❌ Вы не зарегистрированы ни в одном салоне."
             )
             return
         
-        # Get upcoming appointments
-        upcoming_appointments = client.appointments.filter(
-            scheduled_at__gte=timezone.now(),
-            status='planned'
-        ).order_by('scheduled_at')
-        
-        if not upcoming_appointments.exists():
+        if not upcoming_appointments:
             await update.message.reply_text("📅 У вас нет запланированных записей.")
             return
         
@@ -178,25 +183,19 @@ class SalonifyBot:
         
         await update.message.reply_text(message.strip())
     
+    @instrumented_handler('admin')
     async def cancel_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show appointments that can be cancelled"""
         user_id = str(update.effective_user.id)
         
-        try:
-            client = Client.objects.get(telegram_id=user_id)
-        except Client.DoesNotExist:
+        is_client, upcoming_appointments = await queries.get_upcoming_appointments(user_id, statuses=['planned'])
+        if not is_client:
             await update.message.reply_text(
                 "❌ Вы не зарегистрированы ни в одном салоне."
             )
             return
         
-        # Get upcoming appointments
-        upcoming_appointments = client.appointments.filter(
-            scheduled_at__gte=timezone.now(),
-            status='planned'
-        ).order_by('scheduled_at')
-        
-        if not upcoming_appointments.exists():
+        if not upcoming_appointments:
             await update.message.reply_text("📅 У вас нет записей для отмены.")
             return
         
@@ -215,6 +214,7 @@ class SalonifyBot:
             reply_markup=reply_markup
         )
     
+    @instrumented_handler('admin')
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline keyboard button presses"""
         query = update.callback_query
@@ -238,21 +238,18 @@ class SalonifyBot:
             appointment_id = data.split('_')[2]
             await self.handle_appointment_cancellation(query, context, appointment_id)
     
+    @instrumented_handler('admin')
     async def handle_salon_selection(self, query, context, salon_id):
         """Handle salon selection for appointment booking"""
-        try:
-            salon = Salon.objects.get(id=salon_id, user=self.user)
-        except Salon.DoesNotExist:
+        salon, services = await queries.get_owner_salon_with_services(self.user.id, salon_id)
+        if salon is None:
             await query.edit_message_text("❌ Салон не найден.")
             return
         
         context.user_data[USER_DATA_STATE] = APPOINTMENT_BOOKING
         context.user_data[USER_DATA_APPOINTMENT] = {'salon_id': salon_id}
         
-        # Get available services
-        services = salon.services.filter(is_active=True)
-        
-        if not services.exists():
+        if not services:
             await query.edit_message_text("❌ В салоне нет доступных услуг.")
             return
         
@@ -272,22 +269,17 @@ class SalonifyBot:
             reply_markup=reply_markup
         )
     
+    @instrumented_handler('admin')
     async def handle_service_selection(self, query, context, service_id):
         """Handle service selection for appointment booking"""
-        try:
-            service = Service.objects.get(id=service_id)
-        except Service.DoesNotExist:
+        salon_id = context.user_data.get(USER_DATA_APPOINTMENT, {}).get('salon_id')
+        service, masters = await queries.get_service_with_masters(service_id, salon_id=salon_id)
+        if service is None:
             await query.edit_message_text("❌ Услуга не найдена.")
             return
         
         context.user_data[USER_DATA_APPOINTMENT]['service_id'] = service_id
         
-        # Get available masters for this service
-        if service.master:
-            masters = [service.master]
-        else:
-            masters = service.salon.masters.filter(is_active=True)
-        
         if not masters:
             await query.edit_message_text("❌ Нет доступных мастеров.")
             return
@@ -310,11 +302,12 @@ class SalonifyBot:
             reply_markup=reply_markup
         )
     
+    @instrumented_handler('admin')
     async def handle_master_selection(self, query, context, master_id):
         """Handle master selection for appointment booking"""
-        try:
-            master = Master.objects.get(id=master_id)
-        except Master.DoesNotExist:
+        salon_id = context.user_data.get(USER_DATA_APPOINTMENT, {}).get('salon_id')
+        master = await queries.get_master(master_id, salon_id=salon_id)
+        if master is None:
             await query.edit_message_text("❌ Мастер не найден.")
             return
         
@@ -327,23 +320,22 @@ class SalonifyBot:
             "Например: 25.12.2023 14:30"
         )
     
+    @instrumented_handler('admin')
     async def handle_appointment_cancellation(self, query, context, appointment_id):
         """Handle appointment cancellation"""
-        try:
-            appointment = Appointment.objects.get(id=appointment_id)
-            appointment.status = 'cancelled'
-            appointment.save()
-            
-            await query.edit_message_text(
-                f"✅ Запись отменена:\n\n"
-                f"🏪 {appointment.salon.name}\n"
-                f"💇‍♀️ {appointment.service.name}\n"
-                f"📅 {appointment.scheduled_at.strftime('%d.%m.%Y %H:%M')}"
-            )
-            
-        except Appointment.DoesNotExist:
+        appointment = await queries.cancel_appointment(appointment_id, str(query.from_user.id))
+        if appointment is None:
             await query.edit_message_text("❌ Запись не найдена.")
+            return
+        
+        await query.edit_message_text(
+            f"✅ Запись отменена:\n\n"
+            f"🏪 {appointment.salon.name}\n"
+            f"💇‍♀️ {appointment.service.name}\n"
+            f"📅 {appointment.scheduled_at.strftime('%d.%m.%Y %H:%M')}"
+        )
     
+    @instrumented_handler('admin')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages based on current state"""
         user_state = context.user_data.get(USER_DATA_STATE)
@@ -356,6 +348,7 @@ class SalonifyBot:
             # Handle as question
             await self.handle_question(update, context)
     
+    @instrumented_handler('admin')
     async def handle_salon_registration(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle salon registration steps"""
         salon_data = context.user_data[USER_DATA_SALON]
@@ -458,8 +451,8 @@ class SalonifyBot:
                 
                 # Create salon
                 try:
-                    salon = Salon.objects.create(
-                        user=self.user,
+                    salon = await queries.create_salon(
+                        self.user.id,
                         name=salon_data['name'],
                         address=salon_data['address'],
                         phone=salon_data['phone'],
@@ -509,6 +502,7 @@ ID салона: {salon.id}
             else:
                 await update.message.reply_text("Пожалуйста, ответьте 'да' или 'нет':")
     
+    @instrumented_handler('admin')
     async def handle_appointment_booking(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle appointment booking datetime input"""
         appointment_data = context.user_data[USER_DATA_APPOINTMENT]
@@ -528,28 +522,17 @@ ID салона: {salon.id}
             user_id = str(update.effective_user.id)
             user_name = update.effective_user.full_name
             
-            salon = Salon.objects.get(id=appointment_data['salon_id'])
-            service = Service.objects.get(id=appointment_data['service_id'])
-            master = Master.objects.get(id=appointment_data['master_id'])
-            
-            client, created = Client.objects.get_or_create(
-                salon=salon,
-                telegram_id=user_id,
-                defaults={
-                    'full_name': user_name,
-                    'phone': 'Не указан'
-                }
-            )
-            
             # Create appointment
-            appointment = Appointment.objects.create(
-                salon=salon,
-                client=client,
-                service=service,
-                master=master,
-                scheduled_at=scheduled_at,
-                price=service.price
+            appointment = await queries.create_appointment(
+                appointment_data['salon_id'],
+                user_id,
+                appointment_data['service_id'],
+                appointment_data['master_id'],
+                scheduled_at,
+                client_name=user_name,
+                idempotency_key=update_idempotency_key(self.token, update)
             )
+            salon, service, master = appointment.salon, appointment.service, appointment.master
             
             success_message = f"""
 ✅ Запись создана!
@@ -579,15 +562,17 @@ ID салона: {salon.id}
             await update.message.reply_text(f"❌ Ошибка при создании записи: {str(e)}")
             context.user_data.clear()
     
+    @instrumented_handler('admin')
     async def handle_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle questions using AI and knowledge base"""
         question = update.message.text
         
-        # For now, send a simple response
-        # In a real implementation, this would:
-        # 1. Search embeddings for relevant information
-        # 2. Use OpenAI to generate a response based on context
-        # 3. Fall back to general salon information
+        salon_id = await queries.get_first_salon_id(self.user.id)
+        answer = await answer_question(salon_id, question) if salon_id else None
+        
+        if answer:
+            await update.message.reply_text(answer.text)
+            return
         
         await update.message.reply_text(
             f"❓ Вы спросили: {question}\n\n"
@@ -595,21 +580,18 @@ ID салона: {salon.id}
             "Используйте /help для просмотра доступных команд."
         )
     
+    @instrumented_handler('admin')
     async def handle_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle contact sharing"""
         contact = update.message.contact
         user_id = str(update.effective_user.id)
         
         # Update client phone number if exists
-        try:
-            client = Client.objects.get(telegram_id=user_id)
-            client.phone = contact.phone_number
-            client.save()
-            
+        if await queries.update_client_phone(user_id, contact.phone_number):
             await update.message.reply_text(
                 f"✅ Номер телефона обновлен: {contact.phone_number}"
             )
-        except Client.DoesNotExist:
+        else:
             await update.message.reply_text(
                 "ℹ️ Номер телефона сохранен для будущих записей."
             )
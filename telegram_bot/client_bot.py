@@ -11,10 +11,12 @@ from telegram.constants import ParseMode
 from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from core.models import Salon, Master, Service, Client, Appointment
-from core.tasks import search_embeddings
-from asgiref.sync import sync_to_async
-import openai
+from core.models import Salon
+from core.instrumentation import instrumented_handler
+from . import queries
+from .answering import answer_question
+from .dedup import update_idempotency_key
+from .rendering import get_locale, message_renderer
 
 User = get_user_model()
 
@@ -37,21 +39,31 @@ USER_DATA_BOOKING = 'booking_data'
 class SalonClientBot:
     """Бот для клиентов салона"""
     
-    def __init__(self, salon: Salon):
+    def __init__(self, salon: Salon, request=None, get_updates_request=None):
         self.salon = salon
         self.token = salon.telegram_bot_token
-        self.application = Application.builder().token(self.token).build()
+        
+        builder = Application.builder().token(self.token).base_url(f"{settings.TELEGRAM_API_URL}/bot")
+        if request is not None:
+            builder = builder.request(request)
+        if get_updates_request is not None:
+            builder = builder.get_updates_request(get_updates_request)
+        self.application = builder.build()
         self.setup_handlers()
     
     def setup_handlers(self):
         """Set up bot command and message handlers"""
-        self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("services", self.show_services))
-        self.application.add_handler(CommandHandler("book", self.book_appointment))
-        self.application.add_handler(CommandHandler("my_appointments", self.my_appointments))
-        self.application.add_handler(CommandHandler("cancel", self.cancel_appointment))
-        self.application.add_handler(CommandHandler("contact", self.contact_info))
+        self.commands = {
+            "start": self.start,
+            "help": self.help_command,
+            "services": self.show_services,
+            "book": self.book_appointment,
+            "my_appointments": self.my_appointments,
+            "cancel": self.cancel_appointment,
+            "contact": self.contact_info,
+        }
+        for command, callback in self.commands.items():
+            self.application.add_handler(CommandHandler(command, callback))
         
         # Callback query handler for inline keyboards
         self.application.add_handler(CallbackQueryHandler(self.button_callback))
@@ -62,24 +74,25 @@ class SalonClientBot:
         # Contact handler for phone number sharing
         self.application.add_handler(MessageHandler(filters.CONTACT, self.handle_contact))
     
+    async def render(self, user, name: str, *args):
+        """Cached message for the salon's current catalog; None if the salon or item is gone"""
+        catalog = await queries.get_catalog(self.salon.id)
+        if catalog is None:
+            return None
+        locale = get_locale(user.language_code if user else None)
+        return message_renderer.render(catalog, name, *args, locale=locale)
+    
+    @instrumented_handler('salon')
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
         user = update.effective_user
         
         # Get or create client
-        @sync_to_async
-        def get_or_create_client():
-            return Client.objects.get_or_create(
-                salon=self.salon,
-                telegram_id=str(user.id),
-                defaults={
-                    'full_name': f"{user.first_name or ''} {user.last_name or ''}".strip(),
-                    'phone': '',
-                    'email': ''
-                }
-            )
-        
-        client, created = await get_or_create_client()
+        client, created = await queries.get_or_create_client(
+            self.salon.id,
+            str(user.id),
+            f"{user.first_name or ''} {user.last_name or ''}".strip()
+        )
         
         if created:
             welcome_message = f"""
@@ -110,109 +123,35 @@ class SalonClientBot:
         
         await update.message.reply_text(welcome_message.strip())
     
+    @instrumented_handler('salon')
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /help command"""
-        help_text = f"""
-🤖 Команды бота {self.salon.name}:
-
-📅 /book - Записаться на услугу
-📋 /services - Посмотреть все услуги
-👥 /my_appointments - Мои записи
-❌ /cancel - Отменить запись
-📞 /contact - Контактная информация
-❓ /help - Показать это сообщение
-
-💬 Также вы можете просто написать мне вопрос, и я постараюсь помочь!
-
-📍 Адрес: {self.salon.address}
-📞 Телефон: {self.salon.phone}
-        """
-        
-        await update.message.reply_text(help_text.strip())
+        rendered = await self.render(update.effective_user, 'help')
+        if rendered:
+            await update.message.reply_text(rendered.text)
     
+    @instrumented_handler('salon')
     async def show_services(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show available services"""
-        @sync_to_async
-        def get_services():
-            return list(Service.objects.filter(salon=self.salon, is_active=True))
-        
-        services = await get_services()
-        
-        if not services:
-            await update.message.reply_text("❌ В данный момент нет доступных услуг.")
-            return
-        
-        services_text = f"💇‍♀️ Услуги салона {self.salon.name}:\n\n"
-        
-        # Group services by category
-        categories = {}
-        for service in services:
-            category = service.get_category_display()
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(service)
-        
-        for category, category_services in categories.items():
-            services_text += f"📂 {category}:\n"
-            for service in category_services:
-                master_info = f" (мастер: {service.master.full_name})" if service.master else ""
-                services_text += f"• {service.name}{master_info}\n"
-                services_text += f"  💰 {service.price} руб. | ⏱ {service.duration_minutes} мин.\n"
-                if service.description:
-                    services_text += f"  📝 {service.description}\n"
-                services_text += "\n"
-        
-        services_text += "📅 Для записи используйте команду /book"
-        
-        await update.message.reply_text(services_text)
+        rendered = await self.render(update.effective_user, 'services')
+        if rendered:
+            await update.message.reply_text(rendered.text)
     
+    @instrumented_handler('salon')
     async def book_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start booking process"""
-        @sync_to_async
-        def get_services():
-            return list(Service.objects.filter(salon=self.salon, is_active=True))
-        
-        services = await get_services()
-        
-        if not services:
-            await update.message.reply_text("❌ В данный момент нет доступных услуг.")
-            return
-        
-        # Create inline keyboard with services
-        keyboard = []
-        for service in services:
-            master_info = f" ({service.master.full_name})" if service.master else ""
-            keyboard.append([InlineKeyboardButton(
-                f"{service.name}{master_info} - {service.price} руб.",
-                callback_data=f"book_service_{service.id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"💇‍♀️ Выберите услугу в {self.salon.name}:",
-            reply_markup=reply_markup
-        )
+        rendered = await self.render(update.effective_user, 'select_service')
+        if rendered:
+            await update.message.reply_text(rendered.text, reply_markup=rendered.markup)
     
+    @instrumented_handler('salon')
     async def my_appointments(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show user's appointments"""
         user_id = str(update.effective_user.id)
         
-        @sync_to_async
-        def get_client_and_appointments():
-            try:
-                client = Client.objects.get(salon=self.salon, telegram_id=user_id)
-                appointments = list(Appointment.objects.filter(
-                    client=client,
-                    scheduled_at__gte=timezone.now()
-                ).order_by('scheduled_at'))
-                return client, appointments
-            except Client.DoesNotExist:
-                return None, []
-        
-        client, appointments = await get_client_and_appointments()
-        
-        if not client:
+        is_client, appointments = await queries.get_upcoming_appointments(user_id, salon_id=self.salon.id)
+        
+        if not is_client:
             await update.message.reply_text("❌ Вы не зарегистрированы в системе. Используйте /start")
             return
         
@@ -246,26 +185,16 @@ class SalonClientBot:
         
         await update.message.reply_text(appointments_text)
     
+    @instrumented_handler('salon')
     async def cancel_appointment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel appointment"""
         user_id = str(update.effective_user.id)
         
-        @sync_to_async
-        def get_client_and_appointments():
-            try:
-                client = Client.objects.get(salon=self.salon, telegram_id=user_id)
-                appointments = list(Appointment.objects.filter(
-                    client=client,
-                    scheduled_at__gte=timezone.now(),
-                    status__in=['scheduled', 'confirmed']
-                ).order_by('scheduled_at'))
-                return client, appointments
-            except Client.DoesNotExist:
-                return None, []
-        
-        client, appointments = await get_client_and_appointments()
-        
-        if not client:
+        is_client, appointments = await queries.get_upcoming_appointments(
+            user_id, salon_id=self.salon.id, statuses=['scheduled', 'confirmed']
+        )
+        
+        if not is_client:
             await update.message.reply_text("❌ Вы не зарегистрированы в системе. Используйте /start")
             return
         
@@ -288,28 +217,14 @@ class SalonClientBot:
             reply_markup=reply_markup
         )
     
+    @instrumented_handler('salon')
     async def contact_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show contact information"""
-        contact_text = f"""
-📞 Контактная информация
-
-🏪 {self.salon.name}
-📍 Адрес: {self.salon.address}
-📞 Телефон: {self.salon.phone}
-        """
-        
-        if self.salon.email:
-            contact_text += f"📧 Email: {self.salon.email}\n"
-        
-        if self.salon.working_hours:
-            hours_text = self.salon.working_hours.get('text', '')
-            if hours_text:
-                contact_text += f"🕐 Часы работы: {hours_text}\n"
-        
-        contact_text += "\n📅 Для записи используйте /book"
-        
-        await update.message.reply_text(contact_text.strip())
+        rendered = await self.render(update.effective_user, 'contact')
+        if rendered:
+            await update.message.reply_text(rendered.text)
     
+    @instrumented_handler('salon')
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle inline keyboard button presses"""
         query = update.callback_query
@@ -329,28 +244,18 @@ class SalonClientBot:
             appointment_id = data.split('_')[2]
             await self.handle_appointment_cancellation(query, context, appointment_id)
     
+    @instrumented_handler('salon')
     async def handle_service_booking(self, query, context, service_id):
         """Handle service booking"""
-        @sync_to_async
-        def get_service_and_masters():
-            try:
-                service = Service.objects.get(id=service_id, salon=self.salon)
-                if service.master:
-                    masters = [service.master]
-                else:
-                    masters = list(Master.objects.filter(salon=self.salon, is_active=True))
-                return service, masters
-            except Service.DoesNotExist:
-                return None, []
-        
-        service, masters = await get_service_and_masters()
-        
-        if not service:
-            await query.edit_message_text("❌ Услуга не найдена.")
+        rendered = await self.render(query.from_user, 'select_master', service_id)
+        
+        if not rendered:
+            await query.edit_message_text(message_renderer.text('service_not_found'))
             return
         
-        if not masters:
-            await query.edit_message_text("❌ Нет доступных мастеров для этой услуги.")
+        # No keyboard means there are no masters for the service
+        if not rendered.keyboard:
+            await query.edit_message_text(rendered.text)
             return
         
         # Store booking data
@@ -361,65 +266,31 @@ class SalonClientBot:
                 'step': 'select_master'
             }
         
-        # Create keyboard with masters
-        keyboard = []
-        for master in masters:
-            keyboard.append([InlineKeyboardButton(
-                f"👨‍💼 {master.full_name}",
-                callback_data=f"book_master_{master.id}"
-            )])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            f"💇‍♀️ Услуга: {service.name}\n"
-            f"💰 Цена: {service.price} руб.\n"
-            f"⏱ Длительность: {service.duration_minutes} мин.\n\n"
-            "👨‍💼 Выберите мастера:",
-            reply_markup=reply_markup
-        )
+        await query.edit_message_text(rendered.text, reply_markup=rendered.markup)
     
+    @instrumented_handler('salon')
     async def handle_master_selection(self, query, context, master_id):
         """Handle master selection"""
-        @sync_to_async
-        def get_master():
-            try:
-                return Master.objects.get(id=master_id, salon=self.salon)
-            except Master.DoesNotExist:
-                return None
-        
-        master = await get_master()
+        rendered = await self.render(query.from_user, 'select_date', master_id)
         
-        if not master:
-            await query.edit_message_text("❌ Мастер не найден.")
+        if not rendered:
+            await query.edit_message_text(message_renderer.text('master_not_found'))
             return
         
-        booking_data = context.user_data.get(USER_DATA_BOOKING, {})
-        booking_data['master_id'] = master_id
-        booking_data['step'] = 'select_date'
-        context.user_data[USER_DATA_BOOKING] = booking_data
+        if context.user_data is not None:
+            booking_data = context.user_data.get(USER_DATA_BOOKING, {})
+            booking_data['master_id'] = master_id
+            booking_data['step'] = 'select_date'
+            context.user_data[USER_DATA_BOOKING] = booking_data
         
-        await query.edit_message_text(
-            f"👨‍💼 Мастер: {master.full_name}\n\n"
-            "📅 Выберите удобную дату и время:\n\n"
-            "📝 Напишите желаемую дату и время в формате:\n"
-            "ДД.ММ.ГГГГ ЧЧ:ММ\n\n"
-            "Например: 25.12.2024 14:30"
-        )
+        await query.edit_message_text(rendered.text)
     
+    @instrumented_handler('salon')
     async def handle_appointment_cancellation(self, query, context, appointment_id):
         """Handle appointment cancellation"""
-        @sync_to_async
-        def cancel_appointment():
-            try:
-                appointment = Appointment.objects.get(id=appointment_id)
-                appointment.status = 'cancelled'
-                appointment.save()
-                return appointment
-            except Appointment.DoesNotExist:
-                return None
-        
-        appointment = await cancel_appointment()
+        appointment = await queries.cancel_appointment(
+            appointment_id, str(query.from_user.id), salon_id=self.salon.id
+        )
         
         if not appointment:
             await query.edit_message_text("❌ Запись не найдена.")
@@ -433,6 +304,25 @@ class SalonClientBot:
             "📞 При необходимости свяжитесь с нами для уточнения деталей."
         )
     
+    async def dispatch_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Route a message the way the polling handlers do (used by the webhook)"""
+        message = update.message
+        if message.contact:
+            await self.handle_contact(update, context)
+            return
+        
+        text = message.text or ''
+        if text.startswith('/'):
+            command = text.split()[0][1:].split('@', 1)[0]
+            handler = self.commands.get(command)
+            if handler:
+                await handler(update, context)
+            return
+        
+        if text:
+            await self.handle_message(update, context)
+    
+    @instrumented_handler('salon')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages"""
         user_state = context.user_data.get(USER_DATA_STATE) if context.user_data else None
@@ -443,6 +333,7 @@ class SalonClientBot:
             # Handle as question
             await self.handle_question(update, context)
     
+    @instrumented_handler('salon')
     async def handle_booking_process(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle booking process steps"""
         booking_data = context.user_data.get(USER_DATA_BOOKING, {}) if context.user_data else {}
@@ -464,25 +355,16 @@ class SalonClientBot:
                     return
                 
                 # Create appointment
-                @sync_to_async
-                def create_appointment():
-                    user_id = str(update.effective_user.id)
-                    client = Client.objects.get(salon=self.salon, telegram_id=user_id)
-                    service = Service.objects.get(id=booking_data['service_id'])
-                    master = Master.objects.get(id=booking_data['master_id'])
-                    
-                    appointment = Appointment.objects.create(
-                        salon=self.salon,
-                        client=client,
-                        service=service,
-                        master=master,
-                        scheduled_at=appointment_datetime,
-                        price=service.price,
-                        status='scheduled'
-                    )
-                    return appointment, service, master
-                
-                appointment, service, master = await create_appointment()
+                appointment = await queries.create_appointment(
+                    self.salon.id,
+                    str(update.effective_user.id),
+                    booking_data['service_id'],
+                    booking_data['master_id'],
+                    appointment_datetime,
+                    status='scheduled',
+                    idempotency_key=update_idempotency_key(self.token, update)
+                )
+                service, master = appointment.service, appointment.master
                 
                 success_message = f"""
 ✅ Запись успешно создана!
@@ -505,7 +387,8 @@ class SalonClientBot:
                 await update.message.reply_text(success_message.strip())
                 
                 # Clear booking data
-                context.user_data.clear()
+                if context.user_data is not None:
+                    context.user_data.clear()
                 
             except ValueError:
                 await update.message.reply_text(
@@ -517,12 +400,30 @@ class SalonClientBot:
                 await update.message.reply_text(
                     f"❌ Ошибка при создании записи: {str(e)}"
                 )
-                context.user_data.clear()
+                if context.user_data is not None:
+                    context.user_data.clear()
     
+    @instrumented_handler('salon')
     async def handle_question(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user questions using OpenAI"""
         user_question = update.message.text
         
+        if any(word in user_question.lower() for word in ['записаться', 'запись', 'записать']):
+            await self.book_appointment(update, context)
+            return
+        
+        answer = await answer_question(self.salon.id, user_question)
+        if answer:
+            await update.message.reply_text(answer.text)
+            return
+        
+        await self.handle_question_fallback(update, context)
+    
+    @instrumented_handler('salon')
+    async def handle_question_fallback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Answer with static replies when the AI pipeline is unavailable"""
+        user_question = update.message.text
+        
         # Simple responses for common questions
         if any(word in user_question.lower() for word in ['цена', 'стоимость', 'сколько']):
             await self.show_services(update, context)
@@ -551,22 +452,13 @@ class SalonClientBot:
             f"📞 {self.salon.phone}"
         )
     
+    @instrumented_handler('salon')
     async def handle_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle contact sharing"""
         contact = update.message.contact
         user_id = str(update.effective_user.id)
         
-        @sync_to_async
-        def update_client_phone():
-            try:
-                client = Client.objects.get(salon=self.salon, telegram_id=user_id)
-                client.phone = contact.phone_number
-                client.save()
-                return True
-            except Client.DoesNotExist:
-                return False
-        
-        success = await update_client_phone()
+        success = await queries.update_client_phone(user_id, contact.phone_number, salon_id=self.salon.id)
         
         if success:
             await update.message.reply_text(
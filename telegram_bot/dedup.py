@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import Appointment
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """
+    Time-windowed set of recently seen (bot, update_id) pairs.
+
+    Telegram redelivers an update when the webhook times out or fails, so
+    the first delivery claims the pair and retries inside the window are
+    dropped. A process-local LRU answers repeats without I/O; the shared
+    cache (SET NX via cache.add) catches retries that land on another
+    worker. If the cache is down only the local set is used.
+    """
+
+    def __init__(self, window: int = 600, max_local: int = 100000):
+        self.window = window
+        self.max_local = max_local
+        self._local: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, bot_id, update_id) -> str:
+        return f"tg_update:{bot_id}:{update_id}"
+
+    def claim(self, bot_id, update_id) -> bool:
+        """Mark the update as seen; False if it was already claimed"""
+        key = self._key(bot_id, update_id)
+        now = time.monotonic()
+
+        with self._lock:
+            # Entries share one window, so insertion order is expiry order
+            while self._local:
+                oldest, expires_at = next(iter(self._local.items()))
+                if expires_at > now and len(self._local) < self.max_local:
+                    break
+                self._local.pop(oldest)
+            if key in self._local:
+                return False
+            self._local[key] = now + self.window
+
+        try:
+            if not cache.add(key, 1, self.window):
+                return False
+        except Exception as e:
+            logger.error(f"Error claiming update {update_id} of bot {bot_id}: {str(e)}")
+        return True
+
+    def release(self, bot_id, update_id):
+        """Forget a claim so that Telegram's retry is processed"""
+        key = self._key(bot_id, update_id)
+        with self._lock:
+            self._local.pop(key, None)
+        try:
+            cache.delete(key)
+        except Exception as e:
+            logger.error(f"Error releasing update {update_id} of bot {bot_id}: {str(e)}")
+
+
+def update_idempotency_key(bot_token: str, update) -> str:
+    """Idempotency key of the rows an update creates; replays share it"""
+    bot_id = bot_token.split(':', 1)[0]
+    return Appointment.objects.make_idempotency_key('telegram', bot_id, update.update_id)
+
+
+update_deduplicator = UpdateDeduplicator(
+    window=settings.TELEGRAM_UPDATE_DEDUP_WINDOW,
+    max_local=settings.TELEGRAM_UPDATE_DEDUP_MAX_LOCAL,
+)
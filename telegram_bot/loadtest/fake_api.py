@@ -0,0 +1,211 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+
+class FakeBotAPI:
+    """
+    Local stand-in for the Telegram Bot API and the OpenAI endpoints the bots call.
+
+    Every call is recorded by method. Responses are delayed by latency
+    (plus random jitter) and a share of Bot API calls given by rate_429 is
+    answered with 429 Too Many Requests, as Telegram does under flood
+    control. Point settings.TELEGRAM_API_URL at url and
+    settings.OPENAI_BASE_URL at openai_url.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        embedding_dimensions: int = 1536,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.embedding_dimensions = embedding_dimensions
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter()
+        self.recent: List[dict] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.rejected.clear()
+            self.recent.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {'calls': dict(self.calls), 'rejected_429': dict(self.rejected)}
+
+    def record(self, method: str, params: dict, keep: int = 100):
+        with self._lock:
+            self.calls[method] += 1
+            self.recent.append({'method': method, **params})
+            del self.recent[:-keep]
+
+    def should_reject(self, method: str) -> bool:
+        with self._lock:
+            if self._random.random() < self.rate_429:
+                self.rejected[method] += 1
+                return True
+            return False
+
+    def delay(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def bot_result(self, method: str, params: dict):
+        """Plausible result of a Bot API method"""
+        if method in ('sendMessage', 'sendPhoto'):
+            chat_id = params.get('chat_id')
+            return {
+                'message_id': self.next_message_id(),
+                'date': int(time.time()),
+                'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Load test bot', 'username': 'loadtest_bot'}
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+
+    def openai_result(self, path: str, params: dict):
+        if path.endswith('/embeddings'):
+            inputs = params.get('input') or ''
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            tokens = sum(len(str(text)) // 4 + 1 for text in inputs)
+            return {
+                'object': 'list',
+                'data': [
+                    {
+                        'object': 'embedding',
+                        'index': index,
+                        'embedding': [self._random.uniform(-0.05, 0.05) for _ in range(self.embedding_dimensions)],
+                    }
+                    for index in range(len(inputs))
+                ],
+                'model': params.get('model', ''),
+                'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+            }
+        return {
+            'id': f"chatcmpl-{self.next_message_id()}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': params.get('model', ''),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': 'Тестовый ответ нагрузочного стенда.'},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 10, 'total_tokens': 110},
+        }
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _params(self) -> dict:
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if not body:
+                    return {}
+                if 'application/json' in content_type:
+                    return json.loads(body)
+                if 'application/x-www-form-urlencoded' in content_type:
+                    return dict(parse_qsl(body.decode('utf-8')))
+                return {}
+
+            def _reply(self, status: int, payload: dict):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                try:
+                    params = self._params()
+                except ValueError:
+                    params = {}
+                path = self.path.split('?', 1)[0]
+                api.delay()
+
+                if path.startswith('/v1/'):
+                    api.record(f"openai:{path[4:]}", {})
+                    self._reply(200, api.openai_result(path, params))
+                    return
+
+                if not path.startswith('/bot') or path.count('/') < 2:
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+                    return
+
+                method = path.rsplit('/', 1)[-1]
+                if api.should_reject(method):
+                    self._reply(429, {
+                        'ok': False,
+                        'error_code': 429,
+                        'description': f"Too Many Requests: retry after {api.retry_after}",
+                        'parameters': {'retry_after': api.retry_after},
+                    })
+                    return
+                api.record(method, params)
+                self._reply(200, {'ok': True, 'result': api.bot_result(method, params)})
+
+            do_GET = _handle
+            do_POST = _handle
+
+        return Handler
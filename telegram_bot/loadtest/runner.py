@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client as HTTPClient
+
+from core import fastjson
+from core.instrumentation import update_finished
+from core.models import Appointment
+from telegram_bot.replies import reply_stats
+from .scenarios import SimulatedUser
+
+
+class QueryCounter:
+    """execute_wrapper counting queries on every connection, including db_executor threads"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def install(self):
+        connection_created.connect(self._install, dispatch_uid='loadtest_query_counter')
+        for conn in connections.all():
+            self._install(None, conn)
+
+    def uninstall(self):
+        connection_created.disconnect(dispatch_uid='loadtest_query_counter')
+        for conn in connections.all():
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+class OutcomeCounter:
+    """update_finished receiver counting handler outcomes per scenario of the requesting worker"""
+
+    def __init__(self):
+        self.by_scenario: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def set_scenario(self, scenario: str):
+        self._local.scenario = scenario
+
+    def __call__(self, sender, trace, **kwargs):
+        scenario = getattr(self._local, 'scenario', None)
+        if scenario is None:
+            return
+        with self._lock:
+            self.by_scenario.setdefault(scenario, Counter())[trace.outcome] += 1
+
+    def install(self):
+        update_finished.connect(self, dispatch_uid='loadtest_outcome_counter')
+
+    def uninstall(self):
+        update_finished.disconnect(dispatch_uid='loadtest_outcome_counter')
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+@dataclass
+class LoadTestReport:
+    updates: int = 0
+    duration: float = 0.0
+    latencies: List[float] = field(default_factory=list, repr=False)
+    statuses: Counter = field(default_factory=Counter)
+    by_scenario: Dict[str, List[float]] = field(default_factory=dict, repr=False)
+    queries: int = 0
+    inline_replies: int = 0
+    outbound: Dict[str, int] = field(default_factory=dict)
+    rejected_429: Dict[str, int] = field(default_factory=dict)
+    outcomes: Dict[str, Dict[str, int]] = field(default_factory=dict)
+    bookings_expected: int = 0
+    bookings_created: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.updates / self.duration if self.duration else 0.0
+
+    @property
+    def outbound_calls(self) -> int:
+        return sum(count for method, count in self.outbound.items() if not method.startswith('openai:'))
+
+    @property
+    def handler_errors(self) -> int:
+        return sum(outcomes.get('error', 0) for outcomes in self.outcomes.values())
+
+    def per_update(self, value: int) -> float:
+        return value / self.updates if self.updates else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'updates': self.updates,
+            'duration_s': round(self.duration, 3),
+            'throughput_per_s': round(self.throughput, 2),
+            'latency_ms': {
+                name: round(percentile(self.latencies, fraction) * 1000, 2)
+                for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+            },
+            'latency_p95_ms_by_scenario': {
+                scenario: round(percentile(latencies, 0.95) * 1000, 2)
+                for scenario, latencies in sorted(self.by_scenario.items())
+            },
+            'statuses': dict(self.statuses),
+            'outcomes_by_scenario': self.outcomes,
+            'bookings': {'expected': self.bookings_expected, 'created': self.bookings_created},
+            'db_queries_per_update': round(self.per_update(self.queries), 2),
+            'outbound_calls_per_update': round(self.per_update(self.outbound_calls), 3),
+            'inline_replies_per_update': round(self.per_update(self.inline_replies), 3),
+            'outbound_calls': self.outbound,
+            'rejected_429': self.rejected_429,
+        }
+
+
+def run_load(users: List[SimulatedUser], concurrency: int, fake_api) -> LoadTestReport:
+    """
+    Drive all users' updates through the webhook view with concurrency workers.
+
+    Each user is pinned to one worker so its updates stay in order, and a
+    worker interleaves its users one update at a time like real traffic.
+    """
+    report = LoadTestReport()
+    lock = threading.Lock()
+    counter = QueryCounter()
+    outcomes = OutcomeCounter()
+    inline_before = reply_stats['inline']
+
+    def worker(assigned: List[SimulatedUser]):
+        client = HTTPClient()
+        step = 0
+        try:
+            while True:
+                batch = [user for user in assigned if step < len(user.updates)]
+                if not batch:
+                    break
+                for user in batch:
+                    body = fastjson.dumps(user.updates[step])
+                    outcomes.set_scenario(user.scenario)
+                    started = time.perf_counter()
+                    response = client.post(
+                        user.salon.path,
+                        data=body,
+                        content_type='application/json',
+                        secure=True,
+                        HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN=user.salon.secret,
+                    )
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        report.updates += 1
+                        report.latencies.append(elapsed)
+                        report.by_scenario.setdefault(user.scenario, []).append(elapsed)
+                        report.statuses[response.status_code] += 1
+                step += 1
+        finally:
+            connection.close()
+
+    fake_api.reset()
+    counter.install()
+    outcomes.install()
+    threads = [
+        threading.Thread(target=worker, args=(users[index::concurrency],), name=f"loadtest-{index}")
+        for index in range(concurrency)
+    ]
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        report.duration = time.perf_counter() - started
+        counter.uninstall()
+        outcomes.uninstall()
+
+    stats = fake_api.stats()
+    report.queries = counter.count
+    report.inline_replies = reply_stats['inline'] - inline_before
+    report.outbound = stats['calls']
+    report.rejected_429 = stats['rejected_429']
+    report.outcomes = {scenario: dict(counts) for scenario, counts in sorted(outcomes.by_scenario.items())}
+
+    # A handler may fail and still answer 200, so check that every booking script booked
+    booking_ids = [str(user.telegram_id) for user in users if user.scenario == 'book']
+    report.bookings_expected = len(booking_ids)
+    report.bookings_created = Appointment.objects.filter(client__telegram_id__in=booking_ids).count()
+    return report
@@ -0,0 +1,240 @@
+import random
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, List
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Salon, Master, Service, Client, Appointment
+from telegram_bot.webhooks import get_webhook_route_id, get_webhook_secret
+
+User = get_user_model()
+
+# Load test data is recognised by this username prefix and removed afterwards
+USERNAME_PREFIX = 'loadtest_'
+# Bot ids well above real Telegram ids so tokens never collide
+BOT_ID_BASE = 9_000_000_000
+TELEGRAM_ID_BASE = 8_000_000_000
+
+SERVICES = [
+    ('Стрижка женская', 'hair', Decimal('1800'), 60),
+    ('Окрашивание', 'hair', Decimal('4500'), 120),
+    ('Маникюр с покрытием', 'nails', Decimal('1500'), 90),
+    ('Педикюр', 'nails', Decimal('2000'), 90),
+    ('Чистка лица', 'face', Decimal('3000'), 60),
+    ('Массаж спины', 'massage', Decimal('2500'), 45),
+]
+MASTERS = [
+    ('Мария Петрова', 'Парикмахер'),
+    ('Ольга Смирнова', 'Мастер ногтевого сервиса'),
+    ('Елена Кузнецова', 'Косметолог'),
+]
+QUESTIONS = [
+    'Сколько стоит маникюр с покрытием?',
+    'Вы работаете в воскресенье?',
+    'Есть ли парковка рядом с салоном?',
+    'Можно ли оплатить картой?',
+    'Какие мастера делают окрашивание?',
+]
+
+# Share of simulated users following each scenario
+SCENARIO_WEIGHTS = {
+    'browse': 0.4,
+    'book': 0.25,
+    'cancel': 0.1,
+    'question': 0.25,
+}
+
+
+@dataclass
+class LoadTestSalon:
+    salon_id: object
+    token: str
+    path: str
+    secret: str
+    service_ids: List[str]
+    master_ids: List[str]
+
+
+@dataclass
+class SimulatedUser:
+    telegram_id: int
+    first_name: str
+    salon: LoadTestSalon
+    scenario: str
+    appointment_id: str = ''
+    updates: List[dict] = field(default_factory=list)
+
+
+def create_fixtures(salon_count: int, users_per_salon: int, rng: random.Random) -> List[SimulatedUser]:
+    """Create salons with bots, catalogs and clients; return the simulated users"""
+    users = []
+    scenarios, weights = zip(*SCENARIO_WEIGHTS.items())
+    scheduled_at = timezone.now() + timedelta(days=7)
+
+    with transaction.atomic():
+        for index in range(salon_count):
+            owner = User.objects.create_user(
+                username=f"{USERNAME_PREFIX}{index}_{secrets.token_hex(4)}",
+                password=secrets.token_urlsafe(16),
+            )
+            token = f"{BOT_ID_BASE + index}:LOADTEST{secrets.token_urlsafe(24)}"
+            salon = Salon.objects.create(
+                user=owner,
+                name=f"Салон нагрузочного теста {index + 1}",
+                address=f"ул. Тестовая, {index + 1}",
+                phone='+79990000000',
+                email=f"loadtest{index}@example.com",
+                working_hours={'text': 'Пн-Вс 10:00-21:00'},
+                telegram_bot_token=token,
+                telegram_bot_username=f"loadtest_{index}_bot",
+                openai_api_key='sk-loadtest',
+            )
+            masters = Master.objects.bulk_create([
+                Master(salon=salon, full_name=name, phone='+79990000001', specialization=specialization)
+                for name, specialization in MASTERS
+            ])
+            services = Service.objects.bulk_create([
+                Service(
+                    salon=salon,
+                    name=name,
+                    description=f"{name} в салоне {index + 1}",
+                    category=category,
+                    price=price,
+                    duration_minutes=duration,
+                )
+                for name, category, price, duration in SERVICES
+            ])
+            target = LoadTestSalon(
+                salon_id=salon.id,
+                token=token,
+                path=reverse('telegram_webhook', args=[get_webhook_route_id(token)]),
+                secret=get_webhook_secret(token),
+                service_ids=[str(service.id) for service in services],
+                master_ids=[str(master.id) for master in masters],
+            )
+
+            salon_users = [
+                SimulatedUser(
+                    telegram_id=TELEGRAM_ID_BASE + index * users_per_salon + number,
+                    first_name=f"Клиент {number + 1}",
+                    salon=target,
+                    scenario=rng.choices(scenarios, weights)[0],
+                )
+                for number in range(users_per_salon)
+            ]
+            clients = Client.objects.bulk_create([
+                Client(salon=salon, full_name=user.first_name, phone='+79990000002', telegram_id=str(user.telegram_id))
+                for user in salon_users
+            ])
+            # Users who cancel need an appointment to cancel
+            appointments = Appointment.objects.bulk_create([
+                Appointment(
+                    salon=salon,
+                    client=client,
+                    service=services[0],
+                    master=masters[0],
+                    scheduled_at=scheduled_at,
+                    price=services[0].price,
+                )
+                for user, client in zip(salon_users, clients) if user.scenario == 'cancel'
+            ])
+            for user, appointment in zip([u for u in salon_users if u.scenario == 'cancel'], appointments):
+                user.appointment_id = str(appointment.id)
+            users.extend(salon_users)
+
+    return users
+
+
+def delete_fixtures() -> int:
+    """Remove everything created by create_fixtures; returns the number of owners removed"""
+    owners = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    count = owners.count()
+    Salon.objects.filter(user__in=owners).delete()
+    owners.delete()
+    return count
+
+
+class UpdateFactory:
+    """Builds Telegram update payloads with per-bot increasing update_id"""
+
+    def __init__(self):
+        self._update_ids: Dict[str, int] = {}
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    def _next_ids(self, token: str):
+        with self._lock:
+            update_id = self._update_ids.get(token, 100000) + 1
+            self._update_ids[token] = update_id
+            self._message_id += 1
+            return update_id, self._message_id
+
+    def _user(self, user: SimulatedUser) -> dict:
+        return {'id': user.telegram_id, 'is_bot': False, 'first_name': user.first_name, 'language_code': 'ru'}
+
+    def _chat(self, user: SimulatedUser) -> dict:
+        return {'id': user.telegram_id, 'first_name': user.first_name, 'type': 'private'}
+
+    def message(self, user: SimulatedUser, text: str) -> dict:
+        update_id, message_id = self._next_ids(user.salon.token)
+        message = {
+            'message_id': message_id,
+            'from': self._user(user),
+            'chat': self._chat(user),
+            'date': int(time.time()),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user: SimulatedUser, data: str) -> dict:
+        update_id, message_id = self._next_ids(user.salon.token)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user),
+                'message': {
+                    'message_id': message_id,
+                    'from': {'id': int(user.salon.token.split(':')[0]), 'is_bot': True, 'first_name': 'Bot'},
+                    'chat': self._chat(user),
+                    'date': int(time.time()),
+                    'text': '...',
+                },
+                'chat_instance': str(user.telegram_id),
+                'data': data,
+            },
+        }
+
+
+def build_script(user: SimulatedUser, factory: UpdateFactory, rng: random.Random) -> List[dict]:
+    """Updates one user sends, in order"""
+    salon = user.salon
+    updates = [factory.message(user, '/start')]
+
+    if user.scenario == 'browse':
+        updates.append(factory.message(user, '/services'))
+        updates.append(factory.message(user, rng.choice(['/contact', '/help'])))
+    elif user.scenario == 'book':
+        date = (timezone.now() + timedelta(days=rng.randint(1, 30))).strftime('%d.%m.%Y')
+        updates.append(factory.message(user, '/book'))
+        updates.append(factory.callback(user, f"book_service_{rng.choice(salon.service_ids)}"))
+        updates.append(factory.callback(user, f"book_master_{rng.choice(salon.master_ids)}"))
+        updates.append(factory.message(user, f"{date} {rng.randint(10, 19)}:{rng.choice(['00', '30'])}"))
+    elif user.scenario == 'cancel':
+        updates.append(factory.message(user, '/my_appointments'))
+        updates.append(factory.message(user, '/cancel'))
+        updates.append(factory.callback(user, f"cancel_appointment_{user.appointment_id}"))
+    else:
+        updates.append(factory.message(user, rng.choice(QUESTIONS)))
+
+    return updates
@@ -0,0 +1,15 @@
+import time
+
+from celery import shared_task
+
+
+@shared_task
+def queue_latency_probe(enqueued_at: float) -> float:
+    """Seconds between enqueueing and starting this task (manage.py loadtest_queues)"""
+    return time.time() - enqueued_at
+
+
+@shared_task
+def simulate_bulk_work(seconds: float):
+    """Hold a worker slot like a long bulk task would (manage.py loadtest_queues)"""
+    time.sleep(seconds)
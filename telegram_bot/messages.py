@@ -276,4 +276,69 @@ VALIDATION_MESSAGES = {
     'name_too_short': '❌ Имя слишком короткое (минимум 2 символа).',
     'name_too_long': '❌ Имя слишком длинное (максимум 100 символов).',
     'required_field': '❌ Это поле обязательно для заполнения.',
-} 
\ No newline at end of file
+} 
+# Клиентский бот салона (шаблоны для telegram_bot.rendering)
+CLIENT_BOT_MESSAGES = {
+    'help': '''
+🤖 Команды бота {salon_name}:
+
+📅 /book - Записаться на услугу
+📋 /services - Посмотреть все услуги
+👥 /my_appointments - Мои записи
+❌ /cancel - Отменить запись
+📞 /contact - Контактная информация
+❓ /help - Показать это сообщение
+
+💬 Также вы можете просто написать мне вопрос, и я постараюсь помочь!
+
+📍 Адрес: {address}
+📞 Телефон: {phone}
+''',
+    'contact': '''
+📞 Контактная информация
+
+🏪 {salon_name}
+📍 Адрес: {address}
+📞 Телефон: {phone}
+''',
+    'contact_email': '📧 Email: {email}\n',
+    'contact_hours': '🕐 Часы работы: {working_hours}\n',
+    'contact_footer': '\n📅 Для записи используйте /book',
+    'services_header': '💇‍♀️ Услуги салона {salon_name}:\n\n',
+    'services_category': '📂 {category}:\n',
+    'services_item': '• {name}{master}\n  💰 {price} руб. | ⏱ {duration} мин.\n',
+    'services_item_master': ' (мастер: {master})',
+    'services_item_description': '  📝 {description}\n',
+    'services_footer': '📅 Для записи используйте команду /book',
+    'no_services': '❌ В данный момент нет доступных услуг.',
+    'select_service': '💇‍♀️ Выберите услугу в {salon_name}:',
+    'select_service_button': '{name}{master} - {price} руб.',
+    'select_service_button_master': ' ({master})',
+    'select_master': '''
+💇‍♀️ Услуга: {name}
+💰 Цена: {price} руб.
+⏱ Длительность: {duration} мин.
+
+👨‍💼 Выберите мастера:
+''',
+    'select_master_button': '👨‍💼 {master}',
+    'service_not_found': '❌ Услуга не найдена.',
+    'no_masters': '❌ Нет доступных мастеров для этой услуги.',
+    'select_date': '''
+👨‍💼 Мастер: {master}
+
+📅 Выберите удобную дату и время:
+
+📝 Напишите желаемую дату и время в формате:
+ДД.ММ.ГГГГ ЧЧ:ММ
+
+Например: 25.12.2024 14:30
+''',
+    'master_not_found': '❌ Мастер не найден.',
+}
+
+# Шаблоны по языкам; неизвестные языки получают DEFAULT_LOCALE
+DEFAULT_LOCALE = 'ru'
+TEMPLATES = {
+    'ru': CLIENT_BOT_MESSAGES,
+}
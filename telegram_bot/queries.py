@@ -0,0 +1,177 @@
+from typing import List, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.catalog import CatalogSnapshot, catalog_cache
+from core.db import db_call, db_executor
+from core.models import Salon, Master, Service, Client, Appointment
+
+
+async def get_catalog(salon_id) -> Optional[CatalogSnapshot]:
+    """Salon catalog snapshot; a fresh in-process copy is returned without a thread hop"""
+    return catalog_cache.peek(salon_id) or await db_executor.run(catalog_cache.get, salon_id)
+
+
+@db_call
+def get_or_create_client(salon_id, telegram_id: str, full_name: str) -> Tuple[Client, bool]:
+    return Client.objects.get_or_create(
+        salon_id=salon_id,
+        telegram_id=telegram_id,
+        defaults={
+            'full_name': full_name,
+            'phone': '',
+            'email': ''
+        }
+    )
+
+
+@db_call
+def get_service_with_masters(service_id, salon_id=None) -> Tuple[Optional[Service], List[Master]]:
+    """Service and the masters who can perform it"""
+    services = Service.objects.select_related('master')
+    if salon_id is not None:
+        services = services.filter(salon_id=salon_id)
+    service = services.filter(id=service_id).first()
+    if service is None:
+        return None, []
+    if service.master:
+        return service, [service.master]
+    return service, list(Master.objects.filter(salon_id=service.salon_id, is_active=True))
+
+
+@db_call
+def get_master(master_id, salon_id=None) -> Optional[Master]:
+    masters = Master.objects.filter(id=master_id)
+    if salon_id is not None:
+        masters = masters.filter(salon_id=salon_id)
+    return masters.first()
+
+
+@db_call
+def get_upcoming_appointments(telegram_id: str, salon_id=None, statuses=None) -> Tuple[bool, List[Appointment]]:
+    """
+    Upcoming appointments of a Telegram user, with salon, service and master.
+
+    Returns (is_client, appointments); the client lookup only runs when
+    there are no appointments.
+    """
+    appointments = Appointment.objects.filter(
+        client__telegram_id=telegram_id,
+        scheduled_at__gte=timezone.now()
+    )
+    clients = Client.objects.filter(telegram_id=telegram_id)
+    if salon_id is not None:
+        appointments = appointments.filter(salon_id=salon_id)
+        clients = clients.filter(salon_id=salon_id)
+    if statuses:
+        appointments = appointments.filter(status__in=statuses)
+
+    appointments = list(
+        appointments.select_related('salon', 'service', 'master').order_by('scheduled_at')
+    )
+    if appointments:
+        return True, appointments
+    return clients.exists(), []
+
+
+@db_call
+def cancel_appointment(appointment_id, telegram_id: str, salon_id=None) -> Optional[Appointment]:
+    """Cancel an appointment that belongs to the Telegram user"""
+    appointments = Appointment.objects.select_related('salon', 'service', 'master').filter(
+        id=appointment_id,
+        client__telegram_id=telegram_id
+    )
+    if salon_id is not None:
+        appointments = appointments.filter(salon_id=salon_id)
+    appointment = appointments.first()
+    if appointment is None:
+        return None
+    # Cancelling twice (e.g. a replayed update) leaves the row untouched
+    if appointment.status != 'cancelled':
+        appointment.status = 'cancelled'
+        appointment.save(update_fields=['status', 'updated_at'])
+    return appointment
+
+
+@db_call
+def create_appointment(
+    salon_id,
+    telegram_id: str,
+    service_id,
+    master_id,
+    scheduled_at,
+    status: str = 'planned',
+    client_name: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> Appointment:
+    """
+    Book an appointment in one transaction.
+
+    With client_name the client is created if needed, otherwise the user
+    must already be a client of the salon. A repeated idempotency_key
+    returns the appointment created the first time.
+    """
+    with transaction.atomic():
+        salon = Salon.objects.get(id=salon_id)
+        service = Service.objects.select_related('master').get(id=service_id, salon_id=salon_id)
+        master = Master.objects.get(id=master_id, salon_id=salon_id)
+        if client_name is None:
+            client = Client.objects.get(salon_id=salon_id, telegram_id=telegram_id)
+        else:
+            client, _ = Client.objects.get_or_create(
+                salon_id=salon_id,
+                telegram_id=telegram_id,
+                defaults={
+                    'full_name': client_name,
+                    'phone': 'Не указан'
+                }
+            )
+        appointment, _ = Appointment.objects.create_idempotent(
+            idempotency_key,
+            salon=salon,
+            client=client,
+            service=service,
+            master=master,
+            scheduled_at=scheduled_at,
+            price=service.price,
+            status=status
+        )
+        return appointment
+
+
+@db_call
+def update_client_phone(telegram_id: str, phone: str, salon_id=None) -> bool:
+    """Store the shared phone number on the user's client records"""
+    clients = Client.objects.filter(telegram_id=telegram_id)
+    if salon_id is not None:
+        clients = clients.filter(salon_id=salon_id)
+    return clients.update(phone=phone, updated_at=timezone.now()) > 0
+
+
+@db_call
+def get_owner_salons(user_id) -> List[Salon]:
+    return list(Salon.objects.filter(user_id=user_id).order_by('created_at'))
+
+
+@db_call
+def get_first_salon_id(user_id):
+    return Salon.objects.filter(user_id=user_id).order_by('created_at').values_list('id', flat=True).first()
+
+
+@db_call
+def get_owner_salon_with_services(user_id, salon_id) -> Tuple[Optional[Salon], List[Service]]:
+    salon = Salon.objects.filter(id=salon_id, user_id=user_id).first()
+    if salon is None:
+        return None, []
+    services = list(
+        Service.objects.filter(salon=salon, is_active=True)
+        .select_related('master')
+        .order_by('category', 'name')
+    )
+    return salon, services
+
+
+@db_call
+def create_salon(user_id, **fields) -> Salon:
+    return Salon.objects.create(user_id=user_id, **fields)
@@ -0,0 +1,200 @@
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from core.catalog import CatalogSnapshot
+from . import messages
+
+logger = logging.getLogger(__name__)
+
+Keyboard = Tuple[Tuple[Tuple[str, str], ...], ...]
+
+
+@dataclass
+class RenderedMessage:
+    """
+    Ready-to-send message: text plus inline keyboard.
+
+    reply_markup is the Bot API JSON form of the keyboard and markup the
+    python-telegram-bot object; both are built once and shared by every
+    send, which is safe because PTB objects are immutable.
+    """
+    text: str
+    keyboard: Keyboard = ()
+    reply_markup: Optional[dict] = field(init=False, default=None)
+    markup: Optional[InlineKeyboardMarkup] = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        if self.keyboard:
+            self.reply_markup = {
+                'inline_keyboard': [
+                    [{'text': text, 'callback_data': data} for text, data in row]
+                    for row in self.keyboard
+                ]
+            }
+            self.markup = InlineKeyboardMarkup([
+                [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+                for row in self.keyboard
+            ])
+
+    def payload(self, chat_id) -> dict:
+        """sendMessage parameters for chat_id"""
+        payload = {'chat_id': chat_id, 'text': self.text}
+        if self.reply_markup:
+            payload['reply_markup'] = self.reply_markup
+        return payload
+
+
+def get_locale(language_code: Optional[str]) -> str:
+    """Template locale for a Telegram user's language_code"""
+    language = (language_code or '').split('-', 1)[0].lower()
+    return language if language in messages.TEMPLATES else messages.DEFAULT_LOCALE
+
+
+def _render_help(catalog: CatalogSnapshot, t: Dict[str, str]) -> RenderedMessage:
+    salon = catalog.salon
+    return RenderedMessage(t['help'].format(
+        salon_name=salon.name, address=salon.address, phone=salon.phone
+    ).strip())
+
+
+def _render_contact(catalog: CatalogSnapshot, t: Dict[str, str]) -> RenderedMessage:
+    salon = catalog.salon
+    text = t['contact'].format(salon_name=salon.name, address=salon.address, phone=salon.phone)
+    if salon.email:
+        text += t['contact_email'].format(email=salon.email)
+    if salon.working_hours_text:
+        text += t['contact_hours'].format(working_hours=salon.working_hours_text)
+    text += t['contact_footer']
+    return RenderedMessage(text.strip())
+
+
+def _render_services(catalog: CatalogSnapshot, t: Dict[str, str]) -> RenderedMessage:
+    if not catalog.services:
+        return RenderedMessage(t['no_services'])
+
+    parts = [t['services_header'].format(salon_name=catalog.salon.name)]
+    for category, services in catalog.services_by_category().items():
+        parts.append(t['services_category'].format(category=category))
+        for service in services:
+            master = t['services_item_master'].format(master=service.master.full_name) if service.master else ''
+            parts.append(t['services_item'].format(
+                name=service.name, master=master, price=service.price, duration=service.duration_minutes
+            ))
+            if service.description:
+                parts.append(t['services_item_description'].format(description=service.description))
+            parts.append('\n')
+    parts.append(t['services_footer'])
+    return RenderedMessage(''.join(parts))
+
+
+def _render_select_service(catalog: CatalogSnapshot, t: Dict[str, str]) -> RenderedMessage:
+    if not catalog.services:
+        return RenderedMessage(t['no_services'])
+
+    keyboard = tuple(
+        ((
+            t['select_service_button'].format(
+                name=service.name,
+                master=t['select_service_button_master'].format(master=service.master.full_name)
+                if service.master else '',
+                price=service.price,
+            ),
+            f"book_service_{service.id}",
+        ),)
+        for service in catalog.services
+    )
+    return RenderedMessage(t['select_service'].format(salon_name=catalog.salon.name), keyboard)
+
+
+def _render_select_master(catalog: CatalogSnapshot, t: Dict[str, str], service_id) -> Optional[RenderedMessage]:
+    service = catalog.service(service_id)
+    if service is None:
+        return None
+    masters = catalog.masters_for(service)
+    if not masters:
+        return RenderedMessage(t['no_masters'])
+
+    keyboard = tuple(
+        ((t['select_master_button'].format(master=master.full_name), f"book_master_{master.id}"),)
+        for master in masters
+    )
+    text = t['select_master'].format(
+        name=service.name, price=service.price, duration=service.duration_minutes
+    ).strip()
+    return RenderedMessage(text, keyboard)
+
+
+def _render_select_date(catalog: CatalogSnapshot, t: Dict[str, str], master_id) -> Optional[RenderedMessage]:
+    master = catalog.master(master_id)
+    if master is None:
+        return None
+    return RenderedMessage(t['select_date'].format(master=master.full_name).strip())
+
+
+RENDERERS = {
+    'help': _render_help,
+    'contact': _render_contact,
+    'services': _render_services,
+    'select_service': _render_select_service,
+    'select_master': _render_select_master,
+    'select_date': _render_select_date,
+}
+
+
+class MessageRenderer:
+    """
+    Cache of rendered bot messages.
+
+    Entries are keyed by salon, catalog version, locale, message name and
+    arguments, so a catalog change simply stops matching old entries and
+    nothing has to be invalidated; stale ones age out of the LRU. Snapshots
+    built while the shared cache was down carry version 0 and are rendered
+    without caching, since two different catalogs can share it. Rendering
+    works from the catalog snapshot, which is already shared through
+    core.catalog, so only the rendered output is kept per process.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, catalog: CatalogSnapshot, name: str, *args, locale: Optional[str] = None) -> Optional[RenderedMessage]:
+        """Rendered message name for the catalog, or None if an argument refers to a missing item"""
+        locale = locale if locale in messages.TEMPLATES else messages.DEFAULT_LOCALE
+        if not catalog.version:
+            return RENDERERS[name](catalog, messages.TEMPLATES[locale], *args)
+        key = (catalog.salon.id, catalog.version, locale, name, tuple(str(arg) for arg in args))
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        rendered = RENDERERS[name](catalog, messages.TEMPLATES[locale], *args)
+
+        with self._lock:
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rendered
+
+    def text(self, name: str, locale: Optional[str] = None, **kwargs) -> str:
+        """Plain template text that does not depend on the catalog"""
+        locale = locale if locale in messages.TEMPLATES else messages.DEFAULT_LOCALE
+        template = messages.TEMPLATES[locale][name]
+        return template.format(**kwargs) if kwargs else template
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries)}
+
+
+message_renderer = MessageRenderer(max_entries=settings.BOT_RENDER_CACHE_SIZE)
@@ -0,0 +1,125 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+from core.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# Bot API methods that may be answered in the webhook response body
+INLINE_METHODS = {'sendMessage', 'editMessageText', 'answerCallbackQuery'}
+
+# How many calls were answered inline vs sent through the outbound client
+reply_stats = Counter()
+
+_collector: ContextVar[Optional['ReplyCollector']] = ContextVar('webhook_reply_collector', default=None)
+
+
+class ReplyCollector:
+    """
+    Holds the first Bot API call made while handling a webhook update.
+
+    Telegram executes one method call returned in the webhook response
+    body, which saves an outbound request. The call is only held while it
+    is the only one: as soon as a second call is made the held one is sent
+    first, so messages still arrive in order.
+    """
+
+    def __init__(self, token: str):
+        self.token = token
+        self.held: Optional[tuple] = None
+        self.closed = False
+
+    def hold(self, method: str, params: dict, original=None) -> Tuple[bool, Optional[tuple]]:
+        """
+        Offer a call; returns (held, previous).
+
+        previous is the (method, params, original) call held before, which
+        the caller must send before its own call.
+        """
+        if self.closed:
+            return False, None
+        if self.held is None and method in INLINE_METHODS:
+            self.held = (method, params, original)
+            return True, None
+        self.closed = True
+        previous, self.held = self.held, None
+        return False, previous
+
+    def response(self) -> Optional[dict]:
+        """Webhook response body for the held call, if any"""
+        self.closed = True
+        if self.held is None:
+            return None
+        method, params, _ = self.held
+        self.held = None
+        reply_stats['inline'] += 1
+        return {'method': method, **params}
+
+
+def current_collector(token: str) -> Optional[ReplyCollector]:
+    collector = _collector.get()
+    return collector if collector is not None and collector.token == token else None
+
+
+@contextmanager
+def collect_reply(token: str):
+    """Collect the first Bot API call of token's bot made inside the block"""
+    collector = ReplyCollector(token)
+    reset = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(reset)
+
+
+def _fake_result(method: str, params: dict):
+    """Result PTB expects for a call that Telegram will execute later"""
+    if method == 'sendMessage':
+        return {
+            'message_id': 0,
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id'), 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+    return True
+
+
+class InlineReplyRequest(HTTPXRequest):
+    """
+    HTTPXRequest that lets the active ReplyCollector hold the first call.
+
+    Held calls get a synthetic successful result; the real result is never
+    known because Telegram does not report errors for webhook replies.
+    """
+
+    def __init__(self, token: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.token = token
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        collector = current_collector(self.token)
+        if collector is None or request_data is None or request_data.contains_files:
+            reply_stats['outbound'] += 1
+            with stage('outbound'):
+                return await super().do_request(url, method, request_data, *args, **kwargs)
+
+        api_method = url.rsplit('/', 1)[-1]
+        held, previous = collector.hold(api_method, request_data.parameters, (url, method, request_data))
+        if previous is not None:
+            reply_stats['outbound'] += 1
+            with stage('outbound'):
+                await super().do_request(*previous[2], *args, **kwargs)
+        if held:
+            body = {'ok': True, 'result': _fake_result(api_method, request_data.parameters)}
+            return 200, json.dumps(body).encode('utf-8')
+
+        reply_stats['outbound'] += 1
+        with stage('outbound'):
+            return await super().do_request(url, method, request_data, *args, **kwargs)
@@ -0,0 +1,172 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Renew the lease if we own it, take it if it is free
+ACQUIRE_LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not owner then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Delete the lease only if we still own it
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self.nodes: List[str] = sorted(set(nodes))
+        self._ring = []
+        for node in self.nodes:
+            for index in range(vnodes):
+                self._ring.append((_hash(f"{node}#{index}"), node))
+        self._ring.sort()
+        self._hashes = [point for point, _ in self._ring]
+
+    def get_node(self, key: str) -> Optional[str]:
+        """Return the node owning key, or None for an empty ring"""
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._ring)
+        return self._ring[index][1]
+
+
+class ShardCoordinator:
+    """
+    Distributes bots across worker processes and nodes.
+
+    Workers announce themselves with a heartbeat in a Redis sorted set and
+    build the same consistent hash ring from the live members. A worker runs
+    a bot only when the ring assigns it that bot AND it holds the bot's
+    lease key, so a bot is never polled twice even while workers join or
+    leave and their views of the ring briefly disagree. Leases of a dead
+    worker expire after lease_ttl and are picked up by the new owner.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        worker_id: Optional[str] = None,
+        lease_ttl: float = 90.0,
+        vnodes: int = 64,
+        prefix: str = 'salonify:bots',
+    ):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(redis_url)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_ttl = lease_ttl
+        self.vnodes = vnodes
+        self.members_key = f"{prefix}:workers"
+        self.lease_prefix = f"{prefix}:lease:"
+        self.ring = HashRing([self.worker_id], vnodes)
+        self.held: Set[str] = set()
+
+        self._acquire = self.redis.register_script(ACQUIRE_LEASE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+
+    async def heartbeat(self) -> List[str]:
+        """Refresh our membership, drop dead workers and rebuild the ring"""
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.members_key, {self.worker_id: now})
+        pipe.zremrangebyscore(self.members_key, '-inf', now - self.lease_ttl)
+        pipe.zrange(self.members_key, 0, -1)
+        _, _, members = await pipe.execute()
+
+        members = [m.decode() if isinstance(m, bytes) else m for m in members]
+        if sorted(members) != self.ring.nodes:
+            logger.info(f"Shard membership changed: {len(members)} workers")
+            self.ring = HashRing(members, self.vnodes)
+        return members
+
+    async def assign(self, keys: Iterable[str]) -> Set[str]:
+        """
+        Return the subset of keys this worker should run, acquiring leases.
+
+        Leases for bots that were rebalanced away are kept until the caller
+        has stopped them and calls release().
+        """
+        candidates = [key for key in keys if self.ring.get_node(key) == self.worker_id]
+
+        ttl_ms = int(self.lease_ttl * 1000)
+        pipe = self.redis.pipeline()
+        for key in candidates:
+            await self._acquire(
+                keys=[self.lease_prefix + key],
+                args=[self.worker_id, ttl_ms],
+                client=pipe,
+            )
+        results = await pipe.execute() if candidates else []
+
+        owned = {key for key, acquired in zip(candidates, results) if acquired}
+        self.held |= owned
+        return owned
+
+    async def renew(self) -> Set[str]:
+        """
+        Extend the leases we hold and return the keys whose lease was lost.
+
+        Raises if Redis is unreachable; the caller decides when the leases
+        may have expired and its bots must stop.
+        """
+        held = list(self.held)
+        await self.heartbeat()
+        if not held:
+            return set()
+
+        ttl_ms = int(self.lease_ttl * 1000)
+        pipe = self.redis.pipeline()
+        for key in held:
+            await self._acquire(
+                keys=[self.lease_prefix + key],
+                args=[self.worker_id, ttl_ms],
+                client=pipe,
+            )
+        results = await pipe.execute()
+
+        lost = {key for key, renewed in zip(held, results) if not renewed}
+        self.held -= lost
+        return lost
+
+    async def release(self, key: str):
+        """Give up the lease for key so its new owner can start it"""
+        try:
+            await self._release(keys=[self.lease_prefix + key], args=[self.worker_id])
+        except Exception as e:
+            logger.error(f"Error releasing lease for {key}: {str(e)}")
+        self.held.discard(key)
+
+    async def leave(self):
+        """Release all leases and leave the membership set"""
+        for key in list(self.held):
+            await self.release(key)
+        try:
+            await self.redis.zrem(self.members_key, self.worker_id)
+        finally:
+            await self.redis.aclose()
@@ -0,0 +1,395 @@
+import asyncio
+import logging
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from telegram.request import HTTPXRequest
+
+from core.instrumentation import stage
+from core.models import Salon
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Bot entry states
+STATE_STARTING = 'starting'
+STATE_RUNNING = 'running'
+STATE_BACKOFF = 'backoff'
+STATE_STOPPED = 'stopped'
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest shared between many bot applications.
+
+    Application.shutdown() of a single bot must not close the pool used by
+    the rest of the fleet, so shutdown is a no-op and the supervisor closes
+    the pool explicitly via close().
+    """
+
+    async def do_request(self, *args, **kwargs):
+        with stage('outbound'):
+            return await super().do_request(*args, **kwargs)
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        await super().shutdown()
+
+
+@dataclass
+class ManagedBot:
+    """Supervised bot with its restart and health bookkeeping"""
+    key: str
+    token: str
+    factory: Callable
+    bot: Optional[object] = None
+    task: Optional[asyncio.Task] = None
+    state: str = STATE_STARTING
+    restarts: int = 0
+    last_error: str = ''
+    started_at: Optional[float] = None
+    updated_at: Optional[object] = None
+    stop_event: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+class BotSupervisor:
+    """
+    Runs many long-polling bots on one event loop.
+
+    All bots share two HTTP connection pools (one for regular Bot API calls,
+    one for getUpdates long polls, which needs a connection per bot). Startup is concurrent but bounded and
+    staggered, the bot set is periodically synced with Salon/User tokens,
+    and crashed pollers are restarted with exponential backoff.
+
+    With a ShardCoordinator the supervisor only runs the bots its worker
+    owns, so several processes or nodes can share the fleet. Leases are
+    renewed by a separate task every lease_ttl/3, so a slow database cannot
+    let them expire, and bots are stopped once their leases may have lapsed.
+    """
+
+    def __init__(
+        self,
+        include_admin_bots: bool = True,
+        sync_interval: float = 30.0,
+        health_interval: float = 10.0,
+        startup_concurrency: int = 20,
+        startup_stagger: float = 0.05,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        pool_size: int = 256,
+        get_updates_pool_size: int = 1024,
+        measure_memory: bool = False,
+        coordinator=None,
+    ):
+        self.include_admin_bots = include_admin_bots
+        self.sync_interval = sync_interval
+        self.health_interval = health_interval
+        self.startup_stagger = startup_stagger
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.measure_memory = measure_memory
+        self.coordinator = coordinator
+        self.get_updates_pool_size = get_updates_pool_size
+
+        self.bots: Dict[str, ManagedBot] = {}
+        self._startup_semaphore = asyncio.Semaphore(startup_concurrency)
+        self._stopping = asyncio.Event()
+        self._memory_baseline = 0
+
+        self.request = SharedHTTPXRequest(
+            connection_pool_size=pool_size,
+            read_timeout=10.0,
+            write_timeout=10.0,
+            connect_timeout=10.0,
+            pool_timeout=5.0,
+        )
+        # Every idle bot holds one connection in a long poll
+        self.get_updates_request = SharedHTTPXRequest(
+            connection_pool_size=get_updates_pool_size,
+            read_timeout=30.0,
+            connect_timeout=10.0,
+            pool_timeout=30.0,
+        )
+
+    async def run_forever(self):
+        """Sync bots with the database until stop() is called"""
+        if self.measure_memory:
+            tracemalloc.start()
+            self._memory_baseline = tracemalloc.get_traced_memory()[0]
+
+        await self.request.initialize()
+        await self.get_updates_request.initialize()
+
+        renew_task = None
+        if self.coordinator is not None:
+            renew_task = asyncio.create_task(self._renew_leases(), name='lease-renewal')
+
+        last_health_report = 0.0
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await self.sync()
+                except Exception as e:
+                    logger.error(f"Error syncing bots: {str(e)}")
+
+                if time.monotonic() - last_health_report >= self.health_interval:
+                    self.log_health()
+                    last_health_report = time.monotonic()
+
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.sync_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if renew_task is not None:
+                renew_task.cancel()
+                await asyncio.gather(renew_task, return_exceptions=True)
+            await self.stop_all()
+            await self.request.close()
+            await self.get_updates_request.close()
+            if self.coordinator is not None:
+                await self.coordinator.leave()
+            if self.measure_memory:
+                tracemalloc.stop()
+
+    def stop(self):
+        """Ask run_forever() to stop all bots and return"""
+        self._stopping.set()
+
+    async def sync(self):
+        """Add, remove and restart bots to match tokens stored in the database"""
+        targets = await self._load_targets()
+
+        if self.coordinator is not None:
+            await self.coordinator.heartbeat()
+            owned = await self.coordinator.assign(targets.keys())
+            for key in list(self.bots):
+                if key in targets and key not in owned:
+                    logger.info(f"Removing bot {key}: owned by another worker")
+                    await self.remove_bot(key)
+            targets = {key: value for key, value in targets.items() if key in owned}
+
+        for key in list(self.bots):
+            if key not in targets:
+                logger.info(f"Removing bot {key}: token was cleared")
+                await self.remove_bot(key)
+
+        new_entries = []
+        for key, (token, obj, factory) in targets.items():
+            entry = self.bots.get(key)
+            if entry and entry.token != token:
+                logger.info(f"Restarting bot {key}: token changed")
+                await self.remove_bot(key, release=False)
+                entry = None
+
+            if entry is None:
+                entry = ManagedBot(key=key, token=token, factory=factory, updated_at=obj.updated_at)
+                self.bots[key] = entry
+                new_entries.append(entry)
+            elif entry.updated_at != obj.updated_at:
+                # Refresh cached model data (name, address, ...) without a restart
+                entry.factory = factory
+                entry.updated_at = obj.updated_at
+                if entry.bot is not None:
+                    self._refresh_bot_object(entry.bot, obj)
+
+        if len(self.bots) > self.get_updates_pool_size:
+            logger.warning(
+                f"{len(self.bots)} bots share {self.get_updates_pool_size} getUpdates connections, "
+                f"some long polls will wait for a free one; raise BOT_GET_UPDATES_POOL_SIZE"
+            )
+
+        for index, entry in enumerate(new_entries):
+            entry.task = asyncio.create_task(
+                self._supervise(entry, delay=index * self.startup_stagger),
+                name=f"bot-{entry.key}",
+            )
+
+    async def _renew_leases(self):
+        """Keep our leases alive independently of sync() and the database"""
+        interval = self.coordinator.lease_ttl / 3
+        last_renewed = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                lost = await self.coordinator.renew()
+                last_renewed = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error renewing bot leases: {str(e)}")
+                # Stop before the next attempt could come after the leases expire
+                if time.monotonic() - last_renewed + interval < self.coordinator.lease_ttl:
+                    continue
+                lost = set(self.coordinator.held)
+
+            for key in lost:
+                if key in self.bots:
+                    logger.error(f"Stopping bot {key}: lease lost")
+                    await self.remove_bot(key, release=False)
+                self.coordinator.held.discard(key)
+
+    async def remove_bot(self, key: str, release: bool = True):
+        """Stop and forget a supervised bot"""
+        entry = self.bots.pop(key, None)
+        if entry is None:
+            return
+        entry.stop_event.set()
+        if entry.task is not None:
+            try:
+                await entry.task
+            except Exception as e:
+                logger.error(f"Error stopping bot {key}: {str(e)}")
+        # Only hand the bot over once it has stopped polling
+        if release and self.coordinator is not None:
+            await self.coordinator.release(key)
+
+    async def stop_all(self):
+        """Stop every supervised bot"""
+        await asyncio.gather(
+            *(self.remove_bot(key) for key in list(self.bots)),
+            return_exceptions=True,
+        )
+
+    def health(self) -> Dict[str, dict]:
+        """Return per-bot health information"""
+        now = time.monotonic()
+        report = {}
+        for key, entry in self.bots.items():
+            report[key] = {
+                'state': entry.state,
+                'restarts': entry.restarts,
+                'last_error': entry.last_error,
+                'uptime': round(now - entry.started_at, 1) if entry.started_at else 0,
+            }
+        return report
+
+    def memory_per_bot(self) -> Optional[int]:
+        """Average traced memory (bytes) per running bot, if measuring is enabled"""
+        if not self.measure_memory or not tracemalloc.is_tracing():
+            return None
+        running = sum(1 for entry in self.bots.values() if entry.state == STATE_RUNNING)
+        if not running:
+            return None
+        current = tracemalloc.get_traced_memory()[0]
+        return max(current - self._memory_baseline, 0) // running
+
+    def log_health(self):
+        """Log a one-line summary of the fleet state"""
+        states = {}
+        for entry in self.bots.values():
+            states[entry.state] = states.get(entry.state, 0) + 1
+        summary = ', '.join(f"{state}={count}" for state, count in sorted(states.items()))
+        message = f"Bot supervisor: {len(self.bots)} bots ({summary or 'none'})"
+        per_bot = self.memory_per_bot()
+        if per_bot is not None:
+            message += f", ~{per_bot / 1024:.1f} KiB per bot"
+        logger.info(message)
+
+    async def _supervise(self, entry: ManagedBot, delay: float = 0.0):
+        """Keep one bot polling, restarting it with backoff when it crashes"""
+        if delay:
+            await asyncio.sleep(delay)
+
+        while not entry.stop_event.is_set():
+            entry.state = STATE_STARTING
+            try:
+                entry.bot = entry.factory(self.request, self.get_updates_request)
+                async with self._startup_semaphore:
+                    await entry.bot.run()
+
+                entry.state = STATE_RUNNING
+                entry.started_at = time.monotonic()
+                logger.info(f"Started bot {entry.key}")
+
+                while not entry.stop_event.is_set():
+                    updater = entry.bot.application.updater
+                    if not updater or not updater.running:
+                        raise RuntimeError('Updater stopped unexpectedly')
+                    try:
+                        await asyncio.wait_for(entry.stop_event.wait(), timeout=self.health_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                await self._shutdown_bot(entry)
+                raise
+            except Exception as e:
+                entry.restarts += 1
+                entry.last_error = str(e)
+                entry.state = STATE_BACKOFF
+                entry.started_at = None
+                await self._shutdown_bot(entry)
+
+                delay = min(self.backoff_base * 2 ** min(entry.restarts - 1, 16), self.backoff_max)
+                delay += random.uniform(0, delay / 2)
+                logger.error(f"Bot {entry.key} crashed ({str(e)}), restarting in {delay:.1f}s")
+                try:
+                    await asyncio.wait_for(entry.stop_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        await self._shutdown_bot(entry)
+        entry.state = STATE_STOPPED
+
+    async def _shutdown_bot(self, entry: ManagedBot):
+        """Stop a bot application regardless of how far its startup got"""
+        if entry.bot is None:
+            return
+        application = entry.bot.application
+        try:
+            if application.updater and application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+        except Exception as e:
+            logger.error(f"Error shutting down bot {entry.key}: {str(e)}")
+        entry.bot = None
+
+    def _refresh_bot_object(self, bot, obj):
+        if isinstance(obj, Salon):
+            bot.salon = obj
+        else:
+            bot.user = obj
+
+    @sync_to_async
+    def _load_targets(self):
+        """Load {key: (token, model instance, factory)} for every bot that should run"""
+        from .bot import SalonifyBot
+        from .client_bot import SalonClientBot
+
+        targets = {}
+
+        salons = Salon.objects.exclude(telegram_bot_token='')
+        for salon in salons:
+            targets[f"salon:{salon.id}"] = (
+                salon.telegram_bot_token,
+                salon,
+                lambda request, get_updates_request, salon=salon: SalonClientBot(
+                    salon, request=request, get_updates_request=get_updates_request
+                ),
+            )
+
+        if self.include_admin_bots:
+            users = User.objects.exclude(telegram_bot_token='')
+            for user in users:
+                targets[f"user:{user.id}"] = (
+                    user.telegram_bot_token,
+                    user,
+                    lambda request, get_updates_request, user=user: SalonifyBot(
+                        user.telegram_bot_token, user,
+                        request=request, get_updates_request=get_updates_request
+                    ),
+                )
+
+        return targets
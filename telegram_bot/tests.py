@@ -0,0 +1,297 @@
+import asyncio
+import os
+import random
+import secrets
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from telegram import Update
+
+from core.catalog import catalog_cache
+from core.models import Salon, Master, Service, Client, Appointment, UserSession
+from core.retrieval import retrieval_service
+from telegram_bot.answering import SemanticAnswerCache, answer_question
+from telegram_bot.client_bot import SalonClientBot
+from telegram_bot.loadtest.fake_api import FakeBotAPI
+from telegram_bot.loadtest.runner import run_load
+from telegram_bot.loadtest.scenarios import UpdateFactory, build_script, create_fixtures
+from telegram_bot.views import get_bot_id, process_salon_client_update
+from telegram_bot.webhooks import webhook_router
+
+User = get_user_model()
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def update_data(update_id: int, text=None, callback_data=None) -> dict:
+    """Raw Telegram update from client 424242: a message, or a button press under one"""
+    user = {'id': 424242, 'is_bot': False, 'first_name': 'Клиент', 'language_code': 'ru'}
+    message = {
+        'message_id': update_id,
+        'from': user,
+        'chat': {'id': 424242, 'first_name': 'Клиент', 'type': 'private'},
+        'date': int(time.time()),
+        'text': text or '...',
+    }
+    if callback_data is not None:
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'message': message,
+                'chat_instance': '424242',
+                'data': callback_data,
+            },
+        }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnswerQuestionTests(TransactionTestCase):
+    """answer_question against FakeBotAPI standing in for OpenAI"""
+
+    def setUp(self):
+        self.fake_api = FakeBotAPI(seed=1).start()
+        self.addCleanup(self.fake_api.stop)
+        settings_override = override_settings(OPENAI_BASE_URL=self.fake_api.openai_url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        owner = User.objects.create_user(username=f"owner_{secrets.token_hex(4)}", password=secrets.token_urlsafe(16))
+        # A fresh key per test, so no pooled client points at an older fake server
+        self.salon = Salon.objects.create(
+            user=owner,
+            name='Тестовый салон',
+            address='ул. Тестовая, 1',
+            phone='+79990000000',
+            working_hours={'text': 'Пн-Вс 10:00-21:00'},
+            openai_api_key=f"sk-test-{secrets.token_hex(8)}",
+        )
+
+    def use_cache(self, **kwargs):
+        cache = SemanticAnswerCache(**kwargs)
+        patcher = mock.patch('telegram_bot.answering.answer_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cache
+
+    def ask(self, question):
+        return asyncio.run(answer_question(self.salon.id, question))
+
+    def test_answers_from_llm(self):
+        self.use_cache()
+
+        answer = self.ask('Сколько стоит стрижка?')
+
+        self.assertIsNotNone(answer)
+        self.assertFalse(answer.cached)
+        self.assertEqual(answer.text, 'Тестовый ответ нагрузочного стенда.')
+        calls = self.fake_api.stats()['calls']
+        self.assertEqual(calls.get('openai:embeddings'), 1)
+        self.assertEqual(calls.get('openai:chat/completions'), 1)
+
+    def test_repeated_question_is_served_from_cache(self):
+        self.use_cache()
+
+        first = self.ask('Сколько стоит стрижка?')
+        second = self.ask('  сколько СТОИТ стрижка? ')
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(second.text, first.text)
+        calls = self.fake_api.stats()['calls']
+        self.assertEqual(calls.get('openai:embeddings'), 1)
+        self.assertEqual(calls.get('openai:chat/completions'), 1)
+
+    def test_similar_question_is_served_from_semantic_cache(self):
+        # Any embedding counts as similar, so the second question skips the LLM
+        self.use_cache(threshold=-1.0)
+
+        first = self.ask('Сколько стоит стрижка?')
+        second = self.ask('Какая цена у стрижки?')
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        calls = self.fake_api.stats()['calls']
+        self.assertEqual(calls.get('openai:embeddings'), 2)
+        self.assertEqual(calls.get('openai:chat/completions'), 1)
+
+    def test_catalog_change_drops_cached_answers(self):
+        self.use_cache(threshold=-1.0)
+
+        self.ask('Сколько стоит стрижка?')
+        catalog_cache.bump(self.salon.id)
+        second = self.ask('Сколько стоит стрижка?')
+
+        self.assertFalse(second.cached)
+        self.assertEqual(self.fake_api.stats()['calls'].get('openai:chat/completions'), 2)
+
+    def test_reindex_drops_cached_answers(self):
+        self.use_cache(threshold=-1.0)
+
+        self.ask('Сколько стоит стрижка?')
+        retrieval_service.invalidate(self.salon.id)
+        second = self.ask('Сколько стоит стрижка?')
+
+        self.assertFalse(second.cached)
+        self.assertEqual(self.fake_api.stats()['calls'].get('openai:chat/completions'), 2)
+
+    def test_returns_none_without_api_key(self):
+        self.use_cache()
+        Salon.objects.filter(id=self.salon.id).update(openai_api_key='')
+
+        self.assertIsNone(self.ask('Сколько стоит стрижка?'))
+        self.assertEqual(self.fake_api.stats()['calls'], {})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class EventLoopORMTests(TransactionTestCase):
+    """Bot handlers must run every query on db_executor threads, never on the event loop"""
+
+    def setUp(self):
+        self.fake_api = FakeBotAPI(seed=1).start()
+        self.addCleanup(self.fake_api.stop)
+        settings_override = override_settings(TELEGRAM_API_URL=self.fake_api.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        owner = User.objects.create_user(username=f"owner_{secrets.token_hex(4)}", password=secrets.token_urlsafe(16))
+        self.salon = Salon.objects.create(
+            user=owner,
+            name='Тестовый салон',
+            address='ул. Тестовая, 1',
+            phone='+79990000000',
+            working_hours={'text': 'Пн-Вс 10:00-21:00'},
+            telegram_bot_token=f"{secrets.randbelow(10 ** 9)}:{secrets.token_urlsafe(24)}",
+        )
+        master = Master.objects.create(salon=self.salon, full_name='Мастер', phone='+79990000001')
+        self.service = Service.objects.create(
+            salon=self.salon, master=master, name='Стрижка', category='hair',
+            price=Decimal('1000'), duration_minutes=60,
+        )
+        self.update_id = 0
+
+    def make_update(self, bot, text=None, callback_data=None) -> Update:
+        self.update_id += 1
+        return Update.de_json(update_data(self.update_id, text, callback_data), bot.application.bot)
+
+    def test_handlers_do_not_query_on_the_loop_thread(self):
+        on_loop = []
+
+        def fail_on_loop(execute, sql, params, many, context):
+            # connection is this thread's; the loop below runs on this thread too
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                on_loop.append(sql)
+            return execute(sql, params, many, context)
+
+        async def run_updates():
+            bot = SalonClientBot(self.salon)
+            await bot.application.initialize()
+            try:
+                for text in ('/start', '/help', '/services', '/book', '/my_appointments', '/contact'):
+                    await bot.application.process_update(self.make_update(bot, text=text))
+                await bot.application.process_update(
+                    self.make_update(bot, callback_data=f"book_service_{self.service.id}")
+                )
+            finally:
+                await bot.application.shutdown()
+
+        # Let queries on the loop reach the wrapper instead of failing inside the handler
+        with mock.patch.dict(os.environ, {'DJANGO_ALLOW_ASYNC_UNSAFE': 'true'}):
+            with connection.execute_wrapper(fail_on_loop):
+                asyncio.run(run_updates())
+
+        self.assertEqual(on_loop, [])
+        self.assertGreater(self.fake_api.stats()['calls'].get('sendMessage', 0), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WebhookBookingTests(TransactionTestCase):
+    """Booking through the client bot webhook, where every update gets a new bot"""
+
+    def setUp(self):
+        self.fake_api = FakeBotAPI(seed=1).start()
+        self.addCleanup(self.fake_api.stop)
+        settings_override = override_settings(TELEGRAM_API_URL=self.fake_api.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        owner = User.objects.create_user(username=f"owner_{secrets.token_hex(4)}", password=secrets.token_urlsafe(16))
+        self.salon = Salon.objects.create(
+            user=owner,
+            name='Тестовый салон',
+            address='ул. Тестовая, 1',
+            phone='+79990000000',
+            working_hours={'text': 'Пн-Вс 10:00-21:00'},
+            telegram_bot_token=f"{secrets.randbelow(10 ** 9)}:{secrets.token_urlsafe(24)}",
+        )
+        self.master = Master.objects.create(salon=self.salon, full_name='Мастер', phone='+79990000001')
+        self.service = Service.objects.create(
+            salon=self.salon, master=self.master, name='Стрижка', category='hair',
+            price=Decimal('1000'), duration_minutes=60,
+        )
+        Client.objects.create(salon=self.salon, full_name='Клиент', phone='+79990000002', telegram_id='424242')
+        self.bot_id = get_bot_id(self.salon.telegram_bot_token)
+
+    def deliver(self, data):
+        process_salon_client_update(self.salon, data)
+
+    def test_redelivered_booking_creates_one_appointment(self):
+        self.deliver(update_data(1, callback_data=f"book_service_{self.service.id}"))
+        self.deliver(update_data(2, callback_data=f"book_master_{self.master.id}"))
+        session = UserSession.objects.get_active(self.bot_id, 424242)
+        self.assertEqual(session.session_data['booking_data']['step'], 'select_date')
+
+        scheduled_at = (timezone.localtime() + timedelta(days=3)).strftime('%d.%m.%Y 14:30')
+        date_update = update_data(3, text=scheduled_at)
+        self.deliver(date_update)
+        self.assertEqual(Appointment.objects.filter(salon=self.salon).count(), 1)
+        self.assertIsNone(UserSession.objects.get_active(self.bot_id, 424242))
+
+        # Telegram redelivers the update as if the first attempt had failed after booking
+        UserSession.objects.upsert(self.bot_id, 424242, session.session_data)
+        self.deliver(date_update)
+
+        self.assertEqual(Appointment.objects.filter(salon=self.salon).count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LoadTestRunnerTests(TransactionTestCase):
+    """run_load must report what the handlers did, not just HTTP statuses"""
+
+    def setUp(self):
+        self.fake_api = FakeBotAPI(seed=1).start()
+        self.addCleanup(self.fake_api.stop)
+        settings_override = override_settings(
+            TELEGRAM_API_URL=self.fake_api.url, OPENAI_BASE_URL=self.fake_api.openai_url,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_book_scenario_creates_appointments(self):
+        rng = random.Random(1)
+        users = create_fixtures(1, 4, rng)
+        webhook_router.invalidate()
+        factory = UpdateFactory()
+        for user in users:
+            user.scenario = 'book'
+            user.updates = build_script(user, factory, rng)
+
+        report = run_load(users, 2, self.fake_api)
+
+        self.assertEqual(report.handler_errors, 0, report.outcomes)
+        self.assertEqual(report.outcomes['book'].get('ok'), sum(len(user.updates) for user in users))
+        self.assertEqual((report.bookings_created, report.bookings_expected), (4, 4))
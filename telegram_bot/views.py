@@ -1,6 +1,9 @@
-import json
 import logging
 import asyncio
+import copy
+import random
+from typing import Optional
+from django.conf import settings
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
@@ -10,43 +13,68 @@ from django.shortcuts import get_object_or_404
 from telegram import Update
 from telegram.ext import ContextTypes
 from .bot import get_or_create_bot, start_bot_for_user, stop_bot_for_user
+from .dedup import update_deduplicator
+from .replies import InlineReplyRequest, collect_reply, current_collector, reply_stats
+from .webhooks import ALLOWED_UPDATES, get_webhook_url, get_webhook_secret, webhook_router
+from core import fastjson
+from core.instrumentation import current_trace, instrumented_handler, stage, trace_update
 from core.models import Salon, UserSession
+from core.openai_clients import openai_clients
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
-def get_user_session(telegram_user_id):
-    """Get user session data from database"""
-    try:
-        session = UserSession.objects.get(user_id=telegram_user_id)
-        return session.session_data
-    except UserSession.DoesNotExist:
-        return {}
-
-def set_user_session(telegram_user_id, data):
-    """Set user session data in database"""
-    session, created = UserSession.objects.get_or_create(
-        user_id=telegram_user_id,
-        defaults={'session_data': data}
-    )
-    if not created:
-        session.session_data = data
-        session.save()
-
-def clear_user_session(telegram_user_id):
+def get_bot_id(bot_token):
+    """Extract numeric bot id from a Telegram bot token ('<id>:<secret>')"""
+    bot_id = bot_token.split(':', 1)[0]
+    return int(bot_id) if bot_id.isdigit() else 0
+
+def get_user_session(bot_id, telegram_user_id):
+    """Get user session data and its version (None without a session) from database"""
+    with stage('session'):
+        session = UserSession.objects.get_active(bot_id, telegram_user_id)
+    if session is None:
+        return {}, None
+    return session.session_data, session.version
+
+def set_user_session(bot_id, telegram_user_id, data, expected_version=None):
+    """
+    Set user session data in database with a single upsert.
+
+    With expected_version the write only applies if nobody changed the
+    session since it was read; returns the new version or None if it was stale.
+    """
+    with stage('session'):
+        version = UserSession.objects.upsert(
+            bot_id, telegram_user_id, data, expected_version=expected_version
+        )
+    if version is None:
+        logger.info(f"Stale session write for telegram_user {telegram_user_id}, skipping update")
+    return version
+
+def clear_user_session(bot_id, telegram_user_id):
     """Clear user session data from database"""
-    UserSession.objects.filter(user_id=telegram_user_id).delete()
+    with stage('session'):
+        UserSession.objects.filter(bot_id=bot_id, user_id=telegram_user_id).delete()
 
-def start_salon_registration(telegram_user_id):
+def start_salon_registration(bot_id, telegram_user_id):
     """Start salon registration process"""
-    set_user_session(telegram_user_id, {
+    set_user_session(bot_id, telegram_user_id, {
         'state': 'salon_registration',
         'step': 'name',
         'salon_data': {}
     })
 
-def handle_salon_registration_step(bot, user, chat_id, text, session_data, telegram_user_id):
-    """Handle salon registration steps"""
+def save_registration_step(bot, chat_id, telegram_user_id, session_data, version) -> bool:
+    """Save a registration step; on a concurrent update ask the user to resend instead"""
+    if set_user_session(get_bot_id(bot.token), telegram_user_id, session_data, expected_version=version) is not None:
+        return True
+    send_message(bot, chat_id, "⚠️ Не удалось сохранить ответ: данные изменились одновременно с вашим сообщением. Пожалуйста, отправьте его еще раз.")
+    return False
+
+def handle_salon_registration_step(bot, user, chat_id, text, session_data, telegram_user_id, version=None):
+    """Handle salon registration steps; version guards each step against concurrent updates"""
+    bot_id = get_bot_id(bot.token)
     step = session_data.get('step')
     salon_data = session_data.get('salon_data', {})
     
@@ -56,35 +84,40 @@ def handle_salon_registration_step(bot, user, chat_id, text, session_data, teleg
         salon_data['name'] = text
         session_data['step'] = 'address'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, "📍 Введите адрес салона:")
         
     elif step == 'address':
         salon_data['address'] = text
         session_data['step'] = 'phone'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, "📞 Введите телефон салона:")
         
     elif step == 'phone':
         salon_data['phone'] = text
         session_data['step'] = 'email'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, "📧 Введите email салона:")
         
     elif step == 'email':
         salon_data['email'] = text
         session_data['step'] = 'working_hours'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, "🕐 Введите часы работы (например: Пн-Пт 9:00-18:00, Сб 10:00-16:00):")
         
     elif step == 'working_hours':
         salon_data['working_hours'] = text
         session_data['step'] = 'telegram_bot_token'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, """
 🤖 Введите токен Telegram бота для клиентов салона:
 
@@ -113,7 +146,8 @@ def handle_salon_registration_step(bot, user, chat_id, text, session_data, teleg
         salon_data['telegram_bot_token'] = text
         session_data['step'] = 'telegram_bot_username'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, """
 🤖 Введите username Telegram бота (без @):
 
@@ -127,7 +161,8 @@ def handle_salon_registration_step(bot, user, chat_id, text, session_data, teleg
         salon_data['telegram_bot_username'] = username
         session_data['step'] = 'openai_api_key'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         send_message(bot, chat_id, """
 🔑 Введите API ключ OpenAI:
 
@@ -157,7 +192,8 @@ sk-proj-abc123def456ghi789jkl...
         salon_data['openai_api_key'] = text
         session_data['step'] = 'confirmation'
         session_data['salon_data'] = salon_data
-        set_user_session(telegram_user_id, session_data)
+        if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+            return
         
         # Show summary and ask for confirmation
         summary_message = f"""
@@ -178,6 +214,10 @@ sk-proj-abc123def456ghi789jkl...
         
     elif step == 'confirmation':
         if text.lower() in ['да', 'yes', 'y', 'д']:
+            # Claim the step first so a repeated confirmation cannot create a second salon
+            session_data['step'] = 'creating'
+            if not save_registration_step(bot, chat_id, telegram_user_id, session_data, version):
+                return
             # Create salon and new business user
             try:
                 import secrets
@@ -290,53 +330,132 @@ ID салона: {salon.id}
                 send_message(bot, chat_id, success_message.strip())
                 
                 # Clear session
-                clear_user_session(telegram_user_id)
+                clear_user_session(bot_id, telegram_user_id)
                 
             except Exception as e:
                 logger.error(f"Error creating salon: {str(e)}")
                 send_message(bot, chat_id, f"❌ Ошибка при создании салона: {str(e)}")
-                clear_user_session(telegram_user_id)
+                clear_user_session(bot_id, telegram_user_id)
         
         elif text.lower() in ['нет', 'no', 'n', 'н']:
             send_message(bot, chat_id, "❌ Регистрация отменена. Используйте /register_salon для повторной попытки.")
-            clear_user_session(telegram_user_id)
+            clear_user_session(bot_id, telegram_user_id)
         
         else:
             send_message(bot, chat_id, "Пожалуйста, ответьте 'да' или 'нет':")
 
 
+# Update types the bots handle
+HANDLED_UPDATE_TYPES = ('message', 'callback_query')
+
+
+def peek_update_type(update_data) -> Optional[str]:
+    """Handled type of a raw update, or None, without deserializing it"""
+    for update_type in HANDLED_UPDATE_TYPES:
+        if update_type in update_data:
+            return update_type
+    return None
+
+
+def log_update(route, update_data):
+    """Log a sample of incoming updates as one structured line each"""
+    if random.random() >= settings.TELEGRAM_UPDATE_LOG_SAMPLE_RATE:
+        return
+    
+    update_type = next((key for key in update_data if key != 'update_id'), None)
+    body = update_data.get(update_type) if isinstance(update_data.get(update_type), dict) else {}
+    message = body.get('message') or body
+    fields = {
+        'bot_id': route.bot_id,
+        'bot_kind': route.kind,
+        'update_id': update_data.get('update_id'),
+        'type': update_type,
+        'chat_id': (message.get('chat') or {}).get('id'),
+        'from_id': (body.get('from') or {}).get('id'),
+        'text_length': len((body.get('data') if update_type == 'callback_query' else message.get('text')) or ''),
+    }
+    if settings.TELEGRAM_UPDATE_LOG_PAYLOAD:
+        fields['payload'] = update_data
+    logger.info(f"Telegram update {fastjson.dumps(fields, default=str).decode('utf-8')}")
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def webhook(request, bot_token):
+def webhook(request, route_id):
     """Handle Telegram webhook updates"""
+    with trace_update('webhook'):
+        return handle_webhook(request, route_id)
+
+
+def handle_webhook(request, route_id):
+    """Route, verify and process one webhook update inside its trace"""
+    trace = current_trace()
+    
+    # Reject foreign requests before the body is parsed
+    legacy_url = False
+    with stage('routing'):
+        route = webhook_router.resolve(route_id)
+        if route is None and ':' in route_id and settings.TELEGRAM_WEBHOOK_ACCEPT_TOKEN_URLS:
+            route = webhook_router.resolve_token(route_id)
+            legacy_url = route is not None
+    if route is None:
+        trace.outcome = 'not_found'
+        return JsonResponse({'error': 'Bot not found'}, status=404)
+    trace.bot_kind, trace.bot_id = route.kind, route.bot_id
+    secret_token = request.headers.get('X-Telegram-Bot-Api-Secret-Token')
+    # Webhooks registered with the token in the URL predate secret tokens and are
+    # sent without the header; the token in the URL authenticates them instead
+    if not (legacy_url and secret_token is None) and not route.check_secret(secret_token):
+        logger.warning(f"Rejected webhook request with invalid secret token for bot {route.bot_id}")
+        trace.outcome = 'forbidden'
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    
+    bot_id, update_id = route.bot_id, None
     try:
         # Parse update
-        update_data = json.loads(request.body)
-        logger.info(f"Received update for bot_token {bot_token}: {update_data}")
-        
-        # Try to find admin user by bot token first
-        try:
-            user = User.objects.get(telegram_bot_token=bot_token)
-            logger.info(f"Found admin user {user.username} for token")
-            process_telegram_update(user, update_data)
-            return JsonResponse({'status': 'ok'})
-        except User.DoesNotExist:
-            pass
-        
-        # Try to find salon by bot token
-        try:
-            salon = Salon.objects.get(telegram_bot_token=bot_token)
-            logger.info(f"Found salon {salon.name} for token")
-            process_salon_client_update(salon, update_data)
-            return JsonResponse({'status': 'ok'})
-        except Salon.DoesNotExist:
-            pass
-        
-        logger.error(f"Bot token {bot_token} not found in users or salons")
+        with stage('deserialize'):
+            update_data = fastjson.loads(request.body)
+        log_update(route, update_data)
+        
+        # Acknowledge update types the bots ignore without building anything
+        if peek_update_type(update_data) is None:
+            trace.outcome = 'ignored'
+            return JsonResponse({'status': 'ignored'})
+        
+        # Telegram redelivers updates on timeouts; process each update_id once
+        update_id = trace.update_id = update_data.get('update_id')
+        if update_id is not None and not update_deduplicator.claim(bot_id, update_id):
+            logger.info(f"Duplicate update {update_id} for bot {bot_id} skipped")
+            trace.outcome = 'duplicate'
+            return JsonResponse({'status': 'duplicate'})
+        
+        if route.kind == 'admin':
+            with stage('routing'):
+                user = User.objects.filter(id=route.object_id, telegram_bot_token=route.token).first()
+            if user is not None:
+                with collect_reply(route.token) as collector:
+                    process_telegram_update(user, update_data)
+                return JsonResponse(collector.response() or {'status': 'ok'})
+        else:
+            with stage('routing'):
+                salon = Salon.objects.filter(id=route.object_id, telegram_bot_token=route.token).first()
+            if salon is not None:
+                with collect_reply(route.token) as collector:
+                    process_salon_client_update(salon, update_data)
+                return JsonResponse(collector.response() or {'status': 'ok'})
+        
+        # The bot was removed or its token changed since the routes were loaded
+        webhook_router.invalidate()
+        logger.error(f"Bot {bot_id} of webhook route {route_id} no longer exists")
+        trace.outcome = 'not_found'
         return JsonResponse({'error': 'Bot not found'}, status=404)
         
     except Exception as e:
         logger.error(f"Error processing webhook: {str(e)}")
+        trace.outcome = 'error'
+        # Let Telegram's retry of this update through
+        if update_id is not None:
+            update_deduplicator.release(bot_id, update_id)
         return JsonResponse({'error': 'Internal error'}, status=500)
 
 
@@ -346,10 +465,12 @@ def process_telegram_update(user, update_data):
         from .bot import SalonifyBot
         
         # Create bot instance
-        bot = SalonifyBot(user.telegram_bot_token, user)
+        with stage('setup'):
+            bot = SalonifyBot(user.telegram_bot_token, user)
         
         # Create Update object
-        update = Update.de_json(update_data, bot.application.bot)
+        with stage('deserialize'):
+            update = Update.de_json(update_data, bot.application.bot)
         
         # Handle different types of updates
         if update.message:
@@ -366,11 +487,13 @@ def process_salon_client_update(salon, update_data):
     try:
         from .client_bot import SalonClientBot
         
-        # Create client bot instance
-        bot = SalonClientBot(salon)
+        # Create client bot instance; its first reply can go back in the webhook response
+        with stage('setup'):
+            bot = SalonClientBot(salon, request=InlineReplyRequest(salon.telegram_bot_token))
         
         # Create Update object
-        update = Update.de_json(update_data, bot.application.bot)
+        with stage('deserialize'):
+            update = Update.de_json(update_data, bot.application.bot)
         
         # Handle different types of updates
         if update.message:
@@ -382,6 +505,7 @@ def process_salon_client_update(salon, update_data):
         logger.error(f"Error processing salon client update: {str(e)}")
 
 
+@instrumented_handler('admin')
 def handle_message_sync(bot, update, user):
     """Handle message synchronously"""
     try:
@@ -391,11 +515,12 @@ def handle_message_sync(bot, update, user):
         
         # Get or create user session data using Telegram user ID
         telegram_user_id = message.from_user.id
-        session_data = get_user_session(telegram_user_id)
+        bot_id = get_bot_id(bot.token)
+        session_data, session_version = get_user_session(bot_id, telegram_user_id)
         
         # Handle commands
         if text == '/start':
-            clear_user_session(telegram_user_id)
+            clear_user_session(bot_id, telegram_user_id)
             send_message(bot, chat_id, f"""
 👋 Добро пожаловать в Salonify Admin Bot, {message.from_user.first_name}!
 
@@ -426,7 +551,7 @@ def handle_message_sync(bot, update, user):
             """.strip())
             
         elif text == '/register_salon':
-            start_salon_registration(telegram_user_id)
+            start_salon_registration(bot_id, telegram_user_id)
             send_message(bot, chat_id, """
 🏪 Регистрация салона
 
@@ -434,10 +559,12 @@ def handle_message_sync(bot, update, user):
             """.strip())
             
         elif session_data.get('state') == 'salon_registration':
-            handle_salon_registration_step(bot, user, chat_id, text, session_data, telegram_user_id)
+            handle_salon_registration_step(
+                bot, user, chat_id, text, session_data, telegram_user_id, version=session_version
+            )
             
         elif text == '/create_bot':
-            clear_user_session(telegram_user_id)  # Clear any existing session
+            clear_user_session(bot_id, telegram_user_id)  # Clear any existing session
             send_message(bot, chat_id, """
 🤖 Создание бота для клиентов
 
@@ -452,7 +579,7 @@ def handle_message_sync(bot, update, user):
             """.strip())
             
         elif text == '/my_salons':
-            clear_user_session(telegram_user_id)  # Clear any existing session
+            clear_user_session(bot_id, telegram_user_id)  # Clear any existing session
             send_message(bot, chat_id, """
 🏪 Мои салоны
 
@@ -465,7 +592,7 @@ def handle_message_sync(bot, update, user):
             """.strip())
             
         elif text == '/salon_stats':
-            clear_user_session(telegram_user_id)  # Clear any existing session
+            clear_user_session(bot_id, telegram_user_id)  # Clear any existing session
             send_message(bot, chat_id, """
 📊 Статистика салона
 
@@ -501,6 +628,7 @@ def handle_message_sync(bot, update, user):
         logger.error(f"Error handling message: {str(e)}")
 
 
+@instrumented_handler('admin')
 def handle_callback_query_sync(bot, update, user):
     """Handle callback query synchronously"""
     try:
@@ -510,25 +638,52 @@ def handle_callback_query_sync(bot, update, user):
         logger.error(f"Error handling callback query: {str(e)}")
 
 
-def handle_client_message_sync(bot, update, salon):
-    """Handle message synchronously for client bots"""
+def run_client_handler(bot, update, handler):
+    """
+    Run a client bot handler on a fresh event loop.
+
+    The bot is rebuilt for every webhook request, so the user's
+    context.user_data (booking state) is loaded from UserSession before
+    the handler runs and saved back after it.
+    """
+    from telegram.ext import CallbackContext
+    
+    bot_id = get_bot_id(bot.token)
+    telegram_user_id = update.effective_user.id
+    session_data, session_version = get_user_session(bot_id, telegram_user_id)
+    
+    # Handlers mutate nested dicts in place, so compare against an untouched copy
+    context = CallbackContext.from_update(update, bot.application)
+    context.user_data.update(copy.deepcopy(session_data))
+    
+    # Run the async method synchronously
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    
+    async def handle_async():
+        try:
+            await handler(update, context)
+        finally:
+            await openai_clients.close_loop_clients()
+    
     try:
-        import asyncio
-        from telegram.ext import ContextTypes, CallbackContext
-        
-        # Create a simple context
-        context = CallbackContext(bot.application)
-        
-        # Run the async method synchronously
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def handle_async():
-            await bot.handle_message(update, context)
-        
         loop.run_until_complete(handle_async())
+    finally:
         loop.close()
-        
+    
+    user_data = dict(context.user_data)
+    if user_data == session_data:
+        return
+    if user_data:
+        set_user_session(bot_id, telegram_user_id, user_data, expected_version=session_version)
+    else:
+        clear_user_session(bot_id, telegram_user_id)
+
+
+def handle_client_message_sync(bot, update, salon):
+    """Handle message synchronously for client bots"""
+    try:
+        run_client_handler(bot, update, bot.dispatch_message)
     except Exception as e:
         logger.error(f"Error handling client message: {str(e)}")
 
@@ -536,22 +691,7 @@ def handle_client_message_sync(bot, update, salon):
 def handle_client_callback_query_sync(bot, update, salon):
     """Handle callback query synchronously for client bots"""
     try:
-        import asyncio
-        from telegram.ext import ContextTypes, CallbackContext
-        
-        # Create a simple context
-        context = CallbackContext(bot.application)
-        
-        # Run the async method synchronously
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        async def handle_async():
-            await bot.button_callback(update, context)
-        
-        loop.run_until_complete(handle_async())
-        loop.close()
-        
+        run_client_handler(bot, update, bot.button_callback)
     except Exception as e:
         logger.error(f"Error handling client callback query: {str(e)}")
 
@@ -564,12 +704,13 @@ def setup_client_bot_webhook(salon):
         logger.error(f"Salon {salon.name} has no bot token")
         return False
     
-    webhook_url = f"https://salonify-app-3cd2419b7b71.herokuapp.com/telegram/webhook/{salon.telegram_bot_token}/"
+    webhook_url = get_webhook_url(salon.telegram_bot_token)
     
-    url = f"https://api.telegram.org/bot{salon.telegram_bot_token}/setWebhook"
+    url = f"{settings.TELEGRAM_API_URL}/bot{salon.telegram_bot_token}/setWebhook"
     data = {
         'url': webhook_url,
-        'allowed_updates': ['message', 'callback_query']
+        'secret_token': get_webhook_secret(salon.telegram_bot_token),
+        'allowed_updates': ALLOWED_UPDATES
     }
     
     try:
@@ -587,25 +728,41 @@ def setup_client_bot_webhook(salon):
         return False
 
 
-def send_message(bot, chat_id, text):
-    """Send message using requests"""
+def call_bot_api(token, method, data):
+    """Call a Bot API method using requests"""
     import requests
     
-    url = f"https://api.telegram.org/bot{bot.token}/sendMessage"
+    url = f"{settings.TELEGRAM_API_URL}/bot{token}/{method}"
+    reply_stats['outbound'] += 1
+    
+    try:
+        with stage('outbound'):
+            response = requests.post(url, json=data)
+        if response.status_code == 200:
+            logger.info(f"{method} succeeded for chat {data.get('chat_id')}")
+        else:
+            logger.error(f"Failed to call {method}: {response.text}")
+    except Exception as e:
+        logger.error(f"Error calling {method}: {str(e)}")
+
+
+def send_message(bot, chat_id, text):
+    """Send message, as the webhook response when it is the only reply to the update"""
     data = {
         'chat_id': chat_id,
         'text': text,
         'parse_mode': 'HTML'
     }
     
-    try:
-        response = requests.post(url, json=data)
-        if response.status_code == 200:
-            logger.info(f"Message sent successfully to chat {chat_id}")
-        else:
-            logger.error(f"Failed to send message: {response.text}")
-    except Exception as e:
-        logger.error(f"Error sending message: {str(e)}")
+    collector = current_collector(bot.token)
+    if collector is not None:
+        held, previous = collector.hold('sendMessage', data)
+        if previous is not None:
+            call_bot_api(bot.token, previous[0], previous[1])
+        if held:
+            return
+    
+    call_bot_api(bot.token, 'sendMessage', data)
 
 
 @login_required
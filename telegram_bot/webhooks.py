@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from core.models import Salon
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ['message', 'callback_query']
+
+# Registration result statuses
+STATUS_UPDATED = 'updated'
+STATUS_UNCHANGED = 'unchanged'
+STATUS_REMOVED = 'removed'
+STATUS_FAILED = 'failed'
+
+
+def get_webhook_route_id(bot_token: str) -> str:
+    """Opaque per-bot id used in the webhook URL instead of the token"""
+    return hmac.new(
+        settings.SECRET_KEY.encode('utf-8'),
+        f"webhook-route:{bot_token}".encode('utf-8'),
+        hashlib.sha256,
+    ).hexdigest()[:32]
+
+
+def get_webhook_url(bot_token: str, base_url: Optional[str] = None) -> str:
+    """Public URL Telegram should deliver updates for this bot to"""
+    base_url = (base_url or settings.TELEGRAM_WEBHOOK_BASE_URL).rstrip('/')
+    return f"{base_url}/telegram/webhook/{get_webhook_route_id(bot_token)}/"
+
+
+def get_webhook_secret(bot_token: str) -> str:
+    """Per-bot secret_token sent back by Telegram in X-Telegram-Bot-Api-Secret-Token"""
+    return hmac.new(
+        settings.SECRET_KEY.encode('utf-8'),
+        bot_token.encode('utf-8'),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+@dataclass(frozen=True)
+class WebhookRoute:
+    """Bot a webhook request is addressed to"""
+    kind: str
+    object_id: object
+    token: str
+    secret: str
+
+    @property
+    def bot_id(self) -> int:
+        bot_id = self.token.split(':', 1)[0]
+        return int(bot_id) if bot_id.isdigit() else 0
+
+    def check_secret(self, secret_token: Optional[str]) -> bool:
+        """Constant-time check of the X-Telegram-Bot-Api-Secret-Token header"""
+        return hmac.compare_digest(self.secret.encode('utf-8'), (secret_token or '').encode('utf-8'))
+
+
+class WebhookRouter:
+    """
+    Maps webhook route ids to bots without touching the database per request.
+
+    The route table (admin bots of users and client bots of salons) is
+    loaded once per process. An unknown id triggers a reload at most every
+    refresh_interval seconds, so new bots are picked up quickly while
+    random ids cannot force a query per request; the table is also
+    reloaded after max_age. Admin bots win when a token is used twice, as
+    in the old token-based lookup.
+    """
+
+    def __init__(self, refresh_interval: float = 5.0, max_age: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._routes: Dict[str, WebhookRoute] = {}
+        self._by_token: Dict[str, WebhookRoute] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        bots = [
+            ('salon', pk, token)
+            for pk, token in Salon.objects.exclude(telegram_bot_token='').values_list('id', 'telegram_bot_token')
+        ] + [
+            ('admin', pk, token)
+            for pk, token in get_user_model().objects.exclude(telegram_bot_token='').values_list('id', 'telegram_bot_token')
+        ]
+
+        routes, by_token = {}, {}
+        for kind, pk, token in bots:
+            route = WebhookRoute(kind, pk, token, get_webhook_secret(token))
+            routes[get_webhook_route_id(token)] = route
+            by_token[token] = route
+        with self._lock:
+            self._routes, self._by_token = routes, by_token
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(routes)} webhook routes")
+
+    def _lookup(self, table: str, key: str) -> Optional[WebhookRoute]:
+        now = time.monotonic()
+        with self._lock:
+            loaded_at = self._loaded_at
+            route = getattr(self, table).get(key)
+        if loaded_at is None or now - loaded_at >= self.max_age or (
+            route is None and now - loaded_at >= self.refresh_interval
+        ):
+            self._load()
+            with self._lock:
+                route = getattr(self, table).get(key)
+        return route
+
+    def resolve(self, route_id: str) -> Optional[WebhookRoute]:
+        return self._lookup('_routes', route_id)
+
+    def resolve_token(self, bot_token: str) -> Optional[WebhookRoute]:
+        """Route for a webhook still registered with the raw token in its URL"""
+        return self._lookup('_by_token', bot_token)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+
+webhook_router = WebhookRouter()
+
+
+@dataclass
+class WebhookTarget:
+    """Bot whose webhook should be managed"""
+    name: str
+    token: str
+
+
+@dataclass
+class WebhookResult:
+    """Outcome of managing one bot's webhook"""
+    name: str
+    status: str
+    detail: str = ''
+    attempts: int = 0
+
+
+class TelegramAPIError(Exception):
+    pass
+
+
+class WebhookRegistrar:
+    """
+    Registers webhooks for many bots concurrently.
+
+    Requests are bounded by a semaphore, 429 responses are retried after
+    the retry_after Telegram returns, and network/5xx errors are retried
+    with exponential backoff. In diff mode getWebhookInfo is called first
+    and setWebhook is skipped for bots that are already configured.
+
+    Telegram does not return the secret token from getWebhookInfo, so a
+    rotated secret has to be pushed with diff mode disabled.
+    """
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        concurrency: int = 20,
+        max_retries: int = 5,
+        diff: bool = True,
+        max_connections: int = 40,
+        timeout: float = 10.0,
+        api_url: Optional[str] = None,
+    ):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.diff = diff
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.api_url = (api_url or settings.TELEGRAM_API_URL).rstrip('/')
+
+    def register_all(self, targets: Iterable[WebhookTarget]) -> List[WebhookResult]:
+        """Set webhooks for all targets, returning one result per target"""
+        return asyncio.run(self._run(targets, self._register))
+
+    def remove_all(self, targets: Iterable[WebhookTarget]) -> List[WebhookResult]:
+        """Delete webhooks for all targets, returning one result per target"""
+        return asyncio.run(self._run(targets, self._remove))
+
+    async def _run(self, targets, handler):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency,
+        )
+
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as client:
+            async def run_one(target):
+                async with semaphore:
+                    try:
+                        return await handler(client, target)
+                    except Exception as e:
+                        logger.error(f"Webhook update failed for {target.name}: {str(e)}")
+                        return WebhookResult(target.name, STATUS_FAILED, str(e))
+
+            return await asyncio.gather(*(run_one(target) for target in targets))
+
+    async def _register(self, client, target: WebhookTarget) -> WebhookResult:
+        url = get_webhook_url(target.token, self.base_url)
+        attempts = 0
+
+        if self.diff:
+            info, calls = await self._call(client, target.token, 'getWebhookInfo')
+            attempts += calls
+            if (
+                info.get('url') == url
+                and sorted(info.get('allowed_updates') or []) == sorted(ALLOWED_UPDATES)
+                and info.get('max_connections', self.max_connections) == self.max_connections
+            ):
+                return WebhookResult(target.name, STATUS_UNCHANGED, url, attempts)
+
+        _, calls = await self._call(client, target.token, 'setWebhook', {
+            'url': url,
+            'secret_token': get_webhook_secret(target.token),
+            'allowed_updates': ALLOWED_UPDATES,
+            'max_connections': self.max_connections,
+        })
+        attempts += calls
+        return WebhookResult(target.name, STATUS_UPDATED, url, attempts)
+
+    async def _remove(self, client, target: WebhookTarget) -> WebhookResult:
+        _, attempts = await self._call(client, target.token, 'deleteWebhook')
+        return WebhookResult(target.name, STATUS_REMOVED, '', attempts)
+
+    async def _call(self, client, token, method, payload=None):
+        """Call a Bot API method with retries; returns (result, attempts)"""
+        url = f"{self.api_url}/bot{token}/{method}"
+
+        for attempt in range(1, self.max_retries + 1):
+            delay = min(2 ** (attempt - 1), 30) + random.uniform(0, 0.5)
+            try:
+                response = await client.post(url, json=payload or {})
+            except httpx.HTTPError as e:
+                if attempt == self.max_retries:
+                    raise TelegramAPIError(f"{method}: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt == self.max_retries:
+                    raise TelegramAPIError(f"{method}: HTTP {response.status_code}")
+                if response.status_code == 429:
+                    try:
+                        retry_after = response.json().get('parameters', {}).get('retry_after')
+                    except ValueError:
+                        retry_after = None
+                    if retry_after:
+                        delay = retry_after
+                await asyncio.sleep(delay)
+                continue
+
+            result = response.json()
+            if not result.get('ok'):
+                raise TelegramAPIError(f"{method}: {result.get('description')}")
+            return result.get('result') or {}, attempt
+
+        raise TelegramAPIError(f"{method}: retries exhausted")
+
+
+def summarize(results: Iterable[WebhookResult]) -> Counter:
+    """Count results by status"""
+    return Counter(result.status for result in results)